@@ -0,0 +1,129 @@
+import math
+import threading
+import time
+from collections import deque
+
+class AdmissionRejected(Exception):
+    """队列已满或等待超时，retry_after 为建议的重试秒数"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    重计算接口的准入控制。
+
+    每个任务按上传大小和文件数估算成本，同时运行的任务总成本不超过 max_cost；
+    超出时进入有界 FIFO 等待队列，队列已满或等待超过 max_wait 秒则拒绝 (由路由返回 503 + Retry-After)。
+    """
+
+    def __init__(self, max_cost=4, max_queue=16, max_wait=120, bytes_per_unit=4 * 1024 * 1024):
+        self.max_cost = max(1, int(max_cost))
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.bytes_per_unit = bytes_per_unit
+
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._running = 0
+        self._running_cost = 0
+
+        # 统计信息
+        self._admitted = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+        self._avg_run = None  # 任务耗时的指数滑动平均
+
+    def estimate_cost(self, total_bytes, file_count=1):
+        """按上传字节数和文件数估算任务成本 (单位数)，不超过总容量"""
+        size_units = math.ceil((total_bytes or 0) / self.bytes_per_unit)
+        cost = max(1, size_units + max(file_count - 1, 0))
+        return min(cost, self.max_cost)
+
+    def _retry_after_locked(self):
+        avg_run = self._avg_run or 10.0
+        backlog = len(self._queue) + self._running
+        return max(1, int(math.ceil(avg_run * backlog / self.max_cost)))
+
+    def acquire(self, cost):
+        """申请执行名额，返回等待秒数；被拒绝时抛出 AdmissionRejected"""
+        ticket = object()
+        start = time.monotonic()
+        with self._cond:
+            if not self._queue and self._running_cost + cost <= self.max_cost:
+                self._admit_locked(cost, 0.0)
+                return 0.0
+
+            if len(self._queue) >= self.max_queue:
+                self._rejected += 1
+                raise AdmissionRejected("服务器繁忙，请稍后重试", self._retry_after_locked())
+
+            self._queue.append(ticket)
+            try:
+                deadline = start + self.max_wait
+                while not (self._queue[0] is ticket and self._running_cost + cost <= self.max_cost):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._rejected += 1
+                        raise AdmissionRejected("排队等待超时，请稍后重试", self._retry_after_locked())
+                    self._cond.wait(remaining)
+            finally:
+                self._queue.remove(ticket)
+                # 队首变化，唤醒其他等待者重新检查
+                self._cond.notify_all()
+
+            waited = time.monotonic() - start
+            self._admit_locked(cost, waited)
+            return waited
+
+    def _admit_locked(self, cost, waited):
+        self._running += 1
+        self._running_cost += cost
+        self._admitted += 1
+        self._total_wait += waited
+        self._max_wait_seen = max(self._max_wait_seen, waited)
+
+    def release(self, cost, duration=None):
+        with self._cond:
+            self._running -= 1
+            self._running_cost -= cost
+            if duration is not None:
+                self._avg_run = duration if self._avg_run is None else 0.8 * self._avg_run + 0.2 * duration
+            self._cond.notify_all()
+
+    def admit(self, cost):
+        """with 语句用法: with controller.admit(cost): ..."""
+        return _Admission(self, cost)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "running": self._running,
+                "running_cost": self._running_cost,
+                "max_cost": self.max_cost,
+                "queue_depth": len(self._queue),
+                "max_queue": self.max_queue,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "avg_wait_seconds": round(self._total_wait / self._admitted, 3) if self._admitted else 0.0,
+                "max_wait_seconds": round(self._max_wait_seen, 3),
+                "avg_run_seconds": round(self._avg_run, 3) if self._avg_run is not None else None,
+            }
+
+class _Admission:
+    def __init__(self, controller, cost):
+        self.controller = controller
+        self.cost = cost
+        self.waited = 0.0
+        self._start = None
+
+    def __enter__(self):
+        self.waited = self.controller.acquire(self.cost)
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.controller.release(self.cost, time.monotonic() - self._start)
+        return False
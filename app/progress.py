@@ -0,0 +1,106 @@
+import os
+import json
+import threading
+import time
+
+class ProgressBroker:
+    """
+    按任务分发进度事件 (供 /api/progress/<task_id> 的 SSE 使用)。
+
+    事件按任务追加写入共享目录中的 <task_id>.jsonl (每行一个事件)，订阅者轮询读取新增的行，
+    因此多个 worker 进程部署时，订阅请求落在哪个 worker 上都能收到事件。
+    计算线程调用 publish 只追加一行，不等待订阅者，慢客户端不会拖慢计算。
+    订阅时先补发已有事件，因此可以在任务开始前或进行中订阅，
+    断线重连时按 Last-Event-ID 只补发之后的事件。任务结束 (或最后一次发布) ttl 秒后删除事件文件。
+    """
+
+    def __init__(self, directory, ttl=600, poll_interval=0.25):
+        self.directory = directory
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self._seq = {}        # 本进程发布中的任务 {task_id: 最后一个事件 ID}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, task_id):
+        return os.path.join(self.directory, f"{task_id}.jsonl")
+
+    def _prune(self):
+        """删除已结束 (或长期无人发布) 的任务的事件文件"""
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def in_use(self, task_id):
+        """任务 ID 是否已经发布过事件 (任一 worker)"""
+        return os.path.exists(self._path(task_id))
+
+    def publish(self, task_id, event):
+        with self._lock:
+            if task_id not in self._seq:
+                self._prune()
+            seq = self._seq[task_id] = self._seq.get(task_id, 0) + 1
+            line = json.dumps(dict(event, id=seq), ensure_ascii=False) + "\n"
+            with open(self._path(task_id), 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def publisher(self, task_id):
+        """返回传给 processor / merger 的进度回调"""
+        return lambda event: self.publish(task_id, event)
+
+    def finish(self, task_id, **fields):
+        """发布 done 事件，订阅者收到后结束事件流"""
+        self.publish(task_id, dict(event='done', time=round(time.time(), 3), **fields))
+        with self._lock:
+            self._seq.pop(task_id, None)
+
+    def _read_new(self, task_id, offset):
+        """从 offset 起读取完整的事件行，返回 (事件列表, 新的 offset)；写了一半的行留到下次读取"""
+        try:
+            with open(self._path(task_id), 'rb') as f:
+                if os.fstat(f.fileno()).st_size < offset:
+                    # 事件文件被清理后重新创建：从头读取 (已发送的事件按 ID 跳过)
+                    offset = 0
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+        end = data.rfind(b"\n") + 1
+        events = [json.loads(line) for line in data[:end].decode('utf-8').splitlines() if line]
+        return events, offset + end
+
+    def stream(self, task_id, last_id=0, keepalive=15):
+        """
+        SSE 事件流生成器：每个事件输出 id / event / data 三行，空闲时发送注释行保持连接。
+        收到 done 事件，或超过 ttl 秒没有任何事件时结束。
+        """
+        offset = 0
+        idle = 0.0
+        since_keepalive = 0.0
+        yield "retry: 2000\n\n"
+        while True:
+            events, offset = self._read_new(task_id, offset)
+            if not events:
+                time.sleep(self.poll_interval)
+                idle += self.poll_interval
+                since_keepalive += self.poll_interval
+                if idle >= self.ttl:
+                    return
+                if since_keepalive >= keepalive:
+                    since_keepalive = 0.0
+                    yield ": keepalive\n\n"
+                continue
+            idle = 0.0
+            for event in events:
+                if event['id'] <= last_id:
+                    continue
+                last_id = event['id']
+                data = json.dumps(event, ensure_ascii=False)
+                yield f"id: {event['id']}\nevent: {event['event']}\ndata: {data}\n\n"
+                if event['event'] == 'done':
+                    return
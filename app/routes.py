@@ -1,16 +1,310 @@
 import os
+import re
+import time
 import uuid
+import pickle
 import shutil
+import tempfile
 import json
-from flask import request, jsonify, render_template, send_from_directory
-from core.processor import process_hospital_data
-from core.merger import merge_excel_files
-from core.config_loader import load_group_config
+import hmac
+import hashlib
+from contextlib import contextmanager
+from urllib.parse import quote
+from flask import Response, request, jsonify, render_template, send_from_directory, after_this_request
+from core.processor import INPUT_FORMATS, compute_hospital_data, write_processed_excel
+from core.merger import compute_merge, write_merge_result
+from core.streaming import process_hospital_data_streaming
+from core.compare import compute_comparison, comparison_to_json, write_comparison_excel, default_label
+from core.batch import file_sha256
+from core.cube import PeriodCube, CubeError, range_to_json
+from core.config_loader import load_group_config, get_processor_config, parse_group_config
+from core.projection import Projection
+from core.progress import emit, stage
+from core.profiling import Profiler
+from core.result_store import ResultStore, SingleFlight
+from core.summary import build_summary, paginate_summary
+from core import results_db, money
+from app.admission import AdmissionController, AdmissionRejected
+from app.uploads import ChunkedUploads, UploadError
+from app.progress import ProgressBroker
 
 def register_routes(app):
     # 配置从 app 对象获取（假设在 app.py 中定义）
     UPLOAD_FOLDER = app.config['UPLOAD_FOLDER']
     DOWNLOAD_FOLDER = app.config['DOWNLOAD_FOLDER']
+    RESULTS_DB = app.config.get('RESULTS_DB')
+    CUBE_DIR = app.config.get('CUBE_DIR')
+    # 汇总接口默认的费用项目排行数量 (只缓存该数量的汇总)
+    SUMMARY_TOP_N = 20
+    # 下载目录下的临时写入目录 (与正式文件同一文件系统，保证重命名是原子的)
+    STAGING_DIRNAME = '.staging'
+
+    # 按任务缓存内存计算结果，供汇总接口使用
+    result_store = ResultStore(
+        max_items=app.config.get('RESULT_CACHE_SIZE', 32),
+        max_bytes=app.config.get('RESULT_CACHE_BYTES')
+    )
+    # 延迟生成模式下待生成的任务结果保存在下载目录的 .pending 中 (多个 worker 共享)，
+    # 任一 worker 收到首次下载时都能生成；超过 LAZY_OUTPUT_TTL 秒未下载的丢弃
+    PENDING_DIRNAME = '.pending'
+    PENDING_TTL = app.config.get('LAZY_OUTPUT_TTL', 24 * 3600)
+    PENDING_NAME_PATTERN = re.compile(r'^[0-9a-f-]+\.xlsx$')
+    render_flight = SingleFlight()
+    # 期间对比结果按输入文件哈希缓存，相同的输入组合不重复计算
+    compare_cache = ResultStore(max_items=app.config.get('COMPARE_CACHE_SIZE', 16))
+    compare_flight = SingleFlight()
+    # 可续传的分块上传 (突破单次请求大小限制)
+    chunked_uploads = ChunkedUploads(
+        UPLOAD_FOLDER,
+        max_bytes=app.config.get('CHUNKED_UPLOAD_MAX_BYTES', 2 * 1024 * 1024 * 1024),
+        ttl=app.config.get('CHUNKED_UPLOAD_TTL', 24 * 3600),
+        complete_ttl=app.config.get('CHUNKED_UPLOAD_COMPLETE_TTL')
+    )
+    # 处理/合并任务的进度事件 (SSE)，事件文件在多个 worker 间共享
+    progress = ProgressBroker(app.config.get('PROGRESS_DIR', os.path.join(UPLOAD_FOLDER, 'progress')),
+                              ttl=app.config.get('PROGRESS_TTL', 600))
+    # 按需性能剖析 (管理员请求头或全局 PROFILE_REQUESTS 开启)
+    profiler = Profiler(
+        app.config.get('PROFILE_DIR', os.path.join(UPLOAD_FOLDER, 'profiles')),
+        top_n=app.config.get('PROFILE_TOP_N', 30),
+        keep=app.config.get('PROFILE_KEEP', 50)
+    )
+    # 月度处理结果的期间立方体 (任意月份区间的合计)
+    cube = PeriodCube(CUBE_DIR) if CUBE_DIR else None
+    # 处理/合并接口的准入控制
+    admission = AdmissionController(
+        max_cost=app.config.get('ADMISSION_MAX_COST', os.cpu_count() or 2),
+        max_queue=app.config.get('ADMISSION_MAX_QUEUE', 16),
+        max_wait=app.config.get('ADMISSION_MAX_WAIT', 120),
+        bytes_per_unit=app.config.get('ADMISSION_BYTES_PER_UNIT', 4 * 1024 * 1024)
+    )
+
+    def _task_id():
+        """
+        客户端可以预先生成任务 ID (task_id，UUID)，在提交前订阅 /api/progress/<task_id>。
+        返回 (task_id, 错误响应)，未提供时生成新的 ID。
+        """
+        task_id = request.form.get('task_id')
+        if not task_id:
+            return str(uuid.uuid4()), None
+        try:
+            task_id = str(uuid.UUID(task_id))
+        except ValueError:
+            return None, (jsonify({"error": "无效的任务 ID"}), 400)
+        if progress.in_use(task_id) or result_store.get(task_id) is not None:
+            return None, (jsonify({"error": "任务 ID 已被使用"}), 409)
+        return task_id, None
+
+    def _track(task_id):
+        """返回任务的进度回调，并在响应返回时发布 done 事件 (成功或失败)"""
+        @after_this_request
+        def _finish(response):
+            body = response.get_json(silent=True) or {}
+            progress.finish(task_id, status='ok' if response.status_code < 400 else 'error',
+                            http_status=response.status_code, error=body.get('error'),
+                            download_url=body.get('download_url'), summary_url=body.get('summary_url'))
+            return response
+        return progress.publisher(task_id)
+
+    def _is_admin():
+        # 管理员令牌通过 X-Admin-Token 请求头提供；未配置 ADMIN_TOKEN 时没有管理员
+        token = app.config.get('ADMIN_TOKEN')
+        supplied = request.headers.get('X-Admin-Token', '')
+        return bool(token) and hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8'))
+
+    @contextmanager
+    def _profile_request(label, **meta):
+        """
+        管理员请求 (X-Profile: 1 且令牌正确) 或 PROFILE_REQUESTS 开启时剖析本次计算，
+        响应头 X-Profile-Id 返回剖析 ID，可通过 /api/admin/profiles/<profile_id> 查看。
+        """
+        wanted = app.config.get('PROFILE_REQUESTS') or (request.headers.get('X-Profile') == '1' and _is_admin())
+        if not wanted:
+            yield
+            return
+        with profiler.capture(label, **meta) as info:
+            yield
+
+        @after_this_request
+        def _add_header(response):
+            if info['profile_id']:
+                response.headers['X-Profile-Id'] = info['profile_id']
+            elif info['skipped']:
+                response.headers['X-Profile-Skipped'] = '1'
+            return response
+
+    def _busy_response(e):
+        response = jsonify({"error": str(e), "retry_after": e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
+
+    def _is_view_only():
+        # mode=summary 表示仅查看汇总，跳过 xlsx 写出
+        return request.form.get('mode') == 'summary'
+
+    def _is_lazy():
+        # lazy=1 (或全局 LAZY_OUTPUT) 表示先返回预览，首次下载时再生成 xlsx
+        lazy = request.form.get('lazy')
+        if lazy is None:
+            return app.config.get('LAZY_OUTPUT', False)
+        return lazy.lower() in ('1', 'true', 'yes')
+
+    def _is_exact():
+        # exact=1 (或全局 EXACT_MONEY) 表示金额按分精确累加，exact=strict 时遇到不足一分的金额报错；
+        # 无法识别的取值抛出 ValueError (接口返回 400)
+        exact = request.form.get('exact')
+        if exact is None:
+            return money.parse_exact(app.config.get('EXACT_MONEY', False))
+        return money.parse_exact(exact)
+
+    def _projection(custom_config=None):
+        """
+        请求级投影 (groups / items / departments / dept_pattern，可重复或逗号分隔)。
+        dept_pattern 按包含的文本匹配科室，只有管理员请求按正则表达式匹配。
+        未指定时返回 None，参数无效 (如未知的分组) 时抛出 ValueError。
+        """
+        projection = Projection(groups=request.form.getlist('groups'),
+                                items=request.form.getlist('items'),
+                                departments=request.form.getlist('departments'),
+                                dept_pattern=request.form.get('dept_pattern'),
+                                dept_regex=_is_admin())
+        if not projection:
+            return None
+        group_summaries, item_to_group = parse_group_config(custom_config) if custom_config else get_processor_config()
+        return projection.resolve(group_summaries, item_to_group)
+
+    def _is_wide():
+        # wide=1 表示按文件名中的年月分期，每个期间一组列 (分期宽表)
+        return request.form.get('wide', '').lower() in ('1', 'true', 'yes')
+
+    def _use_streaming(src_path, upload_size):
+        # stream=1 或 xlsx 超过 STREAMING_THRESHOLD_BYTES 时使用流式处理
+        if not src_path.lower().endswith('.xlsx'):
+            return False
+        stream = request.form.get('stream')
+        if stream is not None:
+            return stream.lower() in ('1', 'true', 'yes')
+        threshold = app.config.get('STREAMING_THRESHOLD_BYTES')
+        return bool(threshold) and upload_size > threshold
+
+    def _build_preview(result):
+        """取结果前 N 行作为预览 (NaN 转为 null)"""
+        n = app.config.get('PREVIEW_ROWS', 20)
+        try:
+            n = int(request.form.get('preview_rows', n))
+        except ValueError:
+            pass
+        preview = json.loads(result['df'].head(max(n, 0)).to_json(orient='split', index=False, force_ascii=False))
+        return {"columns": preview['columns'], "rows": preview['data']}
+
+    def _write_result(result, output_path):
+        if result['kind'] == 'process':
+            return write_processed_excel(result, output_path)
+        return write_merge_result(result, output_path)
+
+    def _stored_name(task_id):
+        # 下载目录中的文件名按任务唯一，避免同名文件互相覆盖
+        return f"{task_id}.xlsx"
+
+    def _download_url(task_id, friendly_name):
+        return f"/api/download/{_stored_name(task_id)}?name={quote(friendly_name)}"
+
+    def _publish(task_id, result, writer=None):
+        """
+        先写入下载目录下按任务隔离的临时路径，写完后原子重命名为正式文件名，
+        保证下载永远不会读到写了一半的文件。
+        writer(path) 可替代默认的结果写出函数 (如流式处理直接写文件)。
+        每次调用使用独立的临时目录：同一任务 ID 可能被并发生成 (相同输入的对比、区间汇总，
+        或多个 worker 同时处理首次下载)，各自写完后重命名到同一正式文件名，互不干扰。
+        """
+        staging_root = os.path.join(DOWNLOAD_FOLDER, STAGING_DIRNAME)
+        os.makedirs(staging_root, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix=f"{task_id}.", dir=staging_root)
+        staging_path = os.path.join(staging_dir, _stored_name(task_id))
+        try:
+            written = writer(staging_path) if writer else _write_result(result, staging_path)
+            if not written:
+                return False
+            os.replace(staging_path, os.path.join(DOWNLOAD_FOLDER, _stored_name(task_id)))
+            return True
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def _pending_path(filename):
+        """待生成结果的路径；只接受下载目录中的任务文件名 (不含路径)"""
+        if not PENDING_NAME_PATTERN.match(filename):
+            return None
+        return os.path.join(DOWNLOAD_FOLDER, PENDING_DIRNAME, os.path.splitext(filename)[0] + '.pkl')
+
+    def _prune_pending():
+        pending_dir = os.path.join(DOWNLOAD_FOLDER, PENDING_DIRNAME)
+        if not os.path.isdir(pending_dir):
+            return
+        now = time.time()
+        for name in os.listdir(pending_dir):
+            path = os.path.join(pending_dir, name)
+            try:
+                if now - os.path.getmtime(path) > PENDING_TTL:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _defer_download(task_id, result, output_filename):
+        """登记延迟生成的下载 (结果写入共享的待生成目录)，并返回带预览的响应字段"""
+        result['output_filename'] = output_filename
+        _prune_pending()
+        path = _pending_path(_stored_name(task_id))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        return {
+            "download_url": _download_url(task_id, output_filename),
+            "filename": output_filename,
+            "lazy": True,
+            "preview": _build_preview(result)
+        }
+
+    def _materialize(filename):
+        """
+        生成延迟下载的 xlsx，与处理/合并任务一样经过准入控制 (被拒绝时抛出 AdmissionRejected)。
+        同一进程内并发的首次下载合并为一次渲染，渲染完成后文件留在下载目录中复用。
+        不同 worker 可能同时渲染同一任务：各自在独立的临时目录中写出 (见 _publish)，
+        先完成的一方删除待生成结果后，另一方以正式文件是否存在为准。
+        返回 True 表示文件已就绪，False 表示任务已过期或生成失败。
+        """
+        output_path = os.path.join(DOWNLOAD_FOLDER, filename)
+
+        def render():
+            if os.path.exists(output_path):
+                return True
+            path = _pending_path(filename)
+            if path is None:
+                return False
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return os.path.exists(output_path)
+            task_id = os.path.splitext(filename)[0]
+            with admission.admit(admission.estimate_cost(size)):
+                if os.path.exists(output_path):
+                    return True
+                result = result_store.get(task_id)
+                if result is None:
+                    try:
+                        with open(path, 'rb') as f:
+                            result = pickle.load(f)
+                    except (OSError, EOFError, pickle.UnpicklingError):
+                        return os.path.exists(output_path)
+                if not _publish(task_id, result):
+                    return os.path.exists(output_path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return True
+
+        return render_flight.do(filename, render)
 
     @app.route('/')
     def index():
@@ -30,16 +324,43 @@ def register_routes(app):
 
     @app.route('/api/download/<path:filename>')
     def download_file(filename):
-        return send_from_directory(DOWNLOAD_FOLDER, filename, as_attachment=True)
+        # 不对外提供临时写入目录中的文件
+        if filename.split('/')[0] in (STAGING_DIRNAME, PENDING_DIRNAME):
+            return jsonify({"error": "文件不存在"}), 404
+        pending_path = _pending_path(filename)
+        if pending_path and not os.path.exists(os.path.join(DOWNLOAD_FOLDER, filename)) \
+                and os.path.exists(pending_path):
+            try:
+                if not _materialize(filename):
+                    return jsonify({"error": "结果已过期，请重新处理"}), 410
+            except AdmissionRejected as e:
+                return _busy_response(e)
+        # 通过 Content-Disposition 保留用户友好的文件名
+        download_name = request.args.get('name') or os.path.basename(filename)
+        return send_from_directory(DOWNLOAD_FOLDER, filename, as_attachment=True, download_name=download_name)
 
     @app.route('/api/process_data', methods=['POST'])
     def api_process_data():
-        if 'file' not in request.files:
-            return jsonify({"error": "No file part"}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({"error": "No selected file"}), 400
+        task_id, error = _task_id()
+        if error:
+            return error
+        report = _track(task_id)
+
+        # 可直接引用已完成的分块上传 (upload_id)，代替 multipart 文件
+        upload_id = request.form.get('upload_id')
+        if upload_id:
+            uploaded_path = chunked_uploads.finalized_path(upload_id)
+            if uploaded_path is None:
+                return jsonify({"error": "上传不存在或尚未完成"}), 404
+            filename = os.path.basename(uploaded_path)
+        else:
+            if 'file' not in request.files:
+                return jsonify({"error": "No file part"}), 400
+
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({"error": "No selected file"}), 400
+            filename = file.filename
 
         # 获取用户自定义配置 (JSON 字符串)
         custom_config = None
@@ -49,75 +370,522 @@ def register_routes(app):
             except json.JSONDecodeError:
                 return jsonify({"error": "Invalid JSON in config"}), 400
 
-        task_id = str(uuid.uuid4())
+        try:
+            projection = _projection(custom_config)
+            exact = _is_exact()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
         task_upload_dir = os.path.join(UPLOAD_FOLDER, task_id)
         os.makedirs(task_upload_dir, exist_ok=True)
         
-        src_path = os.path.join(task_upload_dir, file.filename)
-        file.save(src_path)
-        
-        output_filename = f"{os.path.splitext(file.filename)[0]}_processed.xlsx"
-        output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
+        if upload_id:
+            # 分块上传的文件保留在原处，可重复用于处理、合并和批量处理
+            src_path = uploaded_path
+        else:
+            src_path = os.path.join(task_upload_dir, filename)
+            file.save(src_path)
 
-        try:
-            success = process_hospital_data(
-                src_file=src_path, 
-                output_file=output_path,
-                custom_config=custom_config
-            )
+        output_filename = f"{os.path.splitext(filename)[0]}_processed.xlsx"
+
+        # 收费明细 (长表) 需要先聚合为科室 × 项目宽表；.csv 只能是收费明细
+        input_format = request.form.get('input_format') or (
+            'transactions' if src_path.lower().endswith('.csv') else 'wide')
+        if input_format not in INPUT_FORMATS:
             shutil.rmtree(task_upload_dir, ignore_errors=True)
-            
-            if success:
-                return jsonify({
+            return jsonify({"error": f"不支持的输入格式: {input_format}"}), 400
+
+        # 按上传大小估算任务成本，超出并发容量时排队或拒绝
+        upload_size = os.path.getsize(src_path)
+        cost = admission.estimate_cost(upload_size, 1)
+        try:
+            emit(report, 'queued', cost=cost)
+            with admission.admit(cost), _profile_request('process', upload_bytes=upload_size, input_format=input_format,
+                                                         exact=exact, projection=bool(projection)):
+                emit(report, 'admitted')
+                if (input_format == 'wide' and not exact and projection is None
+                        and _use_streaming(src_path, upload_size)):
+                    # 大文件流式处理：边读边写，不保留内存结果 (不提供汇总和延迟生成)，
+                    # 结果库记录按块暂存，写出成功后写入结果库
+                    ok = _publish(task_id, None, writer=lambda path: process_hospital_data_streaming(
+                        src_path, path, custom_config=custom_config,
+                        chunk_size=app.config.get('STREAMING_CHUNK_ROWS', 5000), progress=report,
+                        results_db=RESULTS_DB, source=filename))
+                    shutil.rmtree(task_upload_dir, ignore_errors=True)
+                    if not ok:
+                        return jsonify({"error": "数据处理失败"}), 500
+                    return jsonify({
+                        "message": "处理成功",
+                        "task_id": task_id,
+                        "streamed": True,
+                        "download_url": _download_url(task_id, output_filename),
+                        "filename": output_filename
+                    }), 200
+
+                result = compute_hospital_data(src_file=src_path, custom_config=custom_config,
+                                               input_format=input_format, exact=exact,
+                                               projection=projection, progress=report)
+                shutil.rmtree(task_upload_dir, ignore_errors=True)
+                if result is None:
+                    return jsonify({"error": "数据处理失败"}), 500
+
+                result['custom_config'] = custom_config
+                result_store.put(task_id, result)
+
+                # 写入结果库失败不影响本次处理；投影结果只含部分数据，不写入结果库
+                if RESULTS_DB and projection is None:
+                    try:
+                        results_db.save_result(RESULTS_DB, result, source=filename)
+                    except Exception as e:
+                        print(f"写入结果库失败: {e}")
+                response = {
                     "message": "处理成功",
-                    "download_url": f"/api/download/{output_filename}",
-                    "filename": output_filename
-                }), 200
-            else:
-                return jsonify({"error": "数据处理失败"}), 500
+                    "task_id": task_id,
+                    "summary_url": f"/api/summary/{task_id}"
+                }
+                if _is_view_only():
+                    return jsonify(response), 200
+                if _is_lazy():
+                    response.update(_defer_download(task_id, result, output_filename))
+                    return jsonify(response), 200
+
+                with stage(report, 'write'):
+                    published = _publish(task_id, result)
+                if published:
+                    response["download_url"] = _download_url(task_id, output_filename)
+                    response["filename"] = output_filename
+                    return jsonify(response), 200
+                else:
+                    return jsonify({"error": "数据处理失败"}), 500
+        except AdmissionRejected as e:
+            shutil.rmtree(task_upload_dir, ignore_errors=True)
+            return _busy_response(e)
         except Exception as e:
             shutil.rmtree(task_upload_dir, ignore_errors=True) # 确保清理
             return jsonify({"error": str(e)}), 500
 
     @app.route('/api/merge_files', methods=['POST'])
     def api_merge_files():
-        if 'files' not in request.files:
-            return jsonify({"error": "No files part"}), 400
-        
+        task_id, error = _task_id()
+        if error:
+            return error
+        report = _track(task_id)
+
+        # upload_ids 引用已完成的分块上传，可与 multipart 文件混用
+        upload_ids = request.form.getlist('upload_ids')
+        uploaded_paths = [chunked_uploads.finalized_path(u) for u in upload_ids]
+        if None in uploaded_paths:
+            return jsonify({"error": "上传不存在或尚未完成"}), 404
+
         files = request.files.getlist('files')
-        if not files or files[0].filename == '':
-            return jsonify({"error": "No selected files"}), 400
+        if not uploaded_paths:
+            if 'files' not in request.files:
+                return jsonify({"error": "No files part"}), 400
+            if not files or files[0].filename == '':
+                return jsonify({"error": "No selected files"}), 400
+
+        try:
+            projection = _projection()
+            exact = _is_exact()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        task_id = str(uuid.uuid4())
         task_input_dir = os.path.join(UPLOAD_FOLDER, task_id)
         os.makedirs(task_input_dir, exist_ok=True)
 
         for file in files:
             if file and (file.filename.endswith('.xlsx') or file.filename.endswith('.xls')):
                 file.save(os.path.join(task_input_dir, file.filename))
+        for path in uploaded_paths:
+            if not path.endswith(('.xlsx', '.xls')):
+                continue
+            # 硬链接到任务目录 (不复制数据)，任务结束后删除任务目录不影响原上传
+            target = os.path.join(task_input_dir, os.path.basename(path))
+            try:
+                os.link(path, target)
+            except OSError:
+                shutil.copy2(path, target)
         
         custom_name = request.form.get('output_filename')
-        output_filename = custom_name if custom_name else f"合并汇总_{task_id[:8]}.xlsx"
-        if not output_filename.endswith(('.xlsx', '.xls')):
+        default_name = "分期汇总" if _is_wide() else "合并汇总"
+        output_filename = custom_name if custom_name else f"{default_name}_{task_id[:8]}.xlsx"
+        if not output_filename.endswith('.xlsx'):
             output_filename += '.xlsx'
             
+        # 按上传总大小和文件数估算任务成本
+        saved = [os.path.join(task_input_dir, f) for f in os.listdir(task_input_dir)]
+        cost = admission.estimate_cost(sum(os.path.getsize(f) for f in saved), len(saved))
         try:
-            result_path = merge_excel_files(
-                input_dir=task_input_dir, 
-                output_dir=DOWNLOAD_FOLDER, 
-                output_filename=output_filename
-            )
-            shutil.rmtree(task_input_dir, ignore_errors=True)
+            emit(report, 'queued', cost=cost, files=len(saved))
+            with admission.admit(cost), _profile_request('merge', upload_bytes=sum(os.path.getsize(f) for f in saved),
+                                                         files=len(saved), exact=exact, wide=_is_wide(),
+                                                         projection=bool(projection)):
+                emit(report, 'admitted')
+                result = compute_merge(input_dir=task_input_dir, exact=exact, projection=projection,
+                                       progress=report, wide=_is_wide())
+                shutil.rmtree(task_input_dir, ignore_errors=True)
+                if result is None:
+                    return jsonify({"error": "合并失败"}), 500
 
-            if result_path and os.path.exists(result_path):
-                final_filename = os.path.basename(result_path)
-                return jsonify({
+                result_store.put(task_id, result)
+                response = {
                     "message": "成功合并文件",
-                    "download_url": f"/api/download/{final_filename}",
-                    "filename": final_filename
-                }), 200
-            else:
-                return jsonify({"error": "合并失败"}), 500
+                    "task_id": task_id,
+                    "summary_url": f"/api/summary/{task_id}"
+                }
+                if _is_view_only():
+                    return jsonify(response), 200
+                if _is_lazy():
+                    response.update(_defer_download(task_id, result, output_filename))
+                    return jsonify(response), 200
+
+                with stage(report, 'write'):
+                    published = _publish(task_id, result)
+                if published:
+                    response["download_url"] = _download_url(task_id, output_filename)
+                    response["filename"] = output_filename
+                    return jsonify(response), 200
+                else:
+                    return jsonify({"error": "合并失败"}), 500
+        except AdmissionRejected as e:
+            shutil.rmtree(task_input_dir, ignore_errors=True)
+            return _busy_response(e)
         except Exception as e:
             shutil.rmtree(task_input_dir, ignore_errors=True)
             return jsonify({"error": str(e)}), 500
+
+    @app.route('/api/compare', methods=['POST'])
+    def api_compare():
+        """
+        期间对比。files 为多个处理/合并结果 (第一个为本期，其余为基期)，
+        可选 labels (与文件一一对应)、top_n (变动排行数量)、format=json|xlsx。
+        """
+        files = [f for f in request.files.getlist('files') if f and f.filename]
+        if len(files) < 2:
+            return jsonify({"error": "至少需要上传两个文件进行对比"}), 400
+        if not all(f.filename.endswith(('.xlsx', '.xls')) for f in files):
+            return jsonify({"error": "只支持 .xls / .xlsx 文件"}), 400
+
+        labels = request.form.getlist('labels') or [default_label(f.filename) for f in files]
+        if len(labels) != len(files):
+            return jsonify({"error": "labels 数量必须与文件数量一致"}), 400
+        try:
+            top_n = min(max(int(request.form.get('top_n', 20)), 1), 200)
+        except ValueError:
+            return jsonify({"error": "top_n 必须为整数"}), 400
+        output_format = request.form.get('format', 'json')
+        if output_format not in ('json', 'xlsx'):
+            return jsonify({"error": "format 只支持 json 或 xlsx"}), 400
+
+        task_id = str(uuid.uuid4())
+        task_input_dir = os.path.join(UPLOAD_FOLDER, task_id)
+        os.makedirs(task_input_dir, exist_ok=True)
+        # 加序号前缀，允许不同期间的文件同名
+        paths = []
+        for i, file in enumerate(files):
+            path = os.path.join(task_input_dir, f"{i:02d}_{os.path.basename(file.filename)}")
+            file.save(path)
+            paths.append(path)
+
+        try:
+            digests = [file_sha256(p) for p in paths]
+            cache_key = hashlib.sha256("|".join(digests + labels + [str(top_n)]).encode('utf-8')).hexdigest()
+            result = compare_cache.get(cache_key)
+            if result is None:
+                cost = admission.estimate_cost(sum(os.path.getsize(p) for p in paths), len(paths))
+                with admission.admit(cost):
+                    result = compare_flight.do(cache_key, lambda: compute_comparison(paths, labels, top_n=top_n))
+                if result is None:
+                    return jsonify({"error": "对比失败"}), 500
+                compare_cache.put(cache_key, result)
+
+            if output_format == 'json':
+                return jsonify(comparison_to_json(result)), 200
+
+            # 相同输入的对比工作簿只生成一次
+            compare_id = f"compare-{cache_key[:32]}"
+            output_filename = f"期间对比_{'_'.join(labels)}.xlsx"
+            if not os.path.exists(os.path.join(DOWNLOAD_FOLDER, _stored_name(compare_id))):
+                if not _publish(compare_id, None, writer=lambda path: write_comparison_excel(result, path)):
+                    return jsonify({"error": "对比失败"}), 500
+            return jsonify({
+                "message": "对比完成",
+                "download_url": _download_url(compare_id, output_filename),
+                "filename": output_filename,
+                "top_movers": result['top_movers'],
+            }), 200
+        except AdmissionRejected as e:
+            return _busy_response(e)
+        except Exception as e:
+            # 异常信息可能包含服务器路径，只记录到日志
+            print(f"期间对比失败: {e}")
+            return jsonify({"error": "对比失败"}), 500
+        finally:
+            shutil.rmtree(task_input_dir, ignore_errors=True)
+
+    def _upload_error(e):
+        return jsonify({"error": str(e), **e.extra}), e.status
+
+    @app.route('/api/uploads', methods=['POST'])
+    def api_upload_initiate():
+        """开始分块上传：{"filename", "size", "sha256" (可选，整个文件的校验和)}"""
+        data = request.get_json(silent=True) or {}
+        try:
+            status = chunked_uploads.initiate(data.get('filename'), data.get('size'), data.get('sha256'))
+        except UploadError as e:
+            return _upload_error(e)
+        status['chunk_size'] = app.config.get('CHUNKED_UPLOAD_CHUNK_BYTES', 8 * 1024 * 1024)
+        return jsonify(status), 201
+
+    @app.route('/api/uploads/<upload_id>', methods=['PUT'])
+    def api_upload_chunk(upload_id):
+        """上传一个分块：请求体为原始字节，?offset= 为写入偏移，X-Chunk-SHA256 为分块校验和"""
+        try:
+            offset = int(request.args.get('offset', ''))
+        except ValueError:
+            return jsonify({"error": "offset 必须为整数"}), 400
+        try:
+            status = chunked_uploads.write_chunk(upload_id, offset, request.stream,
+                                                 request.headers.get('X-Chunk-SHA256'))
+        except UploadError as e:
+            return _upload_error(e)
+        return jsonify(status), 200
+
+    @app.route('/api/uploads/<upload_id>', methods=['GET'])
+    def api_upload_status(upload_id):
+        """查询上传状态，断线后从返回的 offset 继续上传"""
+        try:
+            return jsonify(chunked_uploads.status(upload_id)), 200
+        except UploadError as e:
+            return _upload_error(e)
+
+    @app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+    def api_upload_finalize(upload_id):
+        data = request.get_json(silent=True) or {}
+        try:
+            return jsonify(chunked_uploads.finalize(upload_id, data.get('sha256'))), 200
+        except UploadError as e:
+            return _upload_error(e)
+
+    @app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+    def api_upload_discard(upload_id):
+        try:
+            chunked_uploads.discard(upload_id)
+        except UploadError as e:
+            return _upload_error(e)
+        return jsonify({"message": "已删除"}), 200
+
+    @app.route('/api/progress/<task_id>', methods=['GET'])
+    def api_progress(task_id):
+        """
+        任务进度事件流 (Server-Sent Events)。
+        可以在提交任务前订阅 (提交时携带相同的 task_id)，收到 done 事件后结束。
+        """
+        try:
+            task_id = str(uuid.UUID(task_id))
+        except ValueError:
+            return jsonify({"error": "无效的任务 ID"}), 400
+        try:
+            last_id = int(request.headers.get('Last-Event-ID', 0))
+        except ValueError:
+            last_id = 0
+        return Response(progress.stream(task_id, last_id), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @app.route('/api/summary/<task_id>', methods=['GET'])
+    def api_summary(task_id):
+        """
+        返回任务的紧凑 JSON 汇总。
+        查询参数: page, page_size (分页)，columns (逗号分隔的列投影)，top (费用项目排行数量)
+        """
+        result = result_store.get(task_id)
+        if result is None:
+            return jsonify({"error": "任务不存在或已过期"}), 404
+
+        try:
+            page = int(request.args.get('page', 1))
+            page_size = int(request.args.get('page_size', 50))
+            top_n = min(max(int(request.args.get('top', SUMMARY_TOP_N)), 1), 200)
+        except ValueError:
+            return jsonify({"error": "分页参数必须为整数"}), 400
+        columns_arg = request.args.get('columns')
+        columns = [c.strip() for c in columns_arg.split(',') if c.strip()] if columns_arg else None
+
+        # 默认排行数量的汇总随任务缓存，分页和投影只做切片；
+        # 其他 top 值每次重新计算，不在结果上累积缓存 (结果缓存的大小统计不包含汇总)
+        if top_n == SUMMARY_TOP_N:
+            summary = result.get('summary')
+            if summary is None:
+                summary = result['summary'] = build_summary(result, custom_config=result.get('custom_config'),
+                                                            top_n=top_n)
+        else:
+            summary = build_summary(result, custom_config=result.get('custom_config'), top_n=top_n)
+
+        payload = paginate_summary(summary, page=page, page_size=page_size, columns=columns)
+        payload['task_id'] = task_id
+        payload['kind'] = result['kind']
+        return jsonify(payload), 200
+
+    def _split_arg(name):
+        value = request.args.get(name)
+        return [v.strip() for v in value.split(',') if v.strip()] if value else None
+
+    @app.route('/api/store/runs', methods=['GET'])
+    def api_store_runs():
+        if not RESULTS_DB:
+            return jsonify({"error": "结果库未启用"}), 404
+        return jsonify({"runs": results_db.list_runs(RESULTS_DB)}), 200
+
+    @app.route('/api/store/rollup', methods=['GET'])
+    def api_store_rollup():
+        """
+        直接从结果库按期间区间聚合。
+        查询参数: item (明细项目) / department (逗号分隔)，dimension，group (分组合计)，start / end (年月)，
+        by (逗号分隔)。item 和 group 都不指定时聚合 合计 列；不指定 dimension 时按科室维度分别返回。
+        例: /api/store/rollup?group=03&department=放射科&dimension=开单科室&start=202401&end=202412
+        """
+        if not RESULTS_DB:
+            return jsonify({"error": "结果库未启用"}), 404
+        rows = results_db.query_rollup(
+            RESULTS_DB,
+            items=_split_arg('item'),
+            departments=_split_arg('department'),
+            dimension=request.args.get('dimension'),
+            group=request.args.get('group'),
+            start=request.args.get('start'),
+            end=request.args.get('end'),
+            by=_split_arg('by') or ['period']
+        )
+        return jsonify({"rows": rows}), 200
+
+    @app.route('/api/cube', methods=['GET'])
+    def api_cube_info():
+        """期间立方体状态：已加入的月份、科室数、列数、各月来源文件"""
+        if cube is None:
+            return jsonify({"error": "期间立方体未启用"}), 404
+        return jsonify(cube.info()), 200
+
+    @app.route('/api/cube/months', methods=['POST'])
+    def api_cube_add_months():
+        """
+        加入或替换月份。files / upload_ids 为月度处理结果，按文件名中的年月分组，同一月份的文件相加；
+        可选 period (YYYYMM) 将全部文件计入该月。已有的月份被整体替换。
+        """
+        if cube is None:
+            return jsonify({"error": "期间立方体未启用"}), 404
+        upload_ids = request.form.getlist('upload_ids')
+        uploaded_paths = [chunked_uploads.finalized_path(u) for u in upload_ids]
+        if None in uploaded_paths:
+            return jsonify({"error": "上传不存在或尚未完成"}), 404
+        files = [f for f in request.files.getlist('files') if f and f.filename]
+        if not files and not uploaded_paths:
+            return jsonify({"error": "No selected files"}), 400
+        names = [f.filename for f in files] + [os.path.basename(p) for p in uploaded_paths]
+        if not all(name.endswith(('.xlsx', '.xls')) for name in names):
+            return jsonify({"error": "只支持 .xls / .xlsx 文件"}), 400
+
+        period = request.form.get('period')
+        groups = {}
+        for name in names:
+            key = period or results_db.extract_period(name)
+            if not key:
+                return jsonify({"error": f"无法从文件名识别年月，请指定 period: {name}"}), 400
+            groups.setdefault(key, [])
+
+        task_id = str(uuid.uuid4())
+        task_input_dir = os.path.join(UPLOAD_FOLDER, task_id)
+        os.makedirs(task_input_dir, exist_ok=True)
+        saved = []
+        for i, file in enumerate(files):
+            path = os.path.join(task_input_dir, f"{i:02d}_{os.path.basename(file.filename)}")
+            file.save(path)
+            saved.append((file.filename, path))
+        saved += [(os.path.basename(p), p) for p in uploaded_paths]
+        for name, path in saved:
+            groups[period or results_db.extract_period(name)].append(path)
+
+        try:
+            cost = admission.estimate_cost(sum(os.path.getsize(p) for _, p in saved), len(saved))
+            with admission.admit(cost):
+                updated = [cube.add_month(paths, period=key) for key, paths in sorted(groups.items())]
+            return jsonify({"message": "期间立方体已更新", "updated": updated, "cube": cube.info()}), 200
+        except AdmissionRejected as e:
+            return _busy_response(e)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        finally:
+            shutil.rmtree(task_input_dir, ignore_errors=True)
+
+    @app.route('/api/cube/range', methods=['GET'])
+    def api_cube_range():
+        """
+        区间合计。查询参数: start / end (年月，含两端，省略时为最早 / 最新月份) 或 ytd (本年累计至该月)，
+        format=json|xlsx。例: /api/cube/range?start=202503&end=202508、/api/cube/range?ytd=202506
+        """
+        if cube is None:
+            return jsonify({"error": "期间立方体未启用"}), 404
+        output_format = request.args.get('format', 'json')
+        if output_format not in ('json', 'xlsx'):
+            return jsonify({"error": "format 只支持 json 或 xlsx"}), 400
+        try:
+            if request.args.get('ytd'):
+                result = cube.year_to_date(request.args['ytd'])
+            else:
+                result = cube.range_total(request.args.get('start'), request.args.get('end'))
+        except CubeError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if output_format == 'json':
+            return jsonify(range_to_json(result)), 200
+
+        # 同一立方体实例、同一版本的同一区间只生成一次工作簿，并可通过汇总接口查看
+        first, last = result['periods'][0], result['periods'][-1]
+        cube_id = f"cube-{result['cube_id'][:12]}-{result['version']}-{first}-{last}"
+        output_filename = f"区间汇总_{first}-{last}.xlsx"
+        result_store.put(cube_id, result)
+        if not os.path.exists(os.path.join(DOWNLOAD_FOLDER, _stored_name(cube_id))):
+            try:
+                published = _publish(cube_id, result)
+            except Exception as e:
+                print(f"生成区间汇总工作簿失败: {e}")
+                published = False
+            if not published:
+                return jsonify({"error": "生成工作簿失败"}), 500
+        return jsonify({
+            "message": "区间汇总完成",
+            "periods": result['periods'],
+            "task_id": cube_id,
+            "summary_url": f"/api/summary/{cube_id}",
+            "download_url": _download_url(cube_id, output_filename),
+            "filename": output_filename,
+        }), 200
+
+    @app.route('/api/admin/profiles', methods=['GET'])
+    def api_list_profiles():
+        """最近的剖析记录 (需要管理员令牌)"""
+        if not _is_admin():
+            return jsonify({"error": "需要管理员权限"}), 403
+        return jsonify({"profiles": profiler.list()}), 200
+
+    @app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+    def api_get_profile(profile_id):
+        """
+        剖析详情 (需要管理员令牌)：耗时最多的函数和分配内存最多的代码行。
+        format=prof / txt 时下载 cProfile 原始数据或文本报告。
+        """
+        if not _is_admin():
+            return jsonify({"error": "需要管理员权限"}), 403
+        fmt = request.args.get('format', 'json')
+        path = profiler.path(profile_id, fmt)
+        if not path or not os.path.exists(path):
+            return jsonify({"error": "剖析记录不存在"}), 404
+        if fmt == 'json':
+            return jsonify(profiler.load(profile_id)), 200
+        return send_from_directory(profiler.profile_dir, os.path.basename(path), as_attachment=True)
+
+    @app.route('/api/admission', methods=['GET'])
+    def api_admission():
+        """准入控制状态：运行中任务、队列深度、等待时间等"""
+        return jsonify(admission.stats()), 200
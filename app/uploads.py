@@ -0,0 +1,238 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+
+class UploadError(Exception):
+    """分块上传请求无效，status 为建议的 HTTP 状态码"""
+
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+class ChunkedUploads:
+    """
+    可续传的分块上传。
+
+    目录结构 (均位于 UPLOAD_FOLDER/chunked 下):
+        partial/<upload_id>/meta.json   上传状态 (文件名、总大小、已确认偏移、各块校验和)
+        partial/<upload_id>/data        按偏移直接写入的数据文件
+        complete/<upload_id>/<文件名>   完成后的文件，可作为处理、合并和批量处理的输入
+
+    每个分块必须从当前已确认的偏移开始写入，并附带 SHA-256 校验和；
+    校验失败时截断回原偏移，连接中断后客户端查询状态即可从已确认的偏移继续上传。
+    超过 ttl 秒未完成的上传、完成超过 complete_ttl 秒 (默认同 ttl) 的文件在下次发起上传时删除。
+    """
+
+    def __init__(self, upload_folder, max_bytes=2 * 1024 * 1024 * 1024, ttl=24 * 3600, complete_ttl=None):
+        self.root = os.path.join(upload_folder, 'chunked')
+        self.partial_dir = os.path.join(self.root, 'partial')
+        self.complete_dir = os.path.join(self.root, 'complete')
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.complete_ttl = ttl if complete_ttl is None else complete_ttl
+        os.makedirs(self.partial_dir, exist_ok=True)
+        os.makedirs(self.complete_dir, exist_ok=True)
+
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, upload_id):
+        with self._locks_guard:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    @staticmethod
+    def _check_id(upload_id):
+        try:
+            return str(uuid.UUID(upload_id))
+        except (ValueError, TypeError):
+            raise UploadError("无效的上传 ID", 404)
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.partial_dir, upload_id, 'meta.json')
+
+    def _load_meta(self, upload_id):
+        try:
+            with open(self._meta_path(upload_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadError("上传不存在或已过期", 404)
+
+    def _save_meta(self, upload_id, meta):
+        """先写临时文件再原子替换，崩溃后状态仍与已确认的数据一致"""
+        path = self._meta_path(upload_id)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _status(upload_id, meta):
+        return {
+            "upload_id": upload_id,
+            "filename": meta['filename'],
+            "size": meta['size'],
+            "offset": meta['offset'],
+            "complete": meta.get('complete', False),
+        }
+
+    def initiate(self, filename, size, sha256=None):
+        filename = os.path.basename(filename or '')
+        if not filename or not filename.endswith(('.xls', '.xlsx', '.csv')):
+            raise UploadError("只支持 .xls / .xlsx / .csv 文件")
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            raise UploadError("size 必须为整数")
+        if size <= 0 or size > self.max_bytes:
+            raise UploadError(f"文件大小必须在 1 到 {self.max_bytes} 字节之间", 413)
+
+        self.cleanup()
+        upload_id = str(uuid.uuid4())
+        os.makedirs(os.path.join(self.partial_dir, upload_id))
+        open(os.path.join(self.partial_dir, upload_id, 'data'), 'wb').close()
+        meta = {
+            "filename": filename,
+            "size": size,
+            "sha256": sha256,
+            "offset": 0,
+            "chunks": [],
+            "created_at": time.time(),
+        }
+        self._save_meta(upload_id, meta)
+        return self._status(upload_id, meta)
+
+    def write_chunk(self, upload_id, offset, stream, checksum, block_size=64 * 1024):
+        """
+        从 stream 读取一个分块写入 offset 处。
+        offset 必须等于已确认偏移；重发已确认的分块 (偏移和校验和都相同) 直接返回当前状态。
+        """
+        upload_id = self._check_id(upload_id)
+        if not checksum:
+            raise UploadError("缺少分块校验和 (X-Chunk-SHA256)")
+        checksum = checksum.lower()
+
+        with self._lock(upload_id):
+            meta = self._load_meta(upload_id)
+            if meta.get('complete'):
+                raise UploadError("上传已完成", 409, **self._status(upload_id, meta))
+            if offset < meta['offset']:
+                if any(c['offset'] == offset and c['sha256'] == checksum for c in meta['chunks']):
+                    return self._status(upload_id, meta)
+                raise UploadError("分块偏移与已确认的数据冲突", 409, **self._status(upload_id, meta))
+            if offset != meta['offset']:
+                raise UploadError("分块偏移不连续，请从已确认的偏移继续上传", 409, **self._status(upload_id, meta))
+
+            data_path = os.path.join(self.partial_dir, upload_id, 'data')
+            digest = hashlib.sha256()
+            written = 0
+            with open(data_path, 'r+b') as f:
+                f.seek(offset)
+                while True:
+                    block = stream.read(block_size)
+                    if not block:
+                        break
+                    written += len(block)
+                    if offset + written > meta['size']:
+                        f.truncate(offset)
+                        raise UploadError("分块超出文件声明的大小", 413, **self._status(upload_id, meta))
+                    digest.update(block)
+                    f.write(block)
+                if written == 0 or digest.hexdigest() != checksum:
+                    f.truncate(offset)
+                    raise UploadError("分块为空或校验和不匹配，请重新上传该分块", 400, **self._status(upload_id, meta))
+                f.flush()
+                os.fsync(f.fileno())
+
+            meta['chunks'].append({"offset": offset, "length": written, "sha256": checksum})
+            meta['offset'] = offset + written
+            self._save_meta(upload_id, meta)
+            return self._status(upload_id, meta)
+
+    def status(self, upload_id):
+        upload_id = self._check_id(upload_id)
+        if self.finalized_path(upload_id):
+            with open(os.path.join(self.complete_dir, upload_id, '.meta.json'), 'r', encoding='utf-8') as f:
+                return self._status(upload_id, json.load(f))
+        return self._status(upload_id, self._load_meta(upload_id))
+
+    def finalize(self, upload_id, sha256=None):
+        """数据完整后校验整体哈希 (如果提供)，移动到 complete 目录"""
+        upload_id = self._check_id(upload_id)
+        with self._lock(upload_id):
+            if self.finalized_path(upload_id):
+                return self.status(upload_id)
+            meta = self._load_meta(upload_id)
+            if meta['offset'] != meta['size']:
+                raise UploadError("文件尚未上传完整", 409, **self._status(upload_id, meta))
+
+            partial = os.path.join(self.partial_dir, upload_id)
+            data_path = os.path.join(partial, 'data')
+            expected = (sha256 or meta.get('sha256') or '').lower()
+            if expected:
+                digest = hashlib.sha256()
+                with open(data_path, 'rb') as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b''):
+                        digest.update(block)
+                if digest.hexdigest() != expected:
+                    raise UploadError("文件校验和不匹配", 400, **self._status(upload_id, meta))
+
+            meta['complete'] = True
+            target_dir = os.path.join(self.complete_dir, upload_id)
+            os.makedirs(target_dir, exist_ok=True)
+            with open(os.path.join(target_dir, '.meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(data_path, os.path.join(target_dir, meta['filename']))
+            shutil.rmtree(partial, ignore_errors=True)
+            return self._status(upload_id, meta)
+
+    def finalized_path(self, upload_id):
+        """已完成上传的文件路径，不存在时返回 None"""
+        try:
+            upload_id = self._check_id(upload_id)
+        except UploadError:
+            return None
+        target_dir = os.path.join(self.complete_dir, upload_id)
+        if not os.path.isdir(target_dir):
+            return None
+        for name in os.listdir(target_dir):
+            if not name.startswith('.'):
+                return os.path.join(target_dir, name)
+        return None
+
+    def discard(self, upload_id):
+        upload_id = self._check_id(upload_id)
+        with self._lock(upload_id):
+            found = False
+            for base in (self.partial_dir, self.complete_dir):
+                path = os.path.join(base, upload_id)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                    found = True
+        with self._locks_guard:
+            self._locks.pop(upload_id, None)
+        if not found:
+            raise UploadError("上传不存在或已过期", 404)
+
+    def cleanup(self):
+        """删除超过 ttl 秒未完成的上传和完成超过 complete_ttl 秒的文件"""
+        now = time.time()
+        expired = []
+        for base, meta_name, ttl in ((self.partial_dir, 'meta.json', self.ttl),
+                                     (self.complete_dir, '.meta.json', self.complete_ttl)):
+            for upload_id in os.listdir(base):
+                try:
+                    if now - os.path.getmtime(os.path.join(base, upload_id, meta_name)) > ttl:
+                        expired.append(os.path.join(base, upload_id))
+                except FileNotFoundError:
+                    continue
+        for path in expired:
+            upload_id = os.path.basename(path)
+            with self._lock(upload_id):
+                shutil.rmtree(path, ignore_errors=True)
+            with self._locks_guard:
+                self._locks.pop(upload_id, None)
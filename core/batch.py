@@ -0,0 +1,274 @@
+"""
+命令行批量处理：处理整个目录树的导出文件，并可按年/季度合并。
+
+用法:
+    python -m core.batch excels/data_export excels/batch_output --workers 8 --merge-by year
+
+- 使用多进程并行处理 (默认使用全部 CPU 核心)，并显示进度
+- 在输出目录维护 manifest.json，记录输入文件哈希与输出路径；
+  重新运行时跳过未变化的文件，中途崩溃后可从断点继续
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from core.config_loader import load_group_config
+from core.processor import INPUT_FORMATS, process_hospital_data
+from core.merger import compute_merge_paths, compute_wide_merge_paths, write_merge_result
+
+MANIFEST_NAME = 'manifest.json'
+PERIOD_PATTERN = re.compile(r'(20\d{2})(\d{2})')
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def config_digest(config):
+    """分组配置变化时需要重新处理，因此把配置摘要也记入 manifest"""
+    return hashlib.sha256(json.dumps(config, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {'files': {}, 'merges': {}}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        manifest.setdefault('files', {})
+        manifest.setdefault('merges', {})
+        return manifest
+    except Exception as e:
+        print(f"读取 manifest 失败 ({e})，将重新处理全部文件")
+        return {'files': {}, 'merges': {}}
+
+def save_manifest(path, manifest):
+    """先写临时文件再原子替换，崩溃时不会留下损坏的 manifest"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def find_exports(input_dir, extensions=('.xls', '.xlsx')):
+    """递归查找目录树中的 Excel 导出文件，返回相对路径列表"""
+    found = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for f in sorted(files):
+            if f.endswith(extensions) and not f.startswith(('~', '.~')):
+                found.append(os.path.relpath(os.path.join(root, f), input_dir))
+    return found
+
+def processed_output_path(output_dir, rel_path):
+    stem = os.path.splitext(rel_path)[0]
+    return os.path.join(output_dir, 'processed', f"{stem}_processed.xlsx")
+
+def merge_group_key(rel_path, merge_by):
+    """
+    根据文件名中的年月确定合并分组。
+    同一报表类型 (去掉年月后的文件名相同) 且同一年/季度的文件合并为一个结果，
+    返回 (分组名, 期间) 或 None (文件名中没有年月)。
+    """
+    name = os.path.basename(rel_path)
+    match = PERIOD_PATTERN.search(name)
+    if not match:
+        return None
+    year, month = match.group(1), int(match.group(2))
+    if merge_by == 'quarter':
+        period = f"{year}Q{(month - 1) // 3 + 1}"
+    elif merge_by == 'month':
+        period = f"{year}{month:02d}"
+    else:
+        period = year
+    # 直接拼接 (文件名中可能含有花括号，不能用 str.format)
+    stem = os.path.splitext(name[:match.start()] + period + name[match.end():])[0]
+    return stem.replace('_processed', ''), period
+
+def process_export(src_path, output_path, custom_config, results_db, input_format='wide', exact=False):
+    """子进程入口：处理单个文件，返回 (是否成功, 耗时)"""
+    start = time.perf_counter()
+    try:
+        ok = process_hospital_data(src_file=src_path, output_file=output_path,
+                                   custom_config=custom_config, results_db=results_db,
+                                   input_format=input_format, exact=exact)
+    except Exception as e:
+        print(f"处理失败 {src_path}: {e}")
+        ok = False
+    return ok, time.perf_counter() - start
+
+def _merge_one(paths, output_path, exact=False, wide=False):
+    start = time.perf_counter()
+    try:
+        merge_paths = compute_wide_merge_paths if wide else compute_merge_paths
+        result = merge_paths(paths, exact=exact)
+        ok = result is not None and write_merge_result(result, output_path)
+    except Exception as e:
+        print(f"合并失败 {output_path}: {e}")
+        ok = False
+    return ok, time.perf_counter() - start
+
+def _progress(done, total, label):
+    width = 30
+    filled = int(width * done / total) if total else width
+    print(f"[{'#' * filled}{'.' * (width - filled)}] {done}/{total} {label}", flush=True)
+
+def run_batch(input_dir, output_dir, workers=None, merge_by=None, custom_config=None,
+              results_db=None, force=False, input_format='wide', exact=False, wide_merge=False):
+    """
+    批量处理 input_dir 下的全部导出文件，结果写入 output_dir/processed (保持目录结构)。
+    merge_by 为 year / quarter / month 时，再按期间合并到 output_dir/merged；
+    wide_merge 为 True 时合并结果按月份分列 (分期宽表)。
+    input_format 为 transactions 时按收费明细处理 (同时查找 .csv 文件)；exact 为 True 时金额按分精确累加，
+    为 'strict' 时遇到不足一分的金额报错。
+    返回 (成功数, 失败数)。
+    """
+    if not os.path.isdir(input_dir):
+        print(f"错误: 输入目录不存在 {input_dir}")
+        return 0, 0
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    config = custom_config if custom_config else load_group_config()
+    digest = config_digest(config)
+    if exact:
+        # 精确模式的结果与浮点模式不同，切换模式时需要重新处理
+        digest += '-exact'
+
+    extensions = ('.xls', '.xlsx', '.csv') if input_format == 'transactions' else ('.xls', '.xlsx')
+    exports = find_exports(input_dir, extensions)
+    print(f"发现 {len(exports)} 个导出文件")
+
+    # 1. 计算哈希，筛出需要处理的文件
+    pending = []
+    hashes = {}
+    for rel_path in exports:
+        src_path = os.path.join(input_dir, rel_path)
+        hashes[rel_path] = file_sha256(src_path)
+        entry = manifest['files'].get(rel_path)
+        if (not force and entry and entry.get('sha256') == hashes[rel_path]
+                and entry.get('config') == digest and os.path.exists(entry.get('output', ''))):
+            continue
+        pending.append(rel_path)
+    print(f"需要处理 {len(pending)} 个，跳过未变化的 {len(exports) - len(pending)} 个")
+
+    succeeded, failed = 0, 0
+    workers = workers or os.cpu_count() or 1
+
+    # 2. 多进程并行处理，每完成一个就更新 manifest，支持断点续跑
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for rel_path in pending:
+                output_path = processed_output_path(output_dir, rel_path)
+                future = pool.submit(process_export, os.path.join(input_dir, rel_path), output_path,
+                                     custom_config, results_db, input_format, exact)
+                futures[future] = (rel_path, output_path)
+
+            for done, future in enumerate(as_completed(futures), 1):
+                rel_path, output_path = futures[future]
+                ok, elapsed = future.result()
+                if ok:
+                    succeeded += 1
+                    manifest['files'][rel_path] = {
+                        'sha256': hashes[rel_path],
+                        'config': digest,
+                        'output': output_path,
+                        'seconds': round(elapsed, 3),
+                    }
+                    save_manifest(manifest_path, manifest)
+                else:
+                    failed += 1
+                    # 旧的处理结果对应修改前的文件，从 manifest 中去掉，不再参与合并
+                    stale = manifest['files'].pop(rel_path, None)
+                    if stale is not None:
+                        save_manifest(manifest_path, manifest)
+                        if os.path.exists(stale.get('output', '')):
+                            os.remove(stale['output'])
+                _progress(done, len(pending), f"{'完成' if ok else '失败'} {rel_path} ({elapsed:.1f}s)")
+
+    # 3. 按期间合并 (输入哈希未变化的分组跳过)
+    if merge_by:
+        groups = {}
+        for rel_path in exports:
+            entry = manifest['files'].get(rel_path)
+            key = merge_group_key(rel_path, merge_by)
+            if entry is None or key is None:
+                continue
+            groups.setdefault(key[0], []).append(rel_path)
+
+        merge_jobs = []
+        for name, rel_paths in sorted(groups.items()):
+            rel_paths.sort()
+            signature = hashlib.sha256(
+                "|".join(f"{p}:{manifest['files'][p]['sha256']}" for p in rel_paths).encode('utf-8') + digest.encode()
+                + (b'-wide' if wide_merge else b'')
+            ).hexdigest()
+            output_path = os.path.join(output_dir, 'merged', f"{name}_合并.xlsx")
+            entry = manifest['merges'].get(name)
+            if not force and entry and entry.get('signature') == signature and os.path.exists(output_path):
+                continue
+            paths = [manifest['files'][p]['output'] for p in rel_paths]
+            merge_jobs.append((name, paths, output_path, signature))
+
+        print(f"需要合并 {len(merge_jobs)} 组，跳过未变化的 {len(groups) - len(merge_jobs)} 组")
+        if merge_jobs:
+            with ProcessPoolExecutor(max_workers=min(workers, len(merge_jobs))) as pool:
+                futures = {pool.submit(_merge_one, paths, output_path, exact, wide_merge):
+                           (name, paths, output_path, signature)
+                           for name, paths, output_path, signature in merge_jobs}
+                for done, future in enumerate(as_completed(futures), 1):
+                    name, paths, output_path, signature = futures[future]
+                    ok, elapsed = future.result()
+                    if ok:
+                        manifest['merges'][name] = {
+                            'signature': signature,
+                            'inputs': paths,
+                            'output': output_path,
+                        }
+                        save_manifest(manifest_path, manifest)
+                    else:
+                        failed += 1
+                    _progress(done, len(merge_jobs), f"{'合并完成' if ok else '合并失败'} {name} ({elapsed:.1f}s)")
+
+    print(f"批量处理结束: 成功 {succeeded}，失败 {failed}")
+    return succeeded, failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量处理医院收入导出文件")
+    parser.add_argument('input_dir', help="导出文件所在目录 (递归查找 .xls/.xlsx)")
+    parser.add_argument('output_dir', help="输出目录，包含 processed/、merged/ 和 manifest.json")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="并行进程数，默认为 CPU 核心数")
+    parser.add_argument('--merge-by', choices=['year', 'quarter', 'month'], default=None,
+                        help="处理后按期间合并同类报表")
+    parser.add_argument('--config', default=None, help="自定义分组配置 JSON 文件，默认使用 config/groups.json")
+    parser.add_argument('--results-db', default=None, help="同时写入 SQLite 结果库")
+    parser.add_argument('--force', action='store_true', help="忽略 manifest，全部重新处理")
+    parser.add_argument('--input-format', choices=INPUT_FORMATS, default='wide',
+                        help="wide: HIS 透视导出；transactions: 收费明细 (科室、收费项目、金额)")
+    parser.add_argument('--exact', action='store_true', help="金额按 int64 分精确累加 (分组合计和合并)")
+    parser.add_argument('--strict-cents', action='store_true',
+                        help="精确累加且遇到不足一分的金额时报错 (包含 --exact)")
+    parser.add_argument('--wide-merge', action='store_true', help="合并结果按月份分列 (每个月一组列，另加各期合计)")
+    args = parser.parse_args(argv)
+
+    custom_config = None
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            custom_config = json.load(f)
+
+    _, failed = run_batch(args.input_dir, args.output_dir, workers=args.workers, merge_by=args.merge_by,
+                          custom_config=custom_config, results_db=args.results_db, force=args.force,
+                          input_format=args.input_format,
+                          exact='strict' if args.strict_cents else args.exact, wide_merge=args.wide_merge)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
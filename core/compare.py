@@ -0,0 +1,226 @@
+"""
+期间对比：本期与上期、去年同期等多个处理/合并结果逐单元格比较。
+
+每个文件按 merge_excel_files 相同的规则规范化 (表头识别、科室索引、去除制表人行和无效列)，
+对齐科室和列后叠成 (文件数 × 科室 × 列) 的数组，一次性计算全部单元格的差额与增幅，
+并列出变动最大的单元格。第一个文件为本期，其余为对比基期。
+"""
+
+import os
+import re
+import numpy as np
+from openpyxl import Workbook
+from openpyxl.styles import Alignment, Font, PatternFill
+from openpyxl.utils import get_column_letter
+
+from core.merger import find_header_row, load_merge_frame
+from core.results_db import extract_period
+
+# 红色表示增长、绿色表示下降 (财务报表习惯)
+INCREASE_FILL = PatternFill('solid', fgColor='F8CBAD')
+DECREASE_FILL = PatternFill('solid', fgColor='C6EFCE')
+# Excel 工作表名不允许的字符，名称最长 31 个字符
+INVALID_SHEET_CHARS = re.compile(r'[\[\]:*?/\\]')
+SHEET_TITLE_MAX = 31
+
+def default_label(path):
+    """对比标签默认取文件名中的年月，没有则取文件名"""
+    name = os.path.basename(path)
+    return extract_period(name) or os.path.splitext(name)[0]
+
+def load_compare_frame(path):
+    """读取并规范化单个文件，返回 (以科室为索引的数值数据框, 科室列名)，列保持原文件顺序"""
+    header_row, index_name = find_header_row(path)
+    frame, _ = load_merge_frame(path, header_row, index_name)
+    frame = frame[frame.index.notna()]
+    frame.index = frame.index.astype(str).str.strip()
+    # 同名科室合并，保证对齐时索引唯一
+    if not frame.index.is_unique:
+        frame = frame.groupby(level=0, sort=False).sum()
+    return frame, index_name
+
+def compare_frames(frames, labels, top_n=20):
+    """
+    frames[0] 为本期，frames[1:] 为基期。
+    返回 {'departments', 'columns', 'labels', 'values': (k, 科室, 列) 数组,
+          'delta': (k-1, 科室, 列), 'pct': (k-1, 科室, 列), 'top_movers': [[...], ...]}
+    增幅为 差额 / |基期值|，基期为 0 时为 NaN。
+    """
+    # 科室和列取并集，以本期文件的顺序为准，其他文件新出现的追加在后面
+    departments = list(dict.fromkeys(d for f in frames for d in f.index))
+    columns = list(dict.fromkeys(c for f in frames for c in f.columns))
+    values = np.stack([f.reindex(index=departments, columns=columns).to_numpy(dtype=float, na_value=0.0)
+                       for f in frames])
+    values = np.nan_to_num(values)
+
+    current, bases = values[0], values[1:]
+    delta = current[np.newaxis] - bases
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = np.where(bases != 0, delta / np.abs(bases), np.nan)
+
+    top_movers = []
+    for k in range(len(bases)):
+        magnitude = np.abs(delta[k]).ravel()
+        n = min(top_n, int(np.count_nonzero(magnitude)))
+        if n == 0:
+            top_movers.append([])
+            continue
+        idx = np.argpartition(-magnitude, n - 1)[:n]
+        idx = idx[np.argsort(-magnitude[idx], kind='stable')]
+        rows, cols = np.unravel_index(idx, delta[k].shape)
+        top_movers.append([{
+            'department': departments[r],
+            'column': columns[c],
+            'current': round(float(current[r, c]), 2),
+            'base': round(float(bases[k, r, c]), 2),
+            'delta': round(float(delta[k, r, c]), 2),
+            'pct': None if np.isnan(pct[k, r, c]) else round(float(pct[k, r, c]), 4),
+        } for r, c in zip(rows.tolist(), cols.tolist())])
+
+    return {
+        'departments': departments,
+        'columns': columns,
+        'labels': list(labels),
+        'values': values,
+        'delta': delta,
+        'pct': pct,
+        'top_movers': top_movers,
+    }
+
+def compute_comparison(paths, labels=None, top_n=20):
+    """
+    比较多个处理/合并结果文件，paths[0] 为本期。
+    返回结果字典 (compare_frames 的结果加上 'kind' 和 'dept_col')，失败返回 None。
+    """
+    if len(paths) < 2:
+        print("错误: 至少需要两个文件进行对比")
+        return None
+    labels = list(labels) if labels else [default_label(p) for p in paths]
+
+    frames = []
+    dept_col = None
+    for path in paths:
+        try:
+            frame, index_name = load_compare_frame(path)
+        except Exception as e:
+            print(f"读取对比文件失败 {os.path.basename(path)}: {e}")
+            return None
+        frames.append(frame)
+        dept_col = dept_col or index_name
+
+    result = compare_frames(frames, labels, top_n=top_n)
+    result.update({'kind': 'compare', 'dept_col': dept_col})
+    return result
+
+def _json_matrix(matrix, digits):
+    rounded = np.round(matrix, digits)
+    return [[None if np.isnan(v) else v for v in row] for row in rounded.tolist()]
+
+def comparison_to_json(result):
+    """转换为 JSON 可序列化的结构 (NaN 转为 null)"""
+    return {
+        'dept_col': result['dept_col'],
+        'departments': result['departments'],
+        'columns': result['columns'],
+        'current': {'label': result['labels'][0], 'values': _json_matrix(result['values'][0], 2)},
+        'comparisons': [{
+            'label': label,
+            'values': _json_matrix(result['values'][k + 1], 2),
+            'delta': _json_matrix(result['delta'][k], 2),
+            'pct': _json_matrix(result['pct'][k], 4),
+            'top_movers': result['top_movers'][k],
+        } for k, label in enumerate(result['labels'][1:])],
+    }
+
+def sheet_title(name, used):
+    """
+    由用户提供的标签生成合法且不重复的工作表名：替换非法字符，截断到 31 个字符，
+    与已用名称重复 (Excel 不区分大小写) 时追加 (2)、(3)…。used 为已用名称的小写集合，会被更新。
+    """
+    base = INVALID_SHEET_CHARS.sub('_', str(name)).strip("'") or '_'
+    title = base[:SHEET_TITLE_MAX]
+    n = 2
+    while title.lower() in used:
+        suffix = f"({n})"
+        title = base[:SHEET_TITLE_MAX - len(suffix)] + suffix
+        n += 1
+    used.add(title.lower())
+    return title
+
+def _format_sheet(ws):
+    center_alignment = Alignment(horizontal='center', vertical='center')
+    for column in ws.columns:
+        max_len = 0
+        col_letter = get_column_letter(column[0].column)
+        for cell in column:
+            cell.alignment = center_alignment
+            try:
+                if cell.value:
+                    l = len(str(cell.value).encode('gbk'))
+                    if l > max_len: max_len = l
+            except Exception:
+                pass
+        ws.column_dimensions[col_letter].width = min(max_len + 2, 40)
+
+def _write_matrix(ws, result, matrix, number_format=None, shade=None, highlight=None):
+    ws.append([result['dept_col']] + result['columns'])
+    for r, dept in enumerate(result['departments']):
+        row = [dept] + [None if np.isnan(v) else round(v, 4 if number_format else 2) for v in matrix[r].tolist()]
+        ws.append(row)
+    if shade is None:
+        return
+    for r in range(len(result['departments'])):
+        for c in range(len(result['columns'])):
+            cell = ws.cell(row=r + 2, column=c + 2)
+            if number_format:
+                cell.number_format = number_format
+            if shade[r, c] > 0:
+                cell.fill = INCREASE_FILL
+            elif shade[r, c] < 0:
+                cell.fill = DECREASE_FILL
+            if highlight and (r, c) in highlight:
+                cell.font = Font(bold=True)
+
+def write_comparison_excel(result, output_path):
+    """
+    写出对比工作簿：本期数值、每个基期的差额和增幅各一个工作表 (增长标红、下降标绿，
+    变动最大的单元格加粗)，以及变动排行表。成功返回 True。
+    """
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    try:
+        wb = Workbook()
+        ws = wb.active
+        used = {"变动排行"}
+        ws.title = sheet_title(f"本期_{result['labels'][0]}", used)
+        _write_matrix(ws, result, result['values'][0])
+        _format_sheet(ws)
+
+        dept_pos = {d: i for i, d in enumerate(result['departments'])}
+        col_pos = {c: i for i, c in enumerate(result['columns'])}
+        for k, label in enumerate(result['labels'][1:]):
+            delta = result['delta'][k]
+            highlight = {(dept_pos[m['department']], col_pos[m['column']]) for m in result['top_movers'][k]}
+
+            ws = wb.create_sheet(sheet_title(f"差额_{label}", used))
+            _write_matrix(ws, result, delta, shade=delta, highlight=highlight)
+            _format_sheet(ws)
+
+            ws = wb.create_sheet(sheet_title(f"增幅_{label}", used))
+            _write_matrix(ws, result, result['pct'][k], number_format='0.0%', shade=delta, highlight=highlight)
+            _format_sheet(ws)
+
+        ws = wb.create_sheet("变动排行")
+        ws.append(['对比期', result['dept_col'], '项目', '本期', '基期', '差额', '增幅'])
+        for k, label in enumerate(result['labels'][1:]):
+            for m in result['top_movers'][k]:
+                ws.append([label, m['department'], m['column'], m['current'], m['base'], m['delta'], m['pct']])
+                ws.cell(row=ws.max_row, column=7).number_format = '0.0%'
+                ws.cell(row=ws.max_row, column=6).fill = INCREASE_FILL if m['delta'] > 0 else DECREASE_FILL
+        _format_sheet(ws)
+
+        wb.save(output_path)
+        print(f"对比完成! 文件已保存: {output_path}")
+        return True
+    except Exception as e:
+        print(f"保存失败: {e}")
+        return False
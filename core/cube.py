@@ -0,0 +1,307 @@
+"""
+期间立方体：由每月的处理结果构建 (月份 × 科室 × 列) 的金额数组，并沿月份轴保存前缀和，
+任意连续月份区间 (一季度、3 月至 8 月、截至某月的本年累计) 的合计只需一次数组相减：
+    合计[i..j] = prefix[j + 1] - prefix[i]
+不再需要对每个区间重新读取和合并文件。
+
+金额以 int64 分保存 (core.money)，前缀和相减的结果与逐文件精确合并完全一致。
+立方体目录中的文件:
+    meta.json               月份 (按时间排序)、科室、列、科室列名、各月来源文件和出现的科室/列、版本号
+    prefix-<版本号>.npy      (月份数 + 1, 科室, 列) 的前缀和，prefix[0] 为 0，查询时以只读内存映射打开
+
+加入或替换一个月份时只读取该月的文件：该月之前的前缀和原样复制，之后的每一行加上该月的变化量，
+写入新版本的 .npy 后原子替换 meta.json，查询中的请求继续使用已打开的旧版本。
+读写元数据时持有目录中 .lock 文件的 fcntl 锁 (更新为排他锁)，多个 worker 进程和命令行可以同时使用同一立方体。
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import bisect
+import argparse
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+from core import money
+from core.compare import load_compare_frame
+from core.merger import write_merged_excel
+from core.results_db import extract_period
+
+try:
+    import fcntl
+except ImportError:  # Windows：只有进程内的锁
+    fcntl = None
+
+META_FILENAME = 'meta.json'
+LOCK_FILENAME = '.lock'
+PERIOD_PATTERN = re.compile(r'^20\d{4}$')
+
+class CubeError(ValueError):
+    """月份、区间参数无效，或立方体中没有所需的数据"""
+
+def check_period(period, name='月份'):
+    """校验年月 (如 202503)，无效时抛出 CubeError"""
+    if not period or not PERIOD_PATTERN.match(str(period)) or not 1 <= int(str(period)[4:]) <= 12:
+        raise CubeError(f"{name}格式无效 (应为 YYYYMM): {period}")
+    return str(period)
+
+def month_cents(paths):
+    """读取同一月份的一个或多个处理结果并精确相加，返回 (以科室为索引的 int64 分数据框, 科室列名)"""
+    frames, dept_col = [], None
+    for path in paths:
+        frame, index_name = load_compare_frame(path)
+        if dept_col is not None and index_name != dept_col:
+            raise CubeError(f"同一月份的文件科室列不一致: {dept_col} / {index_name}")
+        dept_col = index_name
+        frames.append(frame)
+    return money.sum_frames_exact(frames), dept_col
+
+def _extend(labels, new):
+    """将新出现的标签按出现顺序追加到 labels，返回 (新 labels, new 在其中的位置)"""
+    positions = {label: i for i, label in enumerate(labels)}
+    labels = list(labels)
+    for label in new:
+        if label not in positions:
+            positions[label] = len(labels)
+            labels.append(label)
+    return labels, [positions[label] for label in new]
+
+class PeriodCube:
+    def __init__(self, cube_dir):
+        self.cube_dir = cube_dir
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.cube_dir, name)
+
+    @contextmanager
+    def _locked(self, exclusive=True):
+        """进程内的线程锁加上立方体目录中的文件锁 (跨进程)"""
+        with self._lock:
+            os.makedirs(self.cube_dir, exist_ok=True)
+            with open(self._path(LOCK_FILENAME), 'a') as f:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_meta(self):
+        path = self._path(META_FILENAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_meta(self, meta):
+        tmp_path = self._path(META_FILENAME + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(META_FILENAME))
+
+    def _snapshot(self):
+        """在锁内读取元数据并以只读内存映射打开对应版本的前缀和；之后的并发更新不影响已打开的版本"""
+        with self._locked(exclusive=False):
+            meta = self._read_meta()
+            if meta is None or not meta['periods']:
+                raise CubeError("期间立方体中还没有任何月份")
+            prefix = np.load(self._path(meta['prefix_file']), mmap_mode='r')
+        return meta, prefix
+
+    def info(self):
+        """立方体状态：月份、科室数、列数、各月来源文件"""
+        with self._locked(exclusive=False):
+            meta = self._read_meta()
+        if meta is None:
+            return {'periods': [], 'departments': 0, 'columns': 0, 'version': 0, 'sources': {}}
+        return {
+            'cube_id': meta['cube_id'],
+            'dept_col': meta['dept_col'],
+            'periods': meta['periods'],
+            'departments': len(meta['departments']),
+            'columns': len(meta['columns']),
+            'version': meta['version'],
+            'sources': {p: {k: v for k, v in s.items() if k != 'present'} for p, s in meta['sources'].items()},
+        }
+
+    def add_month(self, paths, period=None):
+        """
+        加入或替换一个月份。paths 为该月的一个或多个处理结果 (相加)，period 默认取第一个文件名中的年月。
+        返回 {'period', 'replaced', 'departments', 'columns', 'version'}
+        """
+        period = check_period(period or extract_period(os.path.basename(paths[0])))
+        # 读取文件是最耗时的部分，不持有锁
+        month, dept_col = month_cents(paths)
+
+        with self._locked():
+            # cube_id 区分不同的立方体实例 (目录重建后版本号从 1 重新开始)
+            meta = self._read_meta() or {
+                'cube_id': uuid.uuid4().hex, 'dept_col': dept_col, 'periods': [], 'departments': [], 'columns': [],
+                'version': 0, 'prefix_file': None, 'sources': {},
+            }
+            if meta['dept_col'] != dept_col:
+                raise CubeError(f"科室列与立方体不一致: {dept_col} (立方体为 {meta['dept_col']})")
+
+            if meta['prefix_file']:
+                old = np.load(self._path(meta['prefix_file']), mmap_mode='r')
+            else:
+                old = np.zeros((1, 0, 0), dtype=np.int64)
+            old_d, old_c = old.shape[1], old.shape[2]
+
+            # 新出现的科室和列追加在后面，已有的位置不变
+            departments, rows = _extend(meta['departments'], month.index.tolist())
+            columns, cols = _extend(meta['columns'], month.columns.tolist())
+            periods = list(meta['periods'])
+            replaced = period in periods
+            k = bisect.bisect_left(periods, period)
+            if not replaced:
+                periods.insert(k, period)
+
+            month_values = np.zeros((len(departments), len(columns)), dtype=np.int64)
+            month_values[np.ix_(rows, cols)] = month.to_numpy(dtype=np.int64)
+            # 替换时加上与原月份的差额；插入时之后的前缀和整体后移一行并加上该月
+            delta = month_values
+            if replaced:
+                delta = month_values.copy()
+                delta[:old_d, :old_c] -= np.asarray(old[k + 1]) - np.asarray(old[k])
+            shift = 0 if replaced else 1
+
+            version = meta['version'] + 1
+            prefix_file = f"prefix-{version}.npy"
+            os.makedirs(self.cube_dir, exist_ok=True)
+            tmp_path = self._path(prefix_file + '.tmp')
+            shape = (len(periods) + 1, len(departments), len(columns))
+            prefix = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.int64, shape=shape)
+            try:
+                prefix[:k + 1, :old_d, :old_c] = old[:k + 1]
+                row = np.zeros(shape[1:], dtype=np.int64)
+                for t in range(k + 1, shape[0]):
+                    row[:old_d, :old_c] = old[t - shift]
+                    prefix[t] = money.add_cents(row, delta)
+                prefix.flush()
+            except Exception:
+                del prefix
+                os.remove(tmp_path)
+                raise
+            del prefix
+            os.replace(tmp_path, self._path(prefix_file))
+
+            old_file = meta['prefix_file']
+            meta.update(periods=periods, departments=departments, columns=columns,
+                        version=version, prefix_file=prefix_file)
+            meta['sources'][period] = {
+                'files': [os.path.basename(p) for p in paths],
+                'updated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                # 该月出现的科室和列 (位置)，区间结果只输出区间内出现过的科室和列
+                'present': {'departments': sorted(set(rows)), 'columns': sorted(set(cols))},
+            }
+            self._write_meta(meta)
+
+            del old
+            if old_file:
+                try:
+                    os.remove(self._path(old_file))
+                except OSError:
+                    pass
+
+        print(f"期间立方体{'替换' if replaced else '加入'} {period}: {len(month)} 个科室, {month.shape[1]} 列")
+        return {'period': period, 'replaced': replaced, 'departments': len(departments),
+                'columns': len(columns), 'version': version}
+
+    def range_total(self, start=None, end=None):
+        """
+        start 至 end (含，年月) 之间所有月份的合计，省略时为最早 / 最新的月份。
+        返回与 compute_merge 相同格式的结果字典 (可直接写出或生成汇总)，另含 periods 和 totals。
+        """
+        start = check_period(start, '起始月份') if start else None
+        end = check_period(end, '结束月份') if end else None
+        meta, prefix = self._snapshot()
+        periods = meta['periods']
+        i = bisect.bisect_left(periods, start) if start else 0
+        j = bisect.bisect_right(periods, end) if end else len(periods)
+        if i >= j:
+            raise CubeError(f"{start or '最早'} 至 {end or '最新'} 之间没有数据")
+
+        # 一次相减得到整个区间的合计
+        cents = np.asarray(prefix[j]) - np.asarray(prefix[i])
+
+        present = [meta['sources'][p]['present'] for p in periods[i:j]]
+        rows = sorted(set().union(*(s['departments'] for s in present)))
+        cols = sorted(set().union(*(s['columns'] for s in present)))
+        cents = cents[np.ix_(rows, cols)]
+
+        df = pd.DataFrame(money.from_cents(cents), columns=[meta['columns'][c] for c in cols])
+        df.insert(0, meta['dept_col'], [meta['departments'][r] for r in rows])
+        return {
+            'kind': 'merge',
+            'df': df,
+            'dept_col': meta['dept_col'],
+            'files': [f for p in periods[i:j] for f in meta['sources'][p]['files']],
+            'periods': periods[i:j],
+            'totals': money.from_cents(cents.sum(axis=0)).tolist(),
+            'version': meta['version'],
+            'cube_id': meta['cube_id'],
+        }
+
+    def year_to_date(self, period):
+        """本年 1 月至 period 的累计"""
+        period = check_period(period)
+        return self.range_total(period[:4] + '01', period)
+
+def range_to_json(result):
+    """区间合计转换为 JSON 可序列化的字典 (行为 [科室, 各列金额...])"""
+    df = result['df']
+    return {
+        'periods': result['periods'],
+        'start': result['periods'][0],
+        'end': result['periods'][-1],
+        'dept_col': result['dept_col'],
+        'columns': df.columns[1:].tolist(),
+        'rows': [[row[0]] + [round(v, 2) for v in row[1:]] for row in df.itertuples(index=False, name=None)],
+        'totals': dict(zip(df.columns[1:].tolist(), result['totals'])),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="期间立方体：加入月度处理结果，查询任意月份区间的合计")
+    parser.add_argument('cube_dir', help="立方体目录")
+    sub = parser.add_subparsers(dest='command', required=True)
+    add = sub.add_parser('add', help="加入或替换月份 (文件按文件名中的年月分组，同一月份的文件相加)")
+    add.add_argument('files', nargs='+', help="处理结果 .xls/.xlsx")
+    add.add_argument('--period', default=None, help="指定月份 (YYYYMM)，全部文件计入该月")
+    query = sub.add_parser('range', help="区间合计")
+    query.add_argument('--start', default=None, help="起始月份 (YYYYMM)")
+    query.add_argument('--end', default=None, help="结束月份 (YYYYMM)")
+    query.add_argument('--ytd', default=None, help="本年累计至该月 (YYYYMM)，代替 --start/--end")
+    query.add_argument('-o', '--output', default=None, help="写出 xlsx，省略时输出 JSON")
+    sub.add_parser('info', help="立方体状态")
+    args = parser.parse_args(argv)
+
+    cube = PeriodCube(args.cube_dir)
+    try:
+        if args.command == 'add':
+            groups = {}
+            for path in args.files:
+                groups.setdefault(args.period or extract_period(os.path.basename(path)), []).append(path)
+            for period, paths in sorted(groups.items(), key=lambda item: str(item[0])):
+                cube.add_month(paths, period=period)
+        elif args.command == 'range':
+            result = cube.year_to_date(args.ytd) if args.ytd else cube.range_total(args.start, args.end)
+            if args.output:
+                return 0 if write_merged_excel(result, os.path.abspath(args.output)) else 1
+            print(json.dumps(range_to_json(result), ensure_ascii=False, indent=2))
+        else:
+            print(json.dumps(cube.info(), ensure_ascii=False, indent=2))
+    except (CubeError, money.MoneyError) as e:
+        print(f"错误: {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
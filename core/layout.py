@@ -0,0 +1,179 @@
+"""
+列解析计划缓存。
+
+HIS 每月导出的报表只有少数几种版式。每个文件都重复做的列名处理 (去空格和换行、过滤 Unnamed/nan 列、
+识别科室列、按配置查找每个项目的分组) 只取决于表头行和分组配置，
+因此按 (表头原始单元格签名, 分组配置签名, 列投影) 缓存解析结果 (位置计划)：
+版式相同的文件直接按列位置从原始网格中取数，不再逐列处理列名。
+
+- 处理计划 (process_plan): 科室列、合计列、明细列的位置，明细列的分组 ID 和分组矩阵
+- 合并计划 (merge_plan): 科室 (索引) 列位置、保留的数值列位置和清洗后的列名
+"""
+
+import json
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+
+from core.readers import header_names, column_array
+from core.result_store import ResultStore
+
+DEPT_CANDIDATES = ['开单科室', '执行科室', '病人所在病区']
+LAYOUT_CACHE_SIZE = 64
+
+_plans = ResultStore(max_items=LAYOUT_CACHE_SIZE)
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+def header_signature(cells):
+    """表头行原始单元格 (含位置和类型) 的签名"""
+    return hashlib.sha1(repr(tuple(cells)).encode('utf-8')).hexdigest()
+
+def config_signature(group_summaries, item_to_group):
+    """分组配置的签名 (同一配置对象只计算一次)"""
+    payload = json.dumps([group_summaries, item_to_group], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def _cached(key, build):
+    """按 key 取缓存的计划，没有则构建；key 为 None 时不缓存"""
+    if key is not None:
+        plan = _plans.get(key)
+        if plan is not None:
+            with _stats_lock:
+                _stats['hits'] += 1
+            return plan
+    plan = build()
+    with _stats_lock:
+        _stats['misses'] += 1
+    if key is not None and plan is not None:
+        _plans.put(key, plan)
+    return plan
+
+def cache_info():
+    """缓存命中统计"""
+    with _stats_lock:
+        return dict(_stats, size=len(_plans))
+
+def clear_cache():
+    global _plans
+    _plans = ResultStore(max_items=LAYOUT_CACHE_SIZE)
+    with _stats_lock:
+        _stats.update(hits=0, misses=0)
+
+def _usecols_key(usecols):
+    """列投影函数的缓存键 (Projection.column_filter 提供)；无法识别的函数返回 False (不缓存)"""
+    if usecols is None:
+        return ''
+    return getattr(usecols, 'cache_key', False)
+
+# --- 处理计划 ---
+
+def build_process_plan(names, item_to_group, usecols=None):
+    """
+    由列名构建处理计划，找不到科室列或合计列时返回 None:
+    {'dept_col', 'dept_pos', 'total_pos', 'detail_pos', 'detail_cols', 'detail_gids', 'membership'}
+    位置均为 names 中的下标；membership 为 (明细列, 7) 的 0/1 (可重复计数) 分组矩阵。
+    """
+    kept = [(pos, str(name).strip()) for pos, name in enumerate(names) if usecols is None or usecols(name)]
+    stripped = [name for _, name in kept]
+
+    dept_col = next((c for c in DEPT_CANDIDATES if c in stripped), None)
+    if dept_col is None or '合计' not in stripped:
+        return None
+
+    meta_cols = [dept_col, '合计']
+    detail = [(pos, name) for pos, name in kept if name not in meta_cols and not name.startswith('Unnamed')]
+    detail_gids = [item_to_group.get(name, [7]) for _, name in detail]
+    membership = np.zeros((len(detail), 7), dtype=np.int64)
+    for j, gids in enumerate(detail_gids):
+        for gid in gids:
+            if 1 <= gid <= 7:
+                membership[j, gid - 1] += 1
+
+    return {
+        'dept_col': dept_col,
+        'dept_pos': kept[stripped.index(dept_col)][0],
+        'total_pos': kept[stripped.index('合计')][0],
+        'detail_pos': [pos for pos, _ in detail],
+        'detail_cols': [name for _, name in detail],
+        'detail_gids': detail_gids,
+        'membership': membership,
+    }
+
+def process_plan(header_cells, group_summaries, item_to_group, usecols=None, config_key=None):
+    """按表头原始单元格取缓存的处理计划 (见 build_process_plan)"""
+    usecols_key = _usecols_key(usecols)
+    key = None
+    if usecols_key is not False:
+        config_key = config_key or config_signature(group_summaries, item_to_group)
+        key = ('process', header_signature(header_cells), config_key, usecols_key)
+    return _cached(key, lambda: build_process_plan(header_names(list(header_cells)), item_to_group, usecols))
+
+def process_frame(body, plan):
+    """
+    按处理计划从原始网格 (表头之后的行) 中按位置取列，
+    返回 科室 | 合计 | 明细... 的数据框，与按列名读取后选出的列等价。
+    """
+    positions = [plan['dept_pos'], plan['total_pos']] + plan['detail_pos']
+    names = [plan['dept_col'], '合计'] + plan['detail_cols']
+    data = {j: column_array(body[:, pos]) for j, pos in enumerate(positions)}
+    df = pd.DataFrame(data, index=pd.RangeIndex(len(body)), columns=range(len(positions)))
+    df.columns = names
+    return df
+
+# --- 合并计划 ---
+
+def _clean_merge_name(name):
+    return str(name).replace('\r', '').replace('\n', '').strip()
+
+def build_merge_plan(names, common_index_name, usecols=None):
+    """
+    由列名构建合并计划 (规则同 merger.load_merge_frame):
+    {'index_pos', 'value_pos', 'value_cols', 'column_order'}
+    """
+    kept = [(pos, _clean_merge_name(name)) for pos, name in enumerate(names) if usecols is None or usecols(name)]
+    if not kept:
+        return None
+    cleaned = [name for _, name in kept]
+
+    # 主键列：精确匹配，否则模糊匹配 '科室'，否则取第一列
+    if common_index_name in cleaned:
+        k = cleaned.index(common_index_name)
+    else:
+        k = next((i for i, name in enumerate(cleaned) if '科室' in name), 0)
+
+    rest = kept[:k] + kept[k + 1:]
+    values = [(pos, name) for pos, name in rest
+              if not name.startswith('Unnamed') and name.lower() not in ('nan', 'none')]
+    return {
+        'index_pos': kept[k][0],
+        'value_pos': [pos for pos, _ in values],
+        'value_cols': [name for _, name in values],
+        'column_order': [name for _, name in rest],
+    }
+
+def merge_plan(header_cells, common_index_name, usecols=None):
+    """按表头原始单元格取缓存的合并计划 (见 build_merge_plan)"""
+    usecols_key = _usecols_key(usecols)
+    key = None
+    if usecols_key is not False:
+        key = ('merge', header_signature(header_cells), common_index_name, usecols_key)
+    return _cached(key, lambda: build_merge_plan(header_names(list(header_cells)), common_index_name, usecols))
+
+def merge_frame(body, plan, common_index_name):
+    """
+    按合并计划从原始网格中取数，返回 (以科室为索引的纯数值数据框, 原始列顺序)，
+    与 merger.load_merge_frame 按列名处理的结果等价。
+    """
+    index = pd.Index(column_array(body[:, plan['index_pos']]), name=common_index_name)
+    n = len(plan['value_pos'])
+    values = np.zeros((len(body), n))
+    for j, pos in enumerate(plan['value_pos']):
+        values[:, j] = pd.to_numeric(pd.Series(column_array(body[:, pos])), errors='coerce').fillna(0).to_numpy()
+    df = pd.DataFrame(values, index=index, columns=plan['value_cols'])
+
+    # 移除“制表人”行
+    if df.index.dtype == 'object':
+        df = df[~df.index.astype(str).str.contains("制表人", na=False)]
+    return df, list(plan['column_order'])
@@ -1,9 +1,27 @@
 import pandas as pd
+import numpy as np
 import os
 import re
+import time
+from openpyxl import Workbook
 from openpyxl.utils import get_column_letter
 from openpyxl.styles import Alignment
 
+from core.readers import read_excel, read_grid
+from core.layout import merge_plan, merge_frame
+from core.config_loader import get_processor_config, parse_group_config
+from core.progress import emit, stage
+from core.results_db import extract_period
+from core import money
+
+# 多期间宽表合并中各期合计的期间标签
+WIDE_TOTAL_LABEL = '各期合计'
+
+def _has_numeric_value(values):
+    """该行 (不含首列) 是否有数值单元格"""
+    return any(isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, bool) and not pd.isna(v)
+               for v in values)
+
 def find_header_row(file_path):
     """
     寻找有效的表头行索引。
@@ -13,7 +31,7 @@ def find_header_row(file_path):
     """
     try:
         # 读取前 20 行，不带 header
-        df_preview = pd.read_excel(file_path, header=None, nrows=20)
+        df_preview = read_excel(file_path, header=None, nrows=20)
         
         keywords = ['科室', '费', '金额', '人数', '项目', '合计']
         
@@ -29,6 +47,10 @@ def find_header_row(file_path):
         candidate_rows = []
         
         for i, row in df_preview.iterrows():
+            # 找到表头后，第一行带数值的行是数据区的开始，之后的行不再作为表头候选
+            # (科室名本身可能含“科室”“费”等关键词，如“科室1”“收费处”)
+            if candidate_rows and _has_numeric_value(row.iloc[1:]):
+                break
             row_str = "".join(row.astype(str).tolist())
             # 检查是否包含关键词
             if any(k in row_str for k in keywords):
@@ -57,124 +79,308 @@ def find_header_row(file_path):
     except Exception:
         return 0, "科室"
 
-def merge_excel_files(input_dir='excels/data_aggregation', output_dir='excels/merged', output_filename=None):
-    if not os.path.exists(input_dir):
-        print(f"错误: 输入目录不存在 {input_dir}")
-        return None
+def load_merge_frame(file_path, header_row, common_index_name, usecols=None):
+    """
+    读取单个文件并规范化为以科室为索引的纯数值数据框。
+    usecols 为列选择函数 (列投影)，未选中的列不读取。
+    列名处理 (去除换行空格、识别科室列、去除无效列) 按表头版式缓存为列位置计划 (见 core.layout)，
+    相同版式的文件直接按位置取数。
+    返回: (df, column_order)，column_order 为去掉索引列后的原始列顺序。
+    """
+    grid = read_grid(file_path)
+    plan = merge_plan(grid[header_row], common_index_name, usecols) if header_row < len(grid) else None
+    if plan is None:
+        return pd.DataFrame(index=pd.Index([], name=common_index_name)), []
+    return merge_frame(grid[header_row + 1:], plan, common_index_name)
 
+def list_excel_files(input_dir):
+    """列出目录下待合并的 Excel 文件 (跳过临时锁文件)，按文件名排序"""
     files_to_process = [
         f for f in os.listdir(input_dir) 
         if (f.endswith('.xlsx') or f.endswith('.xls')) 
         and not f.startswith('~') and not f.startswith('.~')
     ]
+    files_to_process.sort()
+    return files_to_process
+
+def default_output_filename(files_to_process):
+    """根据第一个文件名中的年月推断默认输出文件名"""
+    output_name_base = "合并汇总"
+    # 尝试提取日期
+    match = re.search(r'(20\d{4}|20\d{2})', files_to_process[0])
+    if match: output_name_base += f"_{match.group(1)}"
+    return f"{output_name_base}.xlsx"
+
+def finalize_merged_frame(df_total, common_index_name, column_order):
+    """将以科室为索引的累加结果还原为输出数据框：科室列在首位，其余列保持第一个文件的顺序"""
+    # 后处理
+    df_total = df_total.reset_index()
+    
+    # --- 恢复列顺序 ---
+    # 1. 索引列必须在第一位
+    final_cols = [common_index_name]
+    
+    # 2. 按照第一个文件的顺序添加存在的列
+    current_cols_set = set(df_total.columns)
+    
+    for col in column_order:
+        if col in current_cols_set and col != common_index_name:
+            final_cols.append(col)
+            
+    # 3. 添加新出现的列 (追加在后面)
+    for col in df_total.columns:
+        if col not in final_cols:
+            final_cols.append(col)
+            
+    # (已移除) 特殊处理：强制移动 '合计' 到最后的逻辑已删除，以保持原文件顺序
+
+    # 应用顺序
+    df_total = df_total[final_cols]
+    return df_total
+
+def compute_merge(input_dir='excels/data_aggregation', exact=False, projection=None, custom_config=None,
+                  progress=None, wide=False):
+    """
+    合并目录下所有文件，但不写出 Excel。
+    exact 为 True 时以 int64 分精确累加，为 'strict' 时遇到不足一分的金额报错 (见 core.money)。
+    projection 指定只合并部分分组/项目列和科室 (分组按 custom_config 或默认配置解析)。
+    progress 为进度回调，报告每个文件的开始/结束和 header / combine 阶段 (见 core.progress)。
+    wide 为 True 时按期间分列合并 (见 compute_wide_merge_paths)。
+    返回结果字典，失败返回 None:
+    {'kind': 'merge', 'df': 合并后的数据框, 'dept_col': 主键列名, 'files': 参与合并的文件名}
+    """
+    if not os.path.exists(input_dir):
+        print(f"错误: 输入目录不存在 {input_dir}")
+        return None
+
+    files_to_process = list_excel_files(input_dir)
     
     if not files_to_process:
         print(f"在 {input_dir} 未找到 Excel 文件。")
         return None
 
-    files_to_process.sort()
-    
+    merge_paths = compute_wide_merge_paths if wide else compute_merge_paths
+    return merge_paths([os.path.join(input_dir, f) for f in files_to_process], exact=exact,
+                       projection=projection, custom_config=custom_config, progress=progress)
+
+def _resolve_projection(projection, custom_config):
+    """按分组配置解析投影；投影参数无效时抛出 ValueError"""
+    if projection:
+        group_summaries, item_to_group = parse_group_config(custom_config) if custom_config else get_processor_config()
+        projection.resolve(group_summaries, item_to_group)
+
+def _projection_usecols(projection, common_index_name):
+    """读取时的列选择函数 (无列投影时为 None)，保留表头识别出的科室列"""
+    return projection.column_filter(index_name=common_index_name) if projection else None
+
+def compute_merge_paths(file_paths, exact=False, projection=None, custom_config=None, progress=None):
+    """合并给定的文件列表 (按列表顺序)，返回值同 compute_merge"""
+    if not file_paths:
+        return None
+
+    try:
+        _resolve_projection(projection, custom_config)
+    except ValueError as e:
+        print(f"投影参数无效: {e}")
+        return None
+    files_to_process = [os.path.basename(p) for p in file_paths]
+
     # 使用第一个文件来确定表头位置，假设同批次文件格式一致
-    first_file = os.path.join(input_dir, files_to_process[0])
-    header_row, common_index_name = find_header_row(first_file)
+    first_file = file_paths[0]
+    with stage(progress, 'header', file=files_to_process[0]):
+        header_row, common_index_name = find_header_row(first_file)
     print(f"检测到有效表头在第 {header_row + 1} 行，主键列推测为: {common_index_name}")
+    usecols = _projection_usecols(projection, common_index_name)
 
     df_total = None
     column_order = [] # 用于记录列的原始顺序
+    exact_frames = [] # 精确模式：先收集全部文件，再一次性按分累加
 
-    for idx, filename in enumerate(files_to_process):
-        file_path = os.path.join(input_dir, filename)
-        print(f"[{idx+1}/{len(files_to_process)}] 正在处理: {filename}")
+    total = len(files_to_process)
+    for idx, file_path in enumerate(file_paths):
+        filename = files_to_process[idx]
+        print(f"[{idx+1}/{total}] 正在处理: {filename}")
+        emit(progress, 'file_started', index=idx + 1, total=total, file=filename)
+        start = time.perf_counter()
         
         try:
-            # ... (Existing reading logic) ...
-            # 直接读取指定行作为 header
-            df_current = pd.read_excel(file_path, header=header_row)
-            
-            # 清洗列名：去除换行、空格
-            df_current.columns = [str(c).replace('\r', '').replace('\n', '').strip() for c in df_current.columns]
-            
-            # ... (Existing index setting logic) ...
-            if common_index_name in df_current.columns:
-                df_current.set_index(common_index_name, inplace=True)
-            else:
-                # 尝试模糊匹配
-                found = False
-                for col in df_current.columns:
-                    if '科室' in col:
-                        df_current.rename(columns={col: common_index_name}, inplace=True)
-                        df_current.set_index(common_index_name, inplace=True)
-                        found = True
-                        break
-                if not found and not df_current.empty:
-                    df_current.set_index(df_current.columns[0], inplace=True)
-                    df_current.index.name = common_index_name
+            df_current, current_order = load_merge_frame(file_path, header_row, common_index_name, usecols=usecols)
+            if projection and projection.filters_departments:
+                df_current = df_current.loc[projection.department_mask(df_current.index.to_series())]
 
             # 记录第一个文件的列顺序
             if idx == 0:
-                # 此时 index 已经被移出 columns 了，所以记录剩下的 columns 即可
-                column_order = df_current.columns.tolist()
-
-            # 移除“制表人”行
-            if df_current.index.dtype == 'object':
-                df_current = df_current[~df_current.index.astype(str).str.contains("制表人", na=False)]
-
-            # 移除无效列 (Unnamed, NaN)
-            df_current = df_current.loc[:, ~df_current.columns.str.startswith('Unnamed')]
-            df_current = df_current.loc[:, ~df_current.columns.str.lower().isin(['nan', 'none'])]
+                column_order = current_order
 
-            # 只保留数值列，且填充0
-            df_current = df_current.apply(pd.to_numeric, errors='coerce').fillna(0)
-
-            if df_total is None:
+            if exact:
+                exact_frames.append(df_current)
+            elif df_total is None:
                 df_total = df_current
             else:
                 df_total = df_total.add(df_current, fill_value=0)
+            emit(progress, 'file_finished', index=idx + 1, total=total, file=filename, ok=True,
+                 rows=len(df_current), cols=df_current.shape[1], duration=round(time.perf_counter() - start, 3))
                 
         except Exception as e:
             print(f"  -> 失败: {e}")
+            emit(progress, 'file_finished', index=idx + 1, total=total, file=filename, ok=False,
+                 error=str(e), duration=round(time.perf_counter() - start, 3))
             continue
 
+    if exact_frames:
+        with stage(progress, 'combine', files=len(exact_frames)) as info:
+            try:
+                df_cents = money.sum_frames_exact(exact_frames, fractional=money.fractional_mode(exact))
+            except money.MoneyError as e:
+                print(f"精确金额合并失败: {e}")
+                info.update(status='failed', error=str(e))
+                return None
+            # 只在输出时转换回元
+            df_total = pd.DataFrame(money.from_cents(df_cents.to_numpy()), index=df_cents.index, columns=df_cents.columns)
+
     if df_total is None:
         return None
 
-    # 后处理与保存
-    df_total.reset_index(inplace=True)
-    
-    # --- 恢复列顺序 ---
-    # 1. 索引列必须在第一位
-    final_cols = [common_index_name]
-    
-    # 2. 按照第一个文件的顺序添加存在的列
-    current_cols_set = set(df_total.columns)
-    
-    for col in column_order:
-        if col in current_cols_set and col != common_index_name:
-            final_cols.append(col)
-            
-    # 3. 添加新出现的列 (追加在后面)
-    for col in df_total.columns:
-        if col not in final_cols:
-            final_cols.append(col)
-            
-    # (已移除) 特殊处理：强制移动 '合计' 到最后的逻辑已删除，以保持原文件顺序
+    with stage(progress, 'finalize') as info:
+        df_final = finalize_merged_frame(df_total, common_index_name, column_order)
+        info.update(rows=len(df_final), cols=df_final.shape[1])
+    return {
+        'kind': 'merge',
+        'df': df_final,
+        'dept_col': common_index_name,
+        'files': files_to_process,
+    }
 
-    # 应用顺序
-    df_total = df_total[final_cols]
+def period_label(filename):
+    """文件名中的年月 (如 202503)，没有则取文件名"""
+    return extract_period(filename) or os.path.splitext(filename)[0]
 
-    
-    # 构造输出文件名
-    if not output_filename:
-        output_name_base = "合并汇总"
-        # 尝试提取日期
-        match = re.search(r'(20\d{4}|20\d{2})', files_to_process[0])
-        if match: output_name_base += f"_{match.group(1)}"
-        output_filename = f"{output_name_base}.xlsx"
-    if not output_filename.endswith('.xlsx'):
-        output_filename += '.xlsx'
-    
-    os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, output_filename)
+def _extend_index(index, labels):
+    """将新出现的标签按出现顺序追加到 index，返回 (新 index, labels 在其中的位置)"""
+    new = labels[~labels.isin(index)].unique()
+    if len(new):
+        index = index.append(new)
+    return index, index.get_indexer(labels)
+
+def compute_wide_merge_paths(file_paths, exact=False, projection=None, custom_config=None, progress=None):
+    """
+    多期间宽表合并：按文件名中的年月 (period_label) 分期，每个文件只读取一次，
+    累加到 (期间 × 科室 × 列) 的三维数组中，同一期间的多个文件相加，并计算各期合计。
+    参数含义同 compute_merge_paths。返回结果字典，失败返回 None:
+    {
+        'kind': 'merge_wide', 'df': 各期合计 (格式同 compute_merge 的 df，供汇总和预览),
+        'dept_col': 主键列名, 'files': 参与合并的文件名, 'periods': 期间标签 (按时间排序),
+        'departments': 科室, 'columns': 数值列, 'values': (期间, 科室, 列) 数组, 'total': (科室, 列) 数组
+    }
+    """
+    if not file_paths:
+        return None
+
+    try:
+        _resolve_projection(projection, custom_config)
+    except ValueError as e:
+        print(f"投影参数无效: {e}")
+        return None
+    files_to_process = [os.path.basename(p) for p in file_paths]
+
+    with stage(progress, 'header', file=files_to_process[0]):
+        header_row, common_index_name = find_header_row(file_paths[0])
+    print(f"检测到有效表头在第 {header_row + 1} 行，主键列推测为: {common_index_name}")
+    usecols = _projection_usecols(projection, common_index_name)
+
+    departments = pd.Index([], dtype=object)
+    columns = pd.Index([], dtype=object)
+    column_order = []
+    blocks = [] # (期间, 科室位置, 列位置, 数值)
+
+    total = len(files_to_process)
+    for idx, file_path in enumerate(file_paths):
+        filename = files_to_process[idx]
+        label = period_label(filename)
+        print(f"[{idx+1}/{total}] 正在处理: {filename} (期间 {label})")
+        emit(progress, 'file_started', index=idx + 1, total=total, file=filename, period=label)
+        start = time.perf_counter()
+
+        try:
+            df_current, current_order = load_merge_frame(file_path, header_row, common_index_name, usecols=usecols)
+            if projection and projection.filters_departments:
+                df_current = df_current.loc[projection.department_mask(df_current.index.to_series())]
+            # 同名科室先合并，保证每个科室在数组中只占一行
+            if not df_current.index.is_unique:
+                df_current = df_current.groupby(level=0, sort=False).sum()
+            if idx == 0:
+                column_order = current_order
+
+            departments, rows = _extend_index(departments, df_current.index)
+            columns, cols = _extend_index(columns, df_current.columns)
+            if exact:
+                values = money.to_cents(df_current.to_numpy(), fractional=money.fractional_mode(exact))
+            else:
+                values = df_current.to_numpy(dtype=float)
+            blocks.append((label, rows, cols, values))
+            emit(progress, 'file_finished', index=idx + 1, total=total, file=filename, period=label, ok=True,
+                 rows=len(df_current), cols=df_current.shape[1], duration=round(time.perf_counter() - start, 3))
+
+        except Exception as e:
+            print(f"  -> 失败: {e}")
+            emit(progress, 'file_finished', index=idx + 1, total=total, file=filename, period=label, ok=False,
+                 error=str(e), duration=round(time.perf_counter() - start, 3))
+            # 金额无法精确转换时整个合并失败，不能静默跳过该文件
+            if isinstance(e, money.MoneyError):
+                return None
+            continue
+
+    if not blocks:
+        return None
+
+    # 期间按标签排序 (年月即时间顺序)；列按第一个文件的顺序，新出现的列追加在后面
+    periods = sorted({label for label, _, _, _ in blocks})
+    period_pos = {label: p for p, label in enumerate(periods)}
+    order = [c for c in column_order if c in columns] + [c for c in columns if c not in column_order]
+    col_perm = pd.Index(order).get_indexer(columns)
+
+    with stage(progress, 'combine', periods=len(periods)) as info:
+        cube = np.zeros((len(periods), len(departments), len(columns)), dtype=np.int64 if exact else float)
+        try:
+            for label, rows, cols, values in blocks:
+                block = cube[period_pos[label]]
+                ix = np.ix_(rows, col_perm[cols])
+                if exact:
+                    block[ix] = money.add_cents(block[ix], values)
+                else:
+                    block[ix] += values
+            if exact:
+                period_total = np.zeros(cube.shape[1:], dtype=np.int64)
+                for block in cube:
+                    period_total = money.add_cents(period_total, block)
+                # 只在输出时转换回元
+                cube, period_total = money.from_cents(cube), money.from_cents(period_total)
+            else:
+                period_total = cube.sum(axis=0)
+        except money.MoneyError as e:
+            print(f"精确金额合并失败: {e}")
+            info.update(status='failed', error=str(e))
+            return None
+        info.update(rows=len(departments), cols=len(order) * (len(periods) + 1))
+
+    df_total = pd.DataFrame(period_total, index=departments, columns=order)
+    df_total.index.name = common_index_name
+    return {
+        'kind': 'merge_wide',
+        'df': finalize_merged_frame(df_total, common_index_name, order),
+        'dept_col': common_index_name,
+        'files': files_to_process,
+        'periods': periods,
+        'departments': departments.tolist(),
+        'columns': order,
+        'values': cube,
+        'total': period_total,
+    }
+
+def write_merged_excel(result, output_path):
+    """将 compute_merge 的结果写出为单层表头的 xlsx，成功返回 True"""
+    df_total = result['df']
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
     print("正在保存...")
     try:
@@ -198,10 +404,86 @@ def merge_excel_files(input_dir='excels/data_aggregation', output_dir='excels/me
                 worksheet.column_dimensions[col_letter].width = min(max_len + 2, 40)
         
         print(f"完成! 文件已保存: {output_path}")
-        return output_path
+        return True
     except Exception as e:
         print(f"保存失败: {e}")
+        return False
+
+def write_wide_merged_excel(result, output_path):
+    """
+    将 compute_wide_merge_paths 的结果写出为双层表头的 xlsx，成功返回 True：
+    第一行为期间 (每个期间的列合并单元格，最后为各期合计)，第二行为项目列名，科室列跨两行。
+    """
+    periods = result['periods'] + [WIDE_TOTAL_LABEL]
+    columns = result['columns']
+    n_cols = len(columns)
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+
+    print("正在保存...")
+    try:
+        wb = Workbook()
+        ws = wb.active
+        ws.title = 'Sheet1'
+        ws.append([result['dept_col']] + [label for label in periods for _ in range(n_cols)])
+        ws.append([None] + columns * len(periods))
+        ws.merge_cells(start_row=1, start_column=1, end_row=2, end_column=1)
+        if n_cols > 1:
+            for p in range(len(periods)):
+                ws.merge_cells(start_row=1, start_column=2 + p * n_cols, end_row=1, end_column=1 + (p + 1) * n_cols)
+
+        # 每个科室一行：各期间的列依次排开，最后是各期合计
+        wide = np.concatenate(list(result['values']) + [result['total']], axis=1)
+        for dept, row in zip(result['departments'], wide.tolist()):
+            ws.append([dept] + row)
+
+        center_alignment = Alignment(horizontal='center', vertical='center')
+        for column in ws.columns:
+            max_len = 0
+            col_letter = get_column_letter(column[0].column)
+            for cell in column:
+                cell.alignment = center_alignment
+                try:
+                    if cell.value:
+                        l = len(str(cell.value).encode('gbk'))
+                        if l > max_len: max_len = l
+                except: pass
+            ws.column_dimensions[col_letter].width = min(max_len + 2, 40)
+        ws.freeze_panes = 'B3'
+
+        wb.save(output_path)
+        print(f"完成! 文件已保存: {output_path}")
+        return True
+    except Exception as e:
+        print(f"保存失败: {e}")
+        return False
+
+def write_merge_result(result, output_path):
+    """按结果类型 (merge / merge_wide) 写出合并结果"""
+    if result['kind'] == 'merge_wide':
+        return write_wide_merged_excel(result, output_path)
+    return write_merged_excel(result, output_path)
+
+def merge_excel_files(input_dir='excels/data_aggregation', output_dir='excels/merged', output_filename=None, exact=False,
+                      projection=None, progress=None, wide=False):
+    result = compute_merge(input_dir, exact=exact, projection=projection, progress=progress, wide=wide)
+    if result is None:
         return None
 
+    # 构造输出文件名
+    if not output_filename:
+        if wide:
+            output_filename = f"分期汇总_{result['periods'][0]}-{result['periods'][-1]}.xlsx"
+        else:
+            output_filename = default_output_filename(result['files'])
+    if not output_filename.endswith('.xlsx'):
+        output_filename += '.xlsx'
+    
+    output_path = os.path.join(output_dir, output_filename)
+    with stage(progress, 'write') as info:
+        if write_merge_result(result, output_path):
+            return output_path
+        info['status'] = 'failed'
+    return None
+
 if __name__ == "__main__":
     merge_excel_files()
@@ -0,0 +1,127 @@
+"""
+精确金额运算：金额在读取时转换为 int64 (分)，分组和合并的累加全部在整数数组上进行，
+只在写出时转换回元，结果与财务系统的精确合计一致，校验时可以直接判断相等。
+
+- 超过 2^53 分 (约 900 万亿元) 的金额无法从浮点数精确转换，视为溢出
+- 累加前按各列绝对值上界检查，可能超出 int64 时抛出 MoneyOverflowError
+- 不足一分的金额 (如 12.345) 按 fractional 参数处理：'round' 四舍五入 (远离零)，'error' 报错
+
+处理、合并接口和批量处理的 exact 参数：True 为精确累加 (不足一分四舍五入)，'strict' 为精确累加且
+遇到不足一分的金额时报错 (见 fractional_mode)。
+"""
+
+import numpy as np
+import pandas as pd
+
+INT64_MAX = np.iinfo(np.int64).max
+# float64 能精确表示的整数上限
+FLOAT_EXACT_MAX = 2 ** 53
+
+class MoneyError(ValueError):
+    """金额无法精确转换 (如含有不足一分的部分且 fractional='error')"""
+
+class MoneyOverflowError(MoneyError):
+    """金额或累加结果超出 int64 分的表示范围"""
+
+def to_cents(values, fractional='round'):
+    """
+    将金额 (数值、数字文本、空值混合) 转换为 int64 分数组，形状不变。
+    非数字和空值按 0 处理，与 pd.to_numeric(errors='coerce').fillna(0) 一致。
+    """
+    arr = np.asarray(values)
+    if arr.dtype.kind in 'iu':
+        if arr.size and np.abs(arr).max() > INT64_MAX // 100:
+            raise MoneyOverflowError("金额超出 int64 分的表示范围")
+        return arr.astype(np.int64) * 100
+    if arr.dtype.kind != 'f':
+        flat = pd.to_numeric(pd.Series(arr.ravel(), dtype=object), errors='coerce').to_numpy(dtype=float)
+        arr = flat.reshape(arr.shape)
+
+    scaled = np.nan_to_num(arr.astype(float, copy=False), nan=0.0, posinf=np.inf, neginf=-np.inf) * 100
+    if scaled.size and not (np.abs(scaled) < FLOAT_EXACT_MAX).all():
+        raise MoneyOverflowError("金额超出可精确转换的范围 (2^53 分)")
+
+    cents = np.rint(scaled)
+    # 浮点表示误差 (如 0.1 * 100) 不算作不足一分
+    tolerance = 1e-6 + np.abs(scaled) * 1e-12
+    fraction = np.abs(scaled - cents) > tolerance
+    if fraction.any():
+        if fractional == 'error':
+            example = arr[fraction].ravel()[0]
+            raise MoneyError(f"发现 {int(fraction.sum())} 个不足一分的金额 (如 {example})")
+        # 四舍五入到分 (远离零)，不使用 rint 的银行家舍入
+        cents = np.where(fraction, np.sign(scaled) * np.floor(np.abs(scaled) + 0.5), cents)
+    return cents.astype(np.int64)
+
+def fractional_mode(exact):
+    """exact 参数对应的 to_cents fractional 取值"""
+    return 'error' if exact == 'strict' else 'round'
+
+EXACT_VALUES = {'1': True, 'true': True, 'yes': True, '0': False, 'false': False, 'no': False, '': False,
+                'strict': 'strict'}
+
+def parse_exact(value):
+    """
+    将请求参数或配置 (1/true/yes、0/false/no、strict) 解析为 exact 取值：False、True 或 'strict'。
+    无法识别的取值抛出 ValueError，避免要求精确金额的请求被静默地按浮点处理。
+    """
+    if isinstance(value, bool) or value is None:
+        return bool(value)
+    key = str(value).strip().lower()
+    if key not in EXACT_VALUES:
+        raise ValueError(f"无效的 exact 参数: {value} (可选 1/true/yes、0/false/no、strict)")
+    return EXACT_VALUES[key]
+
+def from_cents(cents):
+    """写出时转换回元 (float64，精确到分)"""
+    return np.asarray(cents, dtype=np.int64) / 100
+
+def _abs_bound(cents, axis=None):
+    """绝对值上界 (Python 整数，避免 int64 的 abs 在最小值处溢出)"""
+    if cents.size == 0:
+        return 0 if axis is None else [0] * cents.shape[1 - axis]
+    if axis is None:
+        return max(int(cents.max()), -int(cents.min()))
+    return [max(hi, -lo) for hi, lo in zip(cents.max(axis=axis).tolist(), cents.min(axis=axis).tolist())]
+
+def group_sums(cents, membership):
+    """
+    按分组求和：cents 为 (行, 明细列) 的分，membership 为 (明细列, 分组) 的 0/1 矩阵。
+    先用各列绝对值上界检查溢出，再一次整数矩阵乘法得到 (行, 分组) 的合计。
+    """
+    membership = np.asarray(membership, dtype=np.int64)
+    bounds = _abs_bound(cents, axis=0)
+    for g in range(membership.shape[1]):
+        if sum(b * m for b, m in zip(bounds, membership[:, g].tolist())) > INT64_MAX:
+            raise MoneyOverflowError(f"第 {g + 1} 组合计超出 int64 分的表示范围")
+    return cents @ membership
+
+def add_cents(total, cents):
+    """逐元素累加两个 int64 分数组，可能溢出时抛出 MoneyOverflowError"""
+    if _abs_bound(total) + _abs_bound(cents) > INT64_MAX:
+        raise MoneyOverflowError("累加结果超出 int64 分的表示范围")
+    return total + cents
+
+def sum_frames_exact(frames, fractional='round'):
+    """
+    以科室为索引的多个数据框按索引和列对齐后精确求和，返回 int64 分的数据框。
+    对齐顺序与 DataFrame.add(fill_value=0) 逐个累加的结果相同。
+    """
+    # 同名科室先合并，保证索引唯一
+    frames = [f.groupby(level=0, sort=False).sum() if not f.index.is_unique else f for f in frames]
+    index, columns = frames[0].index, frames[0].columns
+    for frame in frames[1:]:
+        if not index.equals(frame.index):
+            index = index.union(frame.index)
+        if not columns.equals(frame.columns):
+            columns = columns.union(frame.columns)
+
+    total = np.zeros((len(index), len(columns)), dtype=np.int64)
+    for frame in frames:
+        cents = to_cents(frame.to_numpy(), fractional=fractional)
+        rows = index.get_indexer(frame.index)
+        cols = columns.get_indexer(frame.columns)
+        block = np.zeros_like(total)
+        block[np.ix_(rows, cols)] = cents
+        total = add_cents(total, block)
+    return pd.DataFrame(total, index=index, columns=columns)
@@ -1,13 +1,35 @@
 import pandas as pd
+import numpy as np
 import os
 from openpyxl.utils import get_column_letter
 from openpyxl.styles import Alignment
 
 from core.config_loader import get_processor_config, parse_group_config
-
-def process_hospital_data(src_file='excels/data_export/全院收入_按科室202503门诊-开单科室.xls', 
-                          output_file='excels/data_aggregation/全院收入_按科室202503门诊-开单科室_带合并.xlsx',
-                          custom_config=None):
+from core.readers import read_grid, header_names
+from core.layout import build_process_plan, process_plan, process_frame, config_signature
+from core.results_db import save_result
+from core.transactions import pivot_transactions
+from core.progress import stage
+from core import money
+
+# 源文件格式：wide 为 HIS 透视导出 (每科室一行、每项目一列)，transactions 为收费明细长表
+INPUT_FORMATS = ('wide', 'transactions')
+
+def compute_hospital_data(src_file, custom_config=None, input_format='wide', exact=False, projection=None,
+                          progress=None):
+    """
+    读取源文件并完成分组计算，但不写出 Excel。
+    input_format 为 'transactions' 时，先将收费明细哈希聚合为科室 × 项目宽表。
+    exact 为 True 时分组合计以 int64 分精确累加，为 'strict' 时遇到不足一分的金额报错 (见 core.money)。
+    projection (core.projection.Projection) 指定只读取、计算和输出部分分组/项目和科室。
+    progress 为进度回调，报告 read / aggregate 阶段 (见 core.progress)。
+    返回结果字典 (供 process_hospital_data 写出、或供 API 直接汇总预览)，失败返回 None:
+    {
+        'kind': 'process', 'df': 最终数据框, 'header': 双层表头数据框,
+        'dept_col': 科室列名, 'group_cols': 输出的合计列名 (默认 7 个), 'detail_cols': 明细列名,
+        'source': 源文件名
+    }
+    """
     # 1. 确定分组映射规则
     if custom_config:
         print("使用用户自定义分组配置...")
@@ -18,51 +40,86 @@ def process_hospital_data(src_file='excels/data_export/全院收入_按科室202
 
     if not GROUP_SUMMARIES or not ITEM_TO_GROUP_ID:
          print("错误: 分组配置为空或无效。")
-         return False
+         return None
+    config_key = config_signature(GROUP_SUMMARIES, ITEM_TO_GROUP_ID)
+
+    # 投影：按分组配置解析要输出的分组，并在读取时只选择需要的列
+    output_gids = list(range(1, 8))
+    usecols = None
+    if projection:
+        try:
+            projection.resolve(GROUP_SUMMARIES, ITEM_TO_GROUP_ID)
+        except ValueError as e:
+            print(f"投影参数无效: {e}")
+            return None
+        output_gids = projection.output_group_ids()
+        usecols = projection.column_filter()
 
     print(f"正在读取源文件: {src_file}")
     if not os.path.exists(src_file):
         print(f"错误: 源文件不存在 {src_file}")
-        return False
+        return None
 
-    # 源文件表头在第 4 行 (index 3)
     try:
-        df_src = pd.read_excel(src_file, header=3)
+        with stage(progress, 'read', file=os.path.basename(src_file)) as info:
+            if input_format == 'transactions':
+                df_src = pivot_transactions(src_file)
+                plan = build_process_plan(df_src.columns.tolist(), ITEM_TO_GROUP_ID, usecols)
+                names = df_src.columns.tolist()
+                if plan:
+                    df_src = df_src.iloc[:, [plan['dept_pos'], plan['total_pos']] + plan['detail_pos']]
+            else:
+                # 源文件表头在第 4 行 (index 3)；相同版式的表头直接复用缓存的列位置计划
+                grid = read_grid(src_file)
+                if len(grid) <= 3:
+                    raise ValueError("源文件缺少表头行")
+                plan = process_plan(grid[3], GROUP_SUMMARIES, ITEM_TO_GROUP_ID, usecols, config_key=config_key)
+                names = header_names(list(grid[3]))
+                if plan:
+                    df_src = process_frame(grid[4:], plan)
+            if plan:
+                info.update(rows=len(df_src), cols=df_src.shape[1])
     except Exception as e:
         print(f"读取 Excel 失败: {e}")
-        return False
-    
-    # 清洗列名：去除前后空格
-    df_src.columns = df_src.columns.astype(str).str.strip()
-    
-    # 动态识别科室列名 (可能是 '开单科室'、'执行科室' 或 '病人所在病区')
-    dept_col = None
-    for col in ['开单科室', '执行科室', '病人所在病区']:
-        if col in df_src.columns:
-            dept_col = col
-            break
-            
-    if not dept_col:
-        print(f"无法在源文件中找到识别列（'开单科室'、'执行科室'或'病人所在病区'）。当前列名: {df_src.columns.tolist()[:5]}...")
-        return False
+        return None
 
-    # 基础列
-    meta_cols = [dept_col, '合计']
-    # 明细列 (过滤掉 Unnamed 和 基础列)
-    detail_cols = [c for c in df_src.columns if c not in meta_cols and not str(c).startswith('Unnamed')]
-    
-    # 2. 计算分组合计
-    group_sums = {} # {gid: pd.Series}
-    for gid in range(1, 8):
-        group_sums[gid] = pd.Series([0.0] * len(df_src))
+    # 科室列名可能是 '开单科室'、'执行科室' 或 '病人所在病区'
+    if not plan:
+        print(f"无法在源文件中找到识别列（'开单科室'、'执行科室'或'病人所在病区'）及'合计'列。当前列名: {names[:5]}...")
+        return None
+    dept_col = plan['dept_col']
+    # 明细列 (已过滤掉 Unnamed 和 基础列)
+    detail_cols = plan['detail_cols']
+    df_src.columns = [dept_col, '合计'] + detail_cols
 
-    for col in detail_cols:
-        # 获取该列所属组，没找到则默认归入 7 (其他)
-        gids = ITEM_TO_GROUP_ID.get(col.strip(), [7])
-        col_values = pd.to_numeric(df_src[col], errors='coerce').fillna(0)
-        for gid in gids:
-            if gid in group_sums:
-                group_sums[gid] += col_values
+    # 科室过滤在分组计算之前完成，未选中的科室不参与计算
+    if projection and projection.filters_departments:
+        df_src = df_src.loc[projection.department_mask(df_src[dept_col])].reset_index(drop=True)
+
+    # 2. 计算分组合计
+    with stage(progress, 'aggregate', rows=len(df_src), items=len(detail_cols)) as info:
+        group_sums = {} # {gid: pd.Series}
+        if exact:
+            # 明细金额转为整数分，用一次整数矩阵乘法得到 7 个分组合计
+            try:
+                cents = money.to_cents(df_src.iloc[:, 2:].to_numpy(), fractional=money.fractional_mode(exact))
+                sums = money.from_cents(money.group_sums(cents, plan['membership']))
+            except money.MoneyError as e:
+                print(f"精确金额计算失败: {e}")
+                info.update(status='failed', error=str(e))
+                return None
+            for gid in output_gids:
+                group_sums[gid] = pd.Series(sums[:, gid - 1])
+        else:
+            for gid in output_gids:
+                group_sums[gid] = pd.Series([0.0] * len(df_src))
+
+            for j, gids in enumerate(plan['detail_gids']):
+                # 所属组来自计划，没找到的项目默认归入 7 (其他)
+                col_values = pd.to_numeric(df_src.iloc[:, 2 + j], errors='coerce').fillna(0)
+                for gid in gids:
+                    if gid in group_sums:
+                        group_sums[gid] += col_values
 
     # 3. 构造输出数据框
     # 顺序：科室 | 合计 | 01合计 | ... | 07合计 | 明细...
@@ -71,8 +128,8 @@ def process_hospital_data(src_file='excels/data_export/全院收入_按科室202
         '合计': df_src['合计']
     }
     
-    # 添加 7 个合计列
-    for gid in range(1, 8):
+    # 添加合计列 (默认 7 个)
+    for gid in output_gids:
         gid_str = str(gid).zfill(2)
         col_name = GROUP_SUMMARIES[gid_str]
         final_cols_data[col_name] = group_sums[gid]
@@ -86,10 +143,9 @@ def process_hospital_data(src_file='excels/data_export/全院收入_按科室202
     # 4. 构造双层表头
     # 第一行：分组ID
     header_row_0 = [0, 0] 
-    for gid in range(1, 8):
+    for gid in output_gids:
         header_row_0.append(str(gid).zfill(2))
-    for col in detail_cols:
-        gids = ITEM_TO_GROUP_ID.get(col.strip(), [7])
+    for gids in plan['detail_gids']:
         # 如果有多个 ID，用 / 连接显示在表头
         header_row_0.append("/".join(map(str, gids)) if isinstance(gids, list) else gids)
 
@@ -98,6 +154,22 @@ def process_hospital_data(src_file='excels/data_export/全院收入_按科室202
 
     df_header = pd.DataFrame([header_row_0, header_row_1], columns=df_final.columns)
 
+    group_cols = [GROUP_SUMMARIES[str(gid).zfill(2)] for gid in output_gids]
+    return {
+        'kind': 'process',
+        'source': os.path.basename(src_file),
+        'df': df_final,
+        'header': df_header,
+        'dept_col': dept_col,
+        'group_cols': group_cols,
+        'detail_cols': detail_cols,
+    }
+
+def write_processed_excel(result, output_file):
+    """将 compute_hospital_data 的结果写出为带双层表头和样式的 xlsx"""
+    df_final = result['df']
+    df_header = result['header']
+
     # 5. 保存结果
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     try:
@@ -141,5 +213,29 @@ def process_hospital_data(src_file='excels/data_export/全院收入_按科室202
         print(f"保存失败: {e}")
         return False
 
+def process_hospital_data(src_file='excels/data_export/全院收入_按科室202503门诊-开单科室.xls', 
+                          output_file='excels/data_aggregation/全院收入_按科室202503门诊-开单科室_带合并.xlsx',
+                          custom_config=None,
+                          results_db=None,
+                          input_format='wide',
+                          exact=False,
+                          projection=None,
+                          progress=None):
+    result = compute_hospital_data(src_file, custom_config=custom_config, input_format=input_format, exact=exact,
+                                   projection=projection, progress=progress)
+    if result is None:
+        return False
+    # 可选：同时写入 SQLite 结果库，供按期间查询 (投影结果只含部分数据，不写入)
+    if results_db and not projection:
+        try:
+            save_result(results_db, result)
+        except Exception as e:
+            print(f"写入结果库失败: {e}")
+    with stage(progress, 'write') as info:
+        ok = write_processed_excel(result, output_file)
+        if not ok:
+            info['status'] = 'failed'
+    return ok
+
 if __name__ == "__main__":
     process_hospital_data()
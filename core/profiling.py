@@ -0,0 +1,161 @@
+"""
+按需性能剖析：对单次处理/合并计算同时运行 cProfile 和 tracemalloc，结果保存到剖析目录。
+只记录代码位置 (函数名、文件和行号)、调用次数、耗时和内存，不含任何数据内容，
+因此可以在生产环境中定位慢请求的热点，而不需要导出含患者信息的源文件。
+
+每次剖析生成三个文件 (profile_id 为时间戳加随机后缀):
+    <profile_id>.prof   cProfile 原始数据 (可用 pstats 或 snakeviz 打开)
+    <profile_id>.txt    按累计耗时排序的函数列表
+    <profile_id>.json   元数据：标签、耗时、内存峰值、耗时最多的函数、分配内存最多的代码行
+
+剖析是按请求的：cProfile 只记录开启它的线程，即执行本次计算的请求线程，
+线程模式的开发服务器或 gunicorn 线程中同时执行的其他请求不会出现在函数统计中
+(计算内部另开线程的部分也不会记录)。tracemalloc 是进程级的，内存峰值和分配统计
+可能包含同一进程中并发请求的分配。每个进程同一时间只进行一个剖析 (新版 Python 中
+同一时间只能有一个 profiler 生效)，剖析进行中的其他请求正常执行、不剖析。
+"""
+
+import os
+import re
+import io
+import json
+import time
+import uuid
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+PROFILE_ID_PATTERN = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{8}$')
+PROFILE_FORMATS = ('prof', 'txt', 'json')
+
+def _top_functions(stats, top_n):
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top_n]
+    return [{
+        'function': f"{func} ({filename}:{line})",
+        'calls': nc,
+        'tottime': round(tt, 6),
+        'cumtime': round(ct, 6),
+    } for (filename, line, func), (cc, nc, tt, ct, callers) in rows]
+
+def _top_allocations(snapshot, top_n):
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ))
+    return [{
+        'location': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+        'size': stat.size,
+        'count': stat.count,
+    } for stat in snapshot.statistics('lineno')[:top_n]]
+
+class Profiler:
+    def __init__(self, profile_dir, top_n=30, keep=50):
+        self.profile_dir = profile_dir
+        self.top_n = top_n
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def path(self, profile_id, fmt):
+        """剖析文件路径；ID 或格式无效时返回 None"""
+        if not PROFILE_ID_PATTERN.match(profile_id or '') or fmt not in PROFILE_FORMATS:
+            return None
+        return os.path.join(self.profile_dir, f"{profile_id}.{fmt}")
+
+    @contextmanager
+    def capture(self, label, **meta):
+        """
+        剖析 with 块内的计算。返回的字典在退出后包含 profile_id；
+        已有剖析在进行时不剖析，字典中 skipped 为 True。
+        """
+        info = {'profile_id': None, 'skipped': False}
+        if not self._lock.acquire(blocking=False):
+            info['skipped'] = True
+            yield info
+            return
+
+        try:
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            profile = cProfile.Profile()
+            start = time.perf_counter()
+            profile.enable()
+            try:
+                yield info
+            finally:
+                profile.disable()
+                duration = time.perf_counter() - start
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                if started_tracing:
+                    tracemalloc.stop()
+                try:
+                    info['profile_id'] = self._save(profile, snapshot, label, meta, duration, peak)
+                except Exception as e:
+                    print(f"保存剖析结果失败: {e}")
+        finally:
+            self._lock.release()
+
+    def _save(self, profile, snapshot, label, meta, duration, peak):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+        profile.dump_stats(self.path(profile_id, 'prof'))
+        text = io.StringIO()
+        stats = pstats.Stats(profile, stream=text)
+        stats.sort_stats('cumulative').print_stats(self.top_n * 2)
+        with open(self.path(profile_id, 'txt'), 'w', encoding='utf-8') as f:
+            f.write(text.getvalue())
+
+        record = {
+            'profile_id': profile_id,
+            'label': label,
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'duration': round(duration, 3),
+            'peak_memory_bytes': peak,
+            'meta': meta,
+            'top_functions': _top_functions(stats, self.top_n),
+            'top_allocations': _top_allocations(snapshot, self.top_n),
+        }
+        tmp_path = self.path(profile_id, 'json') + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path(profile_id, 'json'))
+        self._prune()
+        print(f"剖析结果已保存: {profile_id} ({label}, {duration:.2f}s)")
+        return profile_id
+
+    def _prune(self):
+        """只保留最近 keep 次剖析"""
+        ids = sorted(f[:-5] for f in os.listdir(self.profile_dir) if f.endswith('.json'))
+        for profile_id in ids[:-self.keep] if self.keep else []:
+            for fmt in PROFILE_FORMATS:
+                try:
+                    os.remove(self.path(profile_id, fmt))
+                except FileNotFoundError:
+                    pass
+
+    def list(self):
+        """最近的剖析 (不含函数和内存明细)，新的在前"""
+        if not os.path.isdir(self.profile_dir):
+            return []
+        records = []
+        for name in sorted(os.listdir(self.profile_dir), reverse=True):
+            if not name.endswith('.json'):
+                continue
+            record = self.load(name[:-5])
+            if record:
+                records.append({k: record[k] for k in ('profile_id', 'label', 'created_at', 'duration',
+                                                       'peak_memory_bytes', 'meta')})
+        return records
+
+    def load(self, profile_id):
+        path = self.path(profile_id, 'json')
+        if not path or not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
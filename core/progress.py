@@ -0,0 +1,46 @@
+"""
+处理进度事件。
+
+processor / merger / streaming 接受可选的 progress 回调，计算过程中调用 progress(event)，
+event 为字典 {'event': 事件类型, 'time': 时间戳, ...}:
+
+- stage          阶段开始或结束: stage (read / aggregate / header / combine / write ...)、
+                 status (started / finished / failed)，结束时带 duration 以及该阶段的 rows / cols
+- file_started   合并中某个文件开始: index (从 1 开始)、total、file
+- file_finished  合并中某个文件结束: index、total、file、ok、rows、cols、duration (失败时带 error)
+- rows           流式处理的行数进度: rows (已写出的行数)
+
+回调只应做轻量操作 (如放入队列)；回调抛出的异常被忽略，不影响计算结果。
+"""
+
+import time
+from contextlib import contextmanager
+
+def emit(progress, event, **fields):
+    """调用进度回调 (progress 为 None 时不做任何事)"""
+    if progress is None:
+        return
+    try:
+        progress(dict(event=event, time=round(time.time(), 3), **fields))
+    except Exception as e:
+        print(f"进度回调失败: {e}")
+
+@contextmanager
+def stage(progress, name, **fields):
+    """
+    报告一个阶段的开始和结束。
+    with 块内可以向返回的字典写入 rows / cols 等字段，随结束事件一起发出；
+    块内抛出异常或写入 status='failed' 时结束事件的 status 为 failed。
+    """
+    emit(progress, 'stage', stage=name, status='started', **fields)
+    extra = {}
+    start = time.perf_counter()
+    try:
+        yield extra
+    except Exception as e:
+        extra.update(status='failed', error=str(e))
+        raise
+    finally:
+        final = dict(fields, status='finished', duration=round(time.perf_counter() - start, 3))
+        final.update(extra)
+        emit(progress, 'stage', stage=name, **final)
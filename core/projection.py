@@ -0,0 +1,135 @@
+"""
+请求级投影：只读取、计算和输出需要的分组/项目列和科室行。
+
+- groups: 分组 ID ('03' / 3) 或分组名称 ('检查收入合计')，包含这些分组的全部明细项目，分组合计完整
+- items: 明细项目名称；只指定项目时不输出分组合计 (只含部分项目的合计没有意义)
+- departments / dept_pattern: 科室名称列表，或科室名称包含的文本 (dept_regex 为 True 时按正则表达式匹配，
+  只对管理员请求开放，避免任意正则表达式的回溯耗尽 worker)
+
+列投影在读取时按表头选择列 (read_excel 的 usecols)，未选中的列不会被解析和转换。
+"""
+
+import re
+import json
+
+from core.layout import config_signature
+
+# 始终保留的基础列
+DEPT_CANDIDATES = ['开单科室', '执行科室', '病人所在病区']
+META_COLUMNS = DEPT_CANDIDATES + ['合计']
+DEPT_PATTERN_MAX = 100
+
+def split_names(values):
+    """将重复参数或逗号分隔的字符串拆分为名称列表"""
+    names = []
+    for value in values or []:
+        names += [v.strip() for v in re.split(r'[,，]', str(value)) if v.strip()]
+    return names
+
+def _clean_name(name):
+    """列名清洗 (与合并计划相同：去掉换行和首尾空白)"""
+    return str(name).replace('\r', '').replace('\n', '').strip()
+
+class Projection:
+    def __init__(self, groups=None, items=None, departments=None, dept_pattern=None, dept_regex=False):
+        self.groups = split_names(groups)
+        self.items = split_names(items)
+        self.departments = split_names(departments)
+        self.dept_pattern = dept_pattern or None
+        if self.dept_pattern:
+            if len(self.dept_pattern) > DEPT_PATTERN_MAX:
+                raise ValueError(f"科室匹配文本不能超过 {DEPT_PATTERN_MAX} 个字符")
+            try:
+                self._dept_regex = re.compile(self.dept_pattern if dept_regex else re.escape(self.dept_pattern))
+            except re.error as e:
+                raise ValueError(f"科室正则表达式无效: {e}")
+
+        # resolve 之后有效
+        self.group_ids = None
+        self.group_names = set()
+        self._all_group_names = set()
+        self._item_to_group = {}
+        self._config_key = None
+
+    @property
+    def projects_columns(self):
+        return bool(self.groups or self.items)
+
+    @property
+    def filters_departments(self):
+        return bool(self.departments or self.dept_pattern)
+
+    def __bool__(self):
+        return self.projects_columns or self.filters_departments
+
+    def resolve(self, group_summaries, item_to_group):
+        """按分组配置解析分组 ID，未知的分组抛出 ValueError"""
+        self._all_group_names = set(group_summaries.values())
+        self._item_to_group = item_to_group
+        self._config_key = config_signature(group_summaries, item_to_group)
+        name_to_id = {name: int(gid) for gid, name in group_summaries.items()}
+        ids = set()
+        for group in self.groups:
+            if group in name_to_id:
+                ids.add(name_to_id[group])
+            elif group.isdigit() and group.zfill(2) in group_summaries:
+                ids.add(int(group))
+            else:
+                raise ValueError(f"未知的分组: {group}")
+        self.group_ids = sorted(ids)
+        self.group_names = {group_summaries[str(gid).zfill(2)] for gid in self.group_ids}
+        return self
+
+    def output_group_ids(self):
+        """输出的分组合计：未投影时为全部 7 组，只指定项目时为空"""
+        if not self.projects_columns:
+            return list(range(1, 8))
+        return list(self.group_ids or [])
+
+    def keeps_item(self, name):
+        if not self.projects_columns:
+            return True
+        name = str(name).strip()
+        if name in self.items:
+            return True
+        # 合并文件中的分组合计列只保留选中的分组
+        if name in self._all_group_names:
+            return name in self.group_names
+        gids = self._item_to_group.get(name, [7])
+        return any(gid in self.group_ids for gid in gids)
+
+    def column_filter(self, index_name=None):
+        """
+        读取源文件时的列选择函数 (传给 read_excel 的 usecols)。
+        保留基础列、index_name (合并时表头识别出的科室列)、选中的分组合计列和项目列。
+        """
+        keep = set(META_COLUMNS)
+        if index_name:
+            keep.add(_clean_name(index_name))
+
+        def usecols(name):
+            return _clean_name(name) in keep or self.keeps_item(name)
+        if not self.projects_columns:
+            return None
+        # 列解析计划 (core.layout) 的缓存键：选择结果只取决于分组、项目、分组配置和科室列
+        usecols.cache_key = json.dumps([self.group_ids, sorted(self.items), self._config_key, index_name],
+                                       ensure_ascii=False)
+        return usecols
+
+    def department_mask(self, series):
+        """科室过滤的布尔掩码 (未指定过滤时全部为 True)"""
+        names = series.astype(str).str.strip()
+        mask = names.notna()
+        if self.departments:
+            mask &= names.isin(self.departments)
+        if self.dept_pattern:
+            mask &= names.str.contains(self._dept_regex, na=False)
+        return mask.to_numpy()
+
+    def to_dict(self):
+        return {
+            'groups': self.groups,
+            'items': self.items,
+            'departments': self.departments,
+            'dept_pattern': self.dept_pattern,
+        }
@@ -0,0 +1,280 @@
+"""
+可插拔的 Excel 读取层。
+
+process_hospital_data / find_header_row / merge_excel_files 统一通过 read_excel 读取，
+按文件扩展名选择后端：
+  - .xls : xlrd (on_demand 按需加载 sheet + mmap 内存映射)，只提取数值/文本网格
+  - .xlsx: openpyxl read_only 流式读取
+  - 其他 : pandas.read_excel 兜底
+新的后端通过 register_backend 注册，select_backends 可用样本文件做一次微基准测试自动选择最快的后端。
+"""
+
+import os
+import mmap
+import time
+import numpy as np
+import pandas as pd
+
+# pandas 默认识别为缺失值的文本
+NA_STRINGS = {'', '#N/A', '#N/A N/A', '#NA', '-NaN', '-nan', 'N/A', 'NA', 'NULL', 'NaN', 'nan', 'null', 'None', '<NA>'}
+
+_BACKENDS = {}   # {name: {'extensions': (...), 'fn': callable}}
+_ACTIVE = {}     # {扩展名: 后端名}
+
+def register_backend(name, extensions, fn):
+    """
+    注册读取后端。fn(file_path, max_rows) 返回原始单元格网格 (二维 object 数组，空单元格为 None)，
+    max_rows 为 None 时读取全部行。
+    """
+    _BACKENDS[name] = {'extensions': tuple(extensions), 'fn': fn}
+    for ext in extensions:
+        _ACTIVE.setdefault(ext, name)
+
+def set_backend(extension, name):
+    """手动指定某扩展名使用的后端"""
+    if name not in _BACKENDS:
+        raise ValueError(f"未知的读取后端: {name}")
+    _ACTIVE[extension] = name
+
+def get_backend(file_path):
+    ext = os.path.splitext(file_path)[1].lower()
+    return _ACTIVE.get(ext, 'pandas')
+
+# --- 后端实现 ---
+
+def _rows_to_grid(rows, width):
+    """将行列表填入二维 object 数组，空单元格为 None"""
+    grid = np.full((len(rows), width), None, dtype=object)
+    for r, row in enumerate(rows):
+        if row:
+            grid[r, :len(row)] = row
+    return grid
+
+def _read_grid_xlrd(file_path, max_rows=None):
+    import xlrd
+    from xlrd.biffh import XL_CELL_EMPTY, XL_CELL_BLANK, XL_CELL_ERROR
+
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            book = xlrd.open_workbook(file_contents=mm, on_demand=True, formatting_info=False)
+            try:
+                sheet = book.sheet_by_index(0)
+                n = sheet.nrows if max_rows is None else min(sheet.nrows, max_rows)
+                grid = _rows_to_grid([sheet.row_values(r) for r in range(n)], sheet.ncols)
+                types = np.zeros((n, sheet.ncols), dtype=np.int8)
+                for r in range(n):
+                    row_types = sheet.row_types(r)
+                    types[r, :len(row_types)] = row_types
+                grid[np.isin(types, (XL_CELL_EMPTY, XL_CELL_BLANK, XL_CELL_ERROR))] = None
+                return grid
+            finally:
+                book.release_resources()
+
+def _read_grid_openpyxl(file_path, max_rows=None):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        rows = [row for row in ws.iter_rows(max_row=max_rows, values_only=True)]
+        width = max((len(row) for row in rows), default=0)
+        return _rows_to_grid(rows, width)
+    finally:
+        wb.close()
+
+def _read_grid_pandas(file_path, max_rows=None):
+    df = pd.read_excel(file_path, header=None, nrows=max_rows)
+    return df.astype(object).where(df.notna(), None).values
+
+register_backend('pandas', ('.xls', '.xlsx', '.xlsm'), _read_grid_pandas)
+register_backend('xlrd-mmap', ('.xls',), _read_grid_xlrd)
+register_backend('openpyxl-stream', ('.xlsx', '.xlsm'), _read_grid_openpyxl)
+_ACTIVE.update({'.xls': 'xlrd-mmap', '.xlsx': 'openpyxl-stream', '.xlsm': 'openpyxl-stream'})
+
+# --- 网格 -> 数据框 ---
+
+def clean_cell(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return None if value.strip() in NA_STRINGS else value
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+def _trim_grid(grid):
+    """去掉末尾的空行和空列 (与 pandas 行为一致)"""
+    grid = np.asarray(grid, dtype=object)
+    if grid.ndim != 2 or grid.size == 0:
+        return np.empty((0, 0), dtype=object)
+    filled = ~np.equal(grid, None)
+    rows = np.flatnonzero(filled.any(axis=1))
+    cols = np.flatnonzero(filled.any(axis=0))
+    if len(rows) == 0:
+        return np.empty((0, 0), dtype=object)
+    return grid[:rows[-1] + 1, :cols[-1] + 1]
+
+def _header_name(value, idx):
+    if value is None:
+        return f"Unnamed: {idx}"
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def _mangle_duplicates(names):
+    """重复列名追加 .1 / .2 后缀 (与 pandas 一致)"""
+    seen = {}
+    result = []
+    for name in names:
+        count = seen.get(name, 0)
+        new_name = name
+        while new_name in seen:
+            count += 1
+            new_name = f"{name}.{count}"
+        seen[name] = count
+        seen.setdefault(new_name, 0)
+        result.append(new_name)
+    return result
+
+def header_names(values):
+    """将表头行的原始单元格转换为与 pandas 一致的列名 (空单元格为 Unnamed: i，重复列名加后缀)"""
+    cleaned = [clean_cell(v) for v in values]
+    return _mangle_duplicates([_header_name(v, i) for i, v in enumerate(cleaned)])
+
+def _to_number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float, np.number)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+def column_array(values):
+    """纯数值 (含数字文本) 列直接转为 float64，其余逐个清洗后保留为 object"""
+    col = values.copy()
+    col[np.equal(col, None)] = np.nan
+    try:
+        return col.astype(float)
+    except (TypeError, ValueError):
+        pass
+
+    values = [clean_cell(v) for v in values]
+    numbers = np.full(len(values), np.nan)
+    for i, v in enumerate(values):
+        if v is None:
+            continue
+        num = _to_number(v)
+        if num is None:
+            arr = np.empty(len(values), dtype=object)
+            for j, w in enumerate(values):
+                if isinstance(w, float) and w.is_integer():
+                    w = int(w)
+                arr[j] = np.nan if w is None else w
+            return arr
+        numbers[i] = num
+    return numbers
+
+def grid_to_frame(grid, header=0, nrows=None, usecols=None):
+    """
+    将原始网格转换为与 pandas.read_excel(header=..., nrows=..., usecols=...) 等价的数据框。
+    usecols 为按列名判断是否保留的函数，未保留的列不做类型转换。
+    """
+    grid = _trim_grid(grid)
+    width = grid.shape[1]
+    if header is None:
+        names = list(range(width))
+        body = grid
+    else:
+        if header >= len(grid):
+            return pd.DataFrame()
+        names = header_names(grid[header])
+        body = grid[header + 1:]
+    if nrows is not None:
+        body = body[:nrows]
+
+    keep = [i for i in range(width) if usecols is None or usecols(names[i])]
+    data = {}
+    for i in keep:
+        data[i] = column_array(body[:, i])
+    df = pd.DataFrame(data, index=pd.RangeIndex(len(body)), columns=keep)
+    df.columns = [names[i] for i in keep]
+    return df
+
+def read_grid(file_path, max_rows=None, backend=None):
+    """
+    读取第一个工作表的原始单元格网格 (去掉末尾空行空列)，与 read_excel 使用相同的后端。
+    配合 core.layout 的位置计划直接按列位置取数。
+    """
+    name = backend or get_backend(file_path)
+    try:
+        grid = _BACKENDS[name]['fn'](file_path, max_rows)
+    except Exception as e:
+        if name == 'pandas':
+            raise
+        print(f"读取后端 {name} 失败 ({e})，回退到 pandas")
+        grid = _read_grid_pandas(file_path, max_rows)
+    return _trim_grid(grid)
+
+def read_excel(file_path, header=0, nrows=None, backend=None, usecols=None):
+    """
+    读取第一个工作表，返回与 pandas.read_excel(file_path, header=header, nrows=nrows, usecols=usecols) 等价的数据框。
+    usecols 为按列名判断是否保留的函数 (列投影)。指定后端失败时回退到 pandas。
+    """
+    name = backend or get_backend(file_path)
+    if name == 'pandas':
+        return pd.read_excel(file_path, header=header, nrows=nrows, usecols=usecols)
+
+    max_rows = None
+    if nrows is not None:
+        max_rows = nrows if header is None else header + 1 + nrows
+    try:
+        grid = _BACKENDS[name]['fn'](file_path, max_rows)
+    except Exception as e:
+        print(f"读取后端 {name} 失败 ({e})，回退到 pandas")
+        return pd.read_excel(file_path, header=header, nrows=nrows, usecols=usecols)
+    return grid_to_frame(grid, header=header, nrows=nrows, usecols=usecols)
+
+def select_backends(sample_files, repeat=2):
+    """
+    微基准测试：用样本文件测试每个支持该扩展名的后端，选出最快且结果形状与 pandas 一致的后端。
+    返回 {扩展名: {后端名: 耗时秒数}}。
+    """
+    timings = {}
+    for sample in sample_files:
+        ext = os.path.splitext(sample)[1].lower()
+        if ext in timings or not os.path.exists(sample):
+            continue
+        try:
+            reference_shape = pd.read_excel(sample, header=None).shape
+        except Exception as e:
+            print(f"基准样本 {sample} 无法读取: {e}")
+            continue
+
+        ext_timings = {}
+        for name, backend in _BACKENDS.items():
+            if ext not in backend['extensions']:
+                continue
+            try:
+                best = None
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    df = grid_to_frame(backend['fn'](sample, None), header=None)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                if df.shape != reference_shape:
+                    print(f"  后端 {name} 结果形状 {df.shape} 与 pandas {reference_shape} 不一致，跳过")
+                    continue
+                ext_timings[name] = best
+            except Exception as e:
+                print(f"  后端 {name} 基准测试失败: {e}")
+
+        if ext_timings:
+            fastest = min(ext_timings, key=ext_timings.get)
+            _ACTIVE[ext] = fastest
+            print(f"读取后端 {ext}: {fastest} ({ext_timings[fastest] * 1000:.1f} ms)")
+        timings[ext] = ext_timings
+    return timings
@@ -0,0 +1,92 @@
+import threading
+from collections import OrderedDict
+
+def result_nbytes(result):
+    """估算任务结果占用的内存 (只统计数据框和数组)"""
+    total = 0
+    for key in ('df', 'header'):
+        df = result.get(key)
+        if df is not None:
+            total += int(df.memory_usage(index=True, deep=True).sum())
+    # 分期宽表合并的三维数组
+    for key in ('values', 'total'):
+        array = result.get(key)
+        if array is not None and hasattr(array, 'nbytes'):
+            total += int(array.nbytes)
+    return total
+
+class ResultStore:
+    """
+    按任务 ID 缓存内存中的计算结果 (线程安全，LRU 淘汰)。
+    超过 max_items 个任务或 max_bytes 字节时淘汰最久未访问的任务。
+    """
+
+    def __init__(self, max_items=32, max_bytes=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._sizes = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, task_id, result):
+        size = result_nbytes(result) if self.max_bytes else 0
+        with self._lock:
+            if task_id in self._items:
+                self._total_bytes -= self._sizes.pop(task_id, 0)
+            self._items[task_id] = result
+            self._items.move_to_end(task_id)
+            self._sizes[task_id] = size
+            self._total_bytes += size
+            # 至少保留刚放入的任务
+            while len(self._items) > 1 and (
+                len(self._items) > self.max_items
+                or (self.max_bytes and self._total_bytes > self.max_bytes)
+            ):
+                old_id, _ = self._items.popitem(last=False)
+                self._total_bytes -= self._sizes.pop(old_id, 0)
+
+    def get(self, task_id):
+        with self._lock:
+            result = self._items.get(task_id)
+            if result is not None:
+                self._items.move_to_end(task_id)
+            return result
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+class SingleFlight:
+    """
+    合并同一 key 的并发调用：第一个调用者执行 fn，其余调用者等待并共享其返回值。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'event': threading.Event(), 'value': None, 'error': None}
+                self._calls[key] = call
+
+        if not leader:
+            call['event'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['value']
+
+        try:
+            call['value'] = fn()
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['event'].set()
+        return call['value']
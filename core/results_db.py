@@ -0,0 +1,201 @@
+"""
+处理结果的本地 SQLite 存储。
+
+每次 process_hospital_data 的结果以长表 (期间 × 科室维度 × 科室 × 项目) 批量写入 facts 表，
+按期间、科室维度、科室、项目和分组建立索引，查询接口直接在库内聚合，无需重新解析 Excel。
+同一期间、同一维度、同一源文件重复处理时覆盖旧数据。
+"""
+
+import os
+import re
+import sqlite3
+import datetime
+import numpy as np
+import pandas as pd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id     INTEGER PRIMARY KEY AUTOINCREMENT,
+    period     TEXT NOT NULL,
+    dimension  TEXT NOT NULL,
+    source     TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    UNIQUE (period, dimension, source)
+);
+CREATE TABLE IF NOT EXISTS facts (
+    run_id     INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    period     TEXT NOT NULL,
+    dimension  TEXT NOT NULL,
+    department TEXT NOT NULL,
+    item       TEXT NOT NULL,
+    kind       TEXT NOT NULL,   -- total: 合计 / group: 分组合计 / item: 明细项目
+    group_ids  TEXT,            -- 分组合计为 '03'，明细项目为表头中的 '1/2' 形式
+    value      REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_facts_period ON facts (period);
+CREATE INDEX IF NOT EXISTS ix_facts_lookup ON facts (dimension, item, department, period);
+CREATE INDEX IF NOT EXISTS ix_facts_department ON facts (department, period);
+CREATE INDEX IF NOT EXISTS ix_facts_group ON facts (group_ids, period);
+CREATE INDEX IF NOT EXISTS ix_facts_run ON facts (run_id);
+"""
+
+ROLLUP_KEYS = {
+    'period': 'period',
+    'department': 'department',
+    'item': 'item',
+    'dimension': 'dimension',
+}
+
+def extract_period(filename):
+    """从文件名中提取年月 (如 202503)，与合并逻辑使用同一正则"""
+    match = re.search(r'(20\d{4})', filename)
+    return match.group(1) if match else None
+
+def connect(db_path):
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    return conn
+
+def fact_rows(result):
+    """
+    将处理结果展开为长表记录 (department, item, kind, group_ids, value)。
+    result 也可以是流式处理的一个数据块 (含 df / dept_col / header / group_cols)。
+    """
+    df = result['df']
+    dept_col = result['dept_col']
+
+    dept_series = df[dept_col]
+    valid_mask = dept_series.notna() & ~dept_series.astype(str).str.contains("制表人", na=False)
+    df_valid = df.loc[valid_mask]
+    departments = df_valid[dept_col].astype(str).str.strip().to_numpy()
+
+    header_ids = dict(zip(result['header'].columns, result['header'].iloc[0])) if 'header' in result else {}
+    group_cols = result.get('group_cols', [])
+
+    items, kinds, group_ids = [], [], []
+    for col in df_valid.columns:
+        if col == dept_col:
+            continue
+        items.append(str(col))
+        if col == '合计':
+            kinds.append('total')
+            group_ids.append(None)
+        elif col in group_cols:
+            kinds.append('group')
+            group_ids.append(str(header_ids.get(col, '')) or None)
+        else:
+            kinds.append('item')
+            group_ids.append(str(header_ids.get(col, '')) or None)
+
+    values = df_valid[items].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    # 只保存非零值，长表规模与实际发生的收入成正比
+    rows_idx, cols_idx = np.nonzero(np.nan_to_num(values) != 0)
+    for r, c in zip(rows_idx.tolist(), cols_idx.tolist()):
+        yield departments[r], items[c], kinds[c], group_ids[c], float(values[r, c])
+
+def save_result(db_path, result, source=None, period=None):
+    """
+    将 compute_hospital_data 的结果写入结果库。
+    期间默认从源文件名提取；无法确定期间时不写入并返回 None，否则返回写入的记录数。
+    """
+    source = source or result.get('source', '')
+    return save_facts(db_path, fact_rows(result), result['dept_col'], source, period=period)
+
+def save_facts(db_path, facts, dimension, source, period=None):
+    """
+    在一个事务中写入一次处理结果的全部长表记录 (facts 为 fact_rows 产出的记录，可以是迭代器)。
+    流式处理按块产出记录，不需要在内存中保留完整结果。返回值同 save_result。
+    """
+    period = period or extract_period(source)
+    if not period:
+        print(f"未能从文件名中识别期间，跳过写入结果库: {source}")
+        return None
+
+    conn = connect(db_path)
+    try:
+        with conn:
+            # 同一期间/维度/源文件重新处理时覆盖旧数据
+            conn.execute("DELETE FROM runs WHERE period = ? AND dimension = ? AND source = ?",
+                         (period, dimension, source))
+            cursor = conn.execute(
+                "INSERT INTO runs (period, dimension, source, created_at) VALUES (?, ?, ?, ?)",
+                (period, dimension, source, datetime.datetime.now().isoformat(timespec='seconds'))
+            )
+            run_id = cursor.lastrowid
+            cursor = conn.executemany(
+                "INSERT INTO facts (run_id, period, dimension, department, item, kind, group_ids, value) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((run_id, period, dimension, dept, item, kind, gids, value)
+                 for dept, item, kind, gids, value in facts)
+            )
+            count = cursor.rowcount
+        print(f"已写入结果库: {period} {dimension} {source} ({count} 条)")
+        return count
+    finally:
+        conn.close()
+
+def query_rollup(db_path, items=None, departments=None, dimension=None, group=None,
+                 start=None, end=None, by=('period',)):
+    """
+    在结果库中按期间区间聚合。
+    items / departments 为名称列表，group 为分组 ID (如 '03')，start / end 为闭区间年月 (如 '202401')。
+    by 为分组维度列表，可选 period / department / item / dimension。
+    返回 [{...维度..., 'value': 合计}]。
+
+    facts 中同一科室同时有 合计、分组合计和明细项目三类记录，只累加其中一类：
+    指定 group 时为分组合计，指定 items 时为明细项目，都不指定时为 合计。
+    三种科室维度 (开单科室 / 执行科室 / 病区) 是同一收入的不同视图，不指定 dimension 时按维度分别返回。
+    """
+    by = [b for b in by if b in ROLLUP_KEYS] or ['period']
+    if not dimension and 'dimension' not in by:
+        by = by + ['dimension']
+    where, params = [], []
+    if not group:
+        where.append("kind = ?")
+        params.append('item' if items else 'total')
+    if items:
+        where.append(f"item IN ({','.join('?' * len(items))})")
+        params += list(items)
+    if departments:
+        where.append(f"department IN ({','.join('?' * len(departments))})")
+        params += list(departments)
+    if dimension:
+        where.append("dimension = ?")
+        params.append(dimension)
+    if group:
+        # 分组合计行的 group_ids 精确等于分组 ID
+        where.append("kind = 'group' AND group_ids = ?")
+        params.append(str(group).zfill(2))
+    if start:
+        where.append("period >= ?")
+        params.append(str(start))
+    if end:
+        where.append("period <= ?")
+        params.append(str(end))
+
+    select_cols = ', '.join(ROLLUP_KEYS[b] for b in by)
+    sql = f"SELECT {select_cols}, SUM(value) FROM facts"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" GROUP BY {select_cols} ORDER BY {select_cols}"
+
+    conn = connect(db_path)
+    try:
+        return [dict(zip(by + ['value'], row[:-1] + (round(row[-1], 2),)))
+                for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+def list_runs(db_path):
+    """列出结果库中已保存的处理记录"""
+    conn = connect(db_path)
+    try:
+        cursor = conn.execute(
+            "SELECT period, dimension, source, created_at FROM runs ORDER BY period, dimension, source"
+        )
+        return [dict(zip(('period', 'dimension', 'source', 'created_at'), row)) for row in cursor]
+    finally:
+        conn.close()
@@ -0,0 +1,238 @@
+"""
+超大 xlsx 导出文件的流式处理 (内存占用只取决于块大小，与文件大小无关)。
+
+使用 openpyxl read_only 逐行读取，每 chunk_size 行转换为 NumPy 数组，按块计算分组合计，
+再用 write_only 工作簿逐行追加写出。计算顺序与 process_hospital_data 完全一致，结果相同。
+指定结果库时，每块的长表记录先追加到临时文件，写出成功后再一次性写入结果库
+(内存占用仍与文件大小无关，数据库写事务也不会持续整个处理过程)。
+"""
+
+import os
+import pickle
+import tempfile
+from copy import copy
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment
+from openpyxl.utils import get_column_letter
+
+from core.config_loader import get_processor_config, parse_group_config
+from core.readers import header_names, clean_cell
+from core.layout import process_plan
+from core.progress import emit, stage
+from core.results_db import fact_rows, save_facts
+
+# 源文件表头在第 4 行 (index 3)，与 process_hospital_data 一致
+HEADER_ROW = 3
+
+def _display_length(value):
+    try:
+        if value:
+            return len(str(value).encode('gbk'))
+    except Exception:
+        pass
+    return 0
+
+def _to_float_column(values):
+    """与 pd.to_numeric(errors='coerce').fillna(0) 等价的逐列转换"""
+    out = np.zeros(len(values))
+    for i, v in enumerate(values):
+        if v is None or isinstance(v, bool):
+            continue
+        if isinstance(v, (int, float)):
+            out[i] = v
+        else:
+            try:
+                out[i] = float(str(v).strip())
+            except ValueError:
+                pass
+    return np.nan_to_num(out, nan=0.0)
+
+def _raw_value(value):
+    """
+    输出原始明细值：数字文本转为数字 (pandas 读取时会把整列数字文本推断为数值)。
+    """
+    if isinstance(value, str):
+        try:
+            number = float(value)
+        except ValueError:
+            return value
+        return int(number) if number.is_integer() else number
+    return value
+
+def _iter_chunks(rows, chunk_size):
+    """
+    按块产出数据行。与 pandas 一致：保留中间的空行，丢弃文件末尾的空行。
+    """
+    chunk = []
+    blank_run = []
+    for row in rows:
+        row = [clean_cell(v) for v in row]
+        if all(v is None for v in row):
+            blank_run.append(row)
+            continue
+        if blank_run:
+            chunk.extend(blank_run)
+            blank_run = []
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _spooled_facts(spool):
+    """依次读出临时文件中按块保存的长表记录"""
+    spool.seek(0)
+    while True:
+        try:
+            rows = pickle.load(spool)
+        except EOFError:
+            return
+        yield from rows
+
+def process_hospital_data_streaming(src_file, output_file, custom_config=None, chunk_size=5000, progress=None,
+                                    results_db=None, source=None):
+    """
+    流式处理 .xlsx 源文件并直接写出结果，成功返回 True。
+    输出格式与 process_hospital_data 相同 (双层表头、居中对齐、列宽自适应)；
+    由于 write_only 模式需要先确定列宽，列宽按表头和第一个数据块估算。
+    progress 为进度回调，每写完一个数据块报告一次已写出的行数 (见 core.progress)。
+    results_db 为结果库路径时同时写入结果库 (与 process_hospital_data 相同的记录)，
+    source 为记录的源文件名，默认取 src_file 的文件名；写入失败不影响处理结果。
+    """
+    if custom_config:
+        print("使用用户自定义分组配置...")
+        GROUP_SUMMARIES, ITEM_TO_GROUP_ID = parse_group_config(custom_config)
+    else:
+        print("使用默认分组配置...")
+        GROUP_SUMMARIES, ITEM_TO_GROUP_ID = get_processor_config()
+
+    if not GROUP_SUMMARIES or not ITEM_TO_GROUP_ID:
+        print("错误: 分组配置为空或无效。")
+        return False
+
+    print(f"正在流式读取源文件: {src_file}")
+    if not os.path.exists(src_file):
+        print(f"错误: 源文件不存在 {src_file}")
+        return False
+
+    try:
+        wb_src = load_workbook(src_file, read_only=True, data_only=True)
+    except Exception as e:
+        print(f"读取 Excel 失败: {e}")
+        return False
+
+    spool = None
+    try:
+        ws_src = wb_src.worksheets[0]
+        rows = ws_src.iter_rows(min_row=HEADER_ROW + 1, values_only=True)
+        header_cells = next(rows, None)
+        if header_cells is None:
+            print("错误: 源文件缺少表头行")
+            return False
+
+        # 列位置计划与内存路径相同 (表头按 pandas 规则命名后去除空格)，相同版式的表头直接复用
+        width = len(header_cells)
+        plan = process_plan(header_cells, GROUP_SUMMARIES, ITEM_TO_GROUP_ID)
+        if plan is None:
+            names = header_names(list(header_cells))
+            print(f"无法在源文件中找到识别列（'开单科室'、'执行科室'或'病人所在病区'）。当前列名: {names[:5]}...")
+            return False
+
+        dept_col = plan['dept_col']
+        dept_idx = plan['dept_pos']
+        total_idx = plan['total_pos']
+        detail_idx = plan['detail_pos']
+        detail_cols = plan['detail_cols']
+        detail_gids = plan['detail_gids']
+
+        group_names = [GROUP_SUMMARIES[str(gid).zfill(2)] for gid in range(1, 8)]
+        header_row_0 = [0, 0] + [str(gid).zfill(2) for gid in range(1, 8)]
+        header_row_0 += ["/".join(map(str, gids)) for gids in detail_gids]
+        header_row_1 = [dept_col, '合计'] + group_names + detail_cols
+
+        os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+        wb_out = Workbook(write_only=True)
+        ws_out = wb_out.create_sheet('Sheet1')
+        # 只注册一次居中样式，之后每个单元格直接复用样式索引
+        template = WriteOnlyCell(ws_out)
+        template.alignment = Alignment(horizontal='center', vertical='center')
+        style_array = template._style
+
+        def styled(values):
+            cells = []
+            for v in values:
+                cell = WriteOnlyCell(ws_out, value=v)
+                cell._style = copy(style_array)
+                cells.append(cell)
+            return cells
+
+        # 结果库记录按块暂存 (分组 ID 取自第一行表头，与 compute_hospital_data 的结果相同)
+        spool = tempfile.TemporaryFile() if results_db else None
+        df_header = pd.DataFrame([header_row_0], columns=header_row_1)
+
+        n_rows = 0
+        widths_set = False
+        for chunk in _iter_chunks(rows, chunk_size):
+            grid = np.full((len(chunk), width), None, dtype=object)
+            for r, row in enumerate(chunk):
+                grid[r, :min(len(row), width)] = row[:width]
+
+            # 按块计算分组合计，累加顺序与内存路径相同
+            group_sums = np.zeros((len(chunk), 7))
+            for j, idx in enumerate(detail_idx):
+                col_values = _to_float_column(grid[:, idx])
+                for gid in detail_gids[j]:
+                    if 1 <= gid <= 7:
+                        group_sums[:, gid - 1] += col_values
+
+            out_rows = []
+            for r in range(len(chunk)):
+                row = [grid[r, dept_idx], _raw_value(grid[r, total_idx])]
+                row += group_sums[r].tolist()
+                row += [_raw_value(grid[r, idx]) for idx in detail_idx]
+                out_rows.append(row)
+
+            if not widths_set:
+                # write_only 模式必须在写入第一行前设置列宽
+                for c in range(len(header_row_1)):
+                    sample = [header_row_0[c], header_row_1[c]] + [row[c] for row in out_rows]
+                    max_length = max(_display_length(v) for v in sample)
+                    ws_out.column_dimensions[get_column_letter(c + 1)].width = min(max_length + 2, 40)
+                ws_out.append(styled(header_row_0))
+                ws_out.append(styled(header_row_1))
+                widths_set = True
+
+            for row in out_rows:
+                ws_out.append(styled(row))
+            if spool is not None:
+                chunk_result = {'df': pd.DataFrame(out_rows, columns=header_row_1), 'header': df_header,
+                                'dept_col': dept_col, 'group_cols': group_names}
+                pickle.dump(list(fact_rows(chunk_result)), spool, protocol=pickle.HIGHEST_PROTOCOL)
+            n_rows += len(chunk)
+            emit(progress, 'rows', rows=n_rows, cols=len(header_row_1))
+
+        if not widths_set:
+            ws_out.append(styled(header_row_0))
+            ws_out.append(styled(header_row_1))
+
+        with stage(progress, 'write', rows=n_rows):
+            wb_out.save(output_file)
+        print(f"处理完成！成功生成：{output_file} (共 {n_rows} 行)")
+
+        if spool is not None:
+            try:
+                save_facts(results_db, _spooled_facts(spool), dept_col, source or os.path.basename(src_file))
+            except Exception as e:
+                print(f"写入结果库失败: {e}")
+        return True
+    except Exception as e:
+        print(f"流式处理失败: {e}")
+        return False
+    finally:
+        wb_src.close()
+        if spool is not None:
+            spool.close()
@@ -0,0 +1,99 @@
+import math
+import numpy as np
+import pandas as pd
+
+from core.config_loader import get_processor_config, parse_group_config
+
+def _round(value):
+    """转换为可 JSON 序列化的两位小数浮点数"""
+    value = float(value)
+    if math.isnan(value) or math.isinf(value):
+        return 0.0
+    return round(value, 2)
+
+def build_summary(result, custom_config=None, top_n=20):
+    """
+    基于 compute_hospital_data / compute_merge 的内存结果构造紧凑汇总：
+    各科室分组合计、费用项目排行、总计。
+    返回的汇总对象会被缓存在任务结果中，分页和列投影在 paginate_summary 中处理。
+    """
+    df = result['df']
+    dept_col = result['dept_col']
+
+    # 合并结果没有记录分组列，按配置中的分组名称识别
+    group_cols = result.get('group_cols')
+    if not group_cols:
+        if custom_config:
+            group_summaries, _ = parse_group_config(custom_config)
+        else:
+            group_summaries, _ = get_processor_config()
+        group_names = set(group_summaries.values())
+        group_cols = [c for c in df.columns if c in group_names]
+
+    # 过滤掉空科室和“制表人”行
+    dept_series = df[dept_col]
+    valid_mask = dept_series.notna() & ~dept_series.astype(str).str.contains("制表人", na=False)
+    df_valid = df.loc[valid_mask]
+
+    value_cols = []
+    if '合计' in df_valid.columns:
+        value_cols.append('合计')
+    value_cols += [c for c in group_cols if c in df_valid.columns]
+
+    values = df_valid[value_cols].apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=float)
+    rows = []
+    for dept, row_values in zip(df_valid[dept_col].astype(str).tolist(), values):
+        rows.append([dept] + [_round(v) for v in row_values])
+
+    grand_totals = {}
+    if len(value_cols):
+        for col, total in zip(value_cols, values.sum(axis=0)):
+            grand_totals[col] = _round(total)
+
+    # 费用项目排行 (排除科室、合计和分组合计列)
+    excluded = set(value_cols) | {dept_col}
+    item_cols = result.get('detail_cols') or [c for c in df_valid.columns if c not in excluded]
+    item_cols = [c for c in item_cols if c in df_valid.columns and c not in excluded]
+    top_items = []
+    if item_cols:
+        item_totals = df_valid[item_cols].apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=float).sum(axis=0)
+        order = np.argsort(-item_totals, kind='stable')[:top_n]
+        top_items = [[str(item_cols[i]), _round(item_totals[i])] for i in order]
+
+    return {
+        'dept_col': dept_col,
+        'columns': [dept_col] + value_cols,
+        'rows': rows,
+        'top_items': top_items,
+        'grand_totals': grand_totals,
+    }
+
+def paginate_summary(summary, page=1, page_size=50, columns=None):
+    """
+    对缓存的汇总进行分页和列投影。
+    columns 为需要保留的列名列表 (科室列始终保留)，为空则返回全部列。
+    """
+    all_columns = summary['columns']
+    if columns:
+        keep = [0] + [i for i, c in enumerate(all_columns) if i > 0 and c in columns]
+    else:
+        keep = list(range(len(all_columns)))
+
+    page = max(int(page), 1)
+    page_size = min(max(int(page_size), 1), 1000)
+    start = (page - 1) * page_size
+    page_rows = summary['rows'][start:start + page_size]
+
+    grand_totals = summary['grand_totals']
+    if columns:
+        grand_totals = {k: v for k, v in grand_totals.items() if k in columns}
+
+    return {
+        'columns': [all_columns[i] for i in keep],
+        'rows': [[row[i] for i in keep] for row in page_rows],
+        'page': page,
+        'page_size': page_size,
+        'total_rows': len(summary['rows']),
+        'top_items': summary['top_items'],
+        'grand_totals': grand_totals,
+    }
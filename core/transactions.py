@@ -0,0 +1,212 @@
+"""
+收费明细 (长表) 输入：每行一条收费记录 (科室、收费项目、金额)。
+
+按块读取明细行，用整数编码的科室/项目键做哈希聚合，直接得到与 HIS 透视导出相同结构的
+科室 × 项目宽表 (科室 | 合计 | 各项目)，再交给 compute_hospital_data 的分组和输出逻辑，
+无需先在 Excel 中透视。支持 .csv (UTF-8 / GBK)、.xlsx 和 .xls；
+.csv 和 .xlsx 逐块读取，内存占用与文件大小无关，.xls 需要整表读入。
+"""
+
+import os
+import csv
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+from core.readers import read_excel
+
+DEPT_CANDIDATES = ['开单科室', '执行科室', '病人所在病区']
+ITEM_CANDIDATES = ['收费项目', '费用项目', '项目名称', '费用类别', '费别']
+AMOUNT_CANDIDATES = ['金额', '实收金额', '应收金额', '费用金额', '总金额']
+
+# 在前若干行中查找表头 (HIS 导出通常有标题行)
+HEADER_SCAN_ROWS = 20
+
+class TransactionAggregator:
+    """
+    科室 × 项目的哈希聚合。
+    每块数据先在块内 factorize，再把块内的唯一值映射到全局整数编码，
+    最后用 bincount 按 (科室编码, 项目编码) 一次性累加金额。
+    """
+
+    def __init__(self):
+        self.dept_codes = {}
+        self.item_codes = {}
+        self._sums = np.zeros((0, 0))
+        self._counts = np.zeros((0, 0), dtype=np.int64)
+
+    @staticmethod
+    def _global_codes(values, codes):
+        """块内 factorize 后只对唯一值做名称清洗和全局编码，空名称编码为 -1"""
+        local, uniques = pd.factorize(values)
+        mapping = np.empty(len(uniques) + 1, dtype=np.int64)
+        mapping[-1] = -1  # factorize 对缺失值返回 -1
+        for i, u in enumerate(uniques):
+            name = str(u).strip()
+            mapping[i] = codes.setdefault(name, len(codes)) if name else -1
+        return mapping[local]
+
+    def _grow(self):
+        n_dept, n_item = len(self.dept_codes), len(self.item_codes)
+        old_dept, old_item = self._sums.shape
+        if n_dept <= old_dept and n_item <= old_item:
+            return
+        # 按倍数扩容，避免频繁复制
+        new_shape = (max(n_dept, old_dept * 2), max(n_item, old_item * 2))
+        sums = np.zeros(new_shape)
+        counts = np.zeros(new_shape, dtype=np.int64)
+        sums[:old_dept, :old_item] = self._sums
+        counts[:old_dept, :old_item] = self._counts
+        self._sums, self._counts = sums, counts
+
+    def add(self, departments, items, amounts):
+        amounts = pd.to_numeric(pd.Series(amounts), errors='coerce').fillna(0).to_numpy(dtype=float)
+        dept = self._global_codes(departments, self.dept_codes)
+        item = self._global_codes(items, self.item_codes)
+
+        # 科室或项目为空的行 (如表尾的制表人、合计行) 不参与聚合
+        valid = (dept >= 0) & (item >= 0)
+        if not valid.all():
+            dept, item, amounts = dept[valid], item[valid], amounts[valid]
+        self._grow()
+        if len(amounts) == 0:
+            return 0
+
+        n_dept, n_item = len(self.dept_codes), len(self.item_codes)
+        flat = dept * n_item + item
+        size = n_dept * n_item
+        self._sums[:n_dept, :n_item] += np.bincount(flat, weights=amounts, minlength=size).reshape(n_dept, n_item)
+        self._counts[:n_dept, :n_item] += np.bincount(flat, minlength=size).reshape(n_dept, n_item)
+        return len(amounts)
+
+    def to_frame(self, dept_col):
+        """
+        输出与透视导出相同结构的宽表：科室 | 合计 | 各项目 (按首次出现顺序)。
+        没有任何收费记录的单元格为空，与透视导出一致；没有有效记录的科室 (如表尾制表人) 不输出。
+        收费项目与科室列或 合计 同名时无法区分，抛出 ValueError。
+        """
+        reserved = set(DEPT_CANDIDATES) | {dept_col, '合计'}
+        collisions = [name for name in self.item_codes if name in reserved]
+        if collisions:
+            raise ValueError(f"收费项目名称与保留列名冲突: {'、'.join(collisions)}")
+        n_dept, n_item = len(self.dept_codes), len(self.item_codes)
+        counts = self._counts[:n_dept, :n_item]
+        keep = counts.sum(axis=1) > 0
+        sums = np.round(self._sums[:n_dept, :n_item][keep], 2)
+        values = np.where(counts[keep] > 0, sums, np.nan)
+
+        departments = np.array(list(self.dept_codes), dtype=object)[keep]
+        data = {dept_col: departments, '合计': np.round(sums.sum(axis=1), 2)}
+        for name, code in self.item_codes.items():
+            data[name] = values[:, code]
+        return pd.DataFrame(data)
+
+def _pick(names, candidates, label):
+    for col in candidates:
+        if col in names:
+            return col
+    raise ValueError(f"无法在收费明细中找到{label}列 (可选: {'、'.join(candidates)})。当前列名: {names[:8]}")
+
+def _header_cells(row):
+    return [str(v).strip() if v is not None else '' for v in row]
+
+def _is_header(row):
+    return any(c in _header_cells(row) for c in DEPT_CANDIDATES)
+
+def _find_header(rows):
+    """返回 (表头行号, 列名列表)；表头行需包含科室列"""
+    for i, row in enumerate(rows):
+        if _is_header(row):
+            return i, _header_cells(row)
+    raise ValueError(f"前 {HEADER_SCAN_ROWS} 行中未找到包含科室列的表头")
+
+def _resolve_columns(names, dept_col=None, item_col=None, amount_col=None):
+    return (dept_col or _pick(names, DEPT_CANDIDATES, '科室'),
+            item_col or _pick(names, ITEM_CANDIDATES, '收费项目'),
+            amount_col or _pick(names, AMOUNT_CANDIDATES, '金额'))
+
+def _detect_encoding(src_file):
+    for encoding in ('utf-8-sig', 'gbk'):
+        try:
+            with open(src_file, 'r', encoding=encoding) as f:
+                f.read(1024 * 1024)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return 'gbk'
+
+def _csv_chunks(src_file, columns, chunk_size):
+    encoding = _detect_encoding(src_file)
+    with open(src_file, 'r', encoding=encoding, newline='') as f:
+        head = [row for _, row in zip(range(HEADER_SCAN_ROWS), csv.reader(f))]
+    header_idx, names = _find_header(head)
+    cols = _resolve_columns(names, *columns)
+    # 按列位置读取：原始表头可能带空格或 BOM，与清洗后的列名不一致
+    idx = [names.index(c) for c in cols]
+    reader = pd.read_csv(src_file, encoding=encoding, skiprows=header_idx + 1, header=None, usecols=idx,
+                         dtype={idx[0]: str, idx[1]: str}, chunksize=chunk_size)
+    for chunk in reader:
+        yield cols, chunk[idx[0]].to_numpy(), chunk[idx[1]].to_numpy(), chunk[idx[2]].to_numpy()
+
+def _xlsx_chunks(src_file, columns, chunk_size):
+    wb = load_workbook(src_file, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        head = []
+        for row in rows:
+            head.append(row)
+            if _is_header(row) or len(head) >= HEADER_SCAN_ROWS:
+                break
+        _, names = _find_header(head)
+        cols = _resolve_columns(names, *columns)
+        idx = [names.index(c) for c in cols]
+
+        buffer = []
+        for row in rows:
+            buffer.append(tuple(row[i] if i < len(row) else None for i in idx))
+            if len(buffer) >= chunk_size:
+                block = np.array(buffer, dtype=object).reshape(-1, 3)
+                yield cols, block[:, 0], block[:, 1], block[:, 2]
+                buffer = []
+        if buffer:
+            block = np.array(buffer, dtype=object).reshape(-1, 3)
+            yield cols, block[:, 0], block[:, 1], block[:, 2]
+    finally:
+        wb.close()
+
+def _xls_chunks(src_file, columns, chunk_size):
+    """.xls 只能整表读入内存 (xlrd 不支持逐行读取)，之后按块聚合；超大的明细请导出为 .xlsx 或 .csv"""
+    grid = read_excel(src_file, header=None)
+    header_idx, names = _find_header(grid.head(HEADER_SCAN_ROWS).to_numpy().tolist())
+    cols = _resolve_columns(names, *columns)
+    idx = [names.index(c) for c in cols]
+    body = grid.iloc[header_idx + 1:, idx].to_numpy(dtype=object)
+    for start in range(0, len(body), chunk_size):
+        block = body[start:start + chunk_size]
+        yield cols, block[:, 0], block[:, 1], block[:, 2]
+
+def pivot_transactions(src_file, dept_col=None, item_col=None, amount_col=None, chunk_size=200000):
+    """
+    读取收费明细并聚合为科室 × 项目宽表 (结构与 HIS 透视导出相同，表头已在第一行)。
+    列名默认自动识别，也可通过 dept_col / item_col / amount_col 指定。
+    """
+    ext = os.path.splitext(src_file)[1].lower()
+    if ext in ('.csv', '.txt'):
+        chunks = _csv_chunks
+    elif ext == '.xlsx':
+        chunks = _xlsx_chunks
+    else:
+        chunks = _xls_chunks
+
+    aggregator = TransactionAggregator()
+    resolved = None
+    n_rows = 0
+    for cols, departments, items, amounts in chunks(src_file, (dept_col, item_col, amount_col), chunk_size):
+        resolved = cols
+        n_rows += aggregator.add(departments, items, amounts)
+
+    if resolved is None:
+        raise ValueError("收费明细为空")
+    df = aggregator.to_frame(resolved[0])
+    print(f"已聚合 {n_rows} 条收费明细: {len(df)} 个科室 × {len(aggregator.item_codes)} 个项目")
+    return df
@@ -0,0 +1,407 @@
+"""
+监控目录守护进程：HIS 导出到共享目录后自动处理，并增量更新对应期间的合并结果。
+
+用法:
+    python -m core.watcher excels/data_export excels/watch_output --merge-by year --workers 4
+
+- Linux 下使用 inotify 监听文件写入完成/移动事件，不可用时回退为定时轮询
+- 文件大小和修改时间在 settle 秒内保持不变才视为写入完成 (防止处理写了一半的文件)
+- 每个新增或变化的文件交给进程池执行 process_hospital_data；同一文件同时只处理一次，
+  处理期间再次变化的文件在本次处理完成后重新提交
+- 删除或移出目录的文件从合并结果中去掉，并删除其 manifest 记录和处理结果
+- 合并结果按分组缓存每个文件的规范化数据，文件变化时只重新读取该文件，
+  由缓存数据按 int64 分重新累加后写出合并文件 (与重新合并的精确结果相同)
+- 与 core.batch 共用 manifest.json，重启后不会重复处理未变化的文件
+"""
+
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import argparse
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from core.config_loader import load_group_config
+from core import money
+from core.merger import find_header_row, load_merge_frame, finalize_merged_frame, write_merged_excel
+from core.batch import (MANIFEST_NAME, file_sha256, config_digest, load_manifest, save_manifest,
+                        find_exports, processed_output_path, merge_group_key, process_export)
+
+# inotify 事件常量
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+_EVENT_HEADER = struct.Struct('iIII')
+
+class InotifyWatcher:
+    """基于 ctypes 的最小 inotify 封装，递归监听目录，返回发生变化 (含删除和移出) 的文件路径"""
+
+    def __init__(self, root):
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name or not sys.platform.startswith('linux'):
+            raise OSError("inotify 不可用")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self._dirs = {}
+        for dirpath, _, _ in os.walk(root):
+            self._add_watch(dirpath)
+
+    def _add_watch(self, path):
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY | IN_DELETE | IN_MOVED_FROM
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd >= 0:
+            self._dirs[wd] = path
+
+    def poll(self, timeout):
+        """等待最多 timeout 秒，返回变化的文件路径集合"""
+        changed = set()
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return changed
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b'\0')
+            offset += name_len
+            parent = self._dirs.get(wd)
+            if parent is None or not name:
+                continue
+            path = os.path.join(parent, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # 新建子目录：加入监听，并把其中已有的文件视为新文件
+                    for dirpath, _, files in os.walk(path):
+                        self._add_watch(dirpath)
+                        changed.update(os.path.join(dirpath, f) for f in files)
+                continue
+            changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+class PollingWatcher:
+    """轮询回退：定期扫描目录，比较文件大小和修改时间"""
+
+    def __init__(self, root, interval=2.0):
+        self.root = root
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for rel_path in find_exports(self.root):
+            path = os.path.join(self.root, rel_path)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            snapshot[path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def poll(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        current = self._scan()
+        changed = {p for p, sig in current.items() if self._snapshot.get(p) != sig}
+        # 已删除的文件
+        changed.update(p for p in self._snapshot if p not in current)
+        self._snapshot = current
+        return changed
+
+    def close(self):
+        pass
+
+class MergeGroup:
+    """
+    一个合并分组 (同类报表、同一期间) 的增量状态。
+    每个文件只在变化时读取一次并缓存；合计由缓存的各文件数据框按 int64 分重新累加 (见 core.money)，
+    与对同一批文件重新合并 (按文件名顺序、精确模式) 的结果完全相同，多次更新也不会累积浮点误差。
+    """
+
+    def __init__(self, name, output_path):
+        self.name = name
+        self.output_path = output_path
+        self.frames = {}      # {相对路径: 规范化后的数据框}
+        self.orders = {}      # {相对路径: 该文件的列顺序}
+        self.total = None
+        self.header_row = None
+        self.index_name = None
+        self.column_order = []
+
+    def update(self, rel_path, processed_path):
+        """用新的处理结果替换该文件的旧贡献，只读取这一个文件"""
+        if self.header_row is None:
+            self.header_row, self.index_name = find_header_row(processed_path)
+        frame, order = load_merge_frame(processed_path, self.header_row, self.index_name)
+        self.frames[rel_path] = frame
+        self.orders[rel_path] = order
+        self._recompute()
+
+    def remove(self, rel_path):
+        """去掉已删除文件的贡献，返回该分组是否还有文件"""
+        if self.frames.pop(rel_path, None) is not None:
+            self.orders.pop(rel_path, None)
+            self._recompute()
+        return bool(self.frames)
+
+    def _recompute(self):
+        if not self.frames:
+            self.total = None
+            return
+        # 与批量合并一样，列顺序取第一个文件的顺序
+        rel_paths = sorted(self.frames)
+        self.column_order = self.orders[rel_paths[0]]
+        frames = [self.frames[rel_path] for rel_path in rel_paths]
+        cents = money.sum_frames_exact(frames)
+        self.total = pd.DataFrame(money.from_cents(cents.to_numpy()), index=cents.index, columns=cents.columns)
+
+    def write(self):
+        df = finalize_merged_frame(self.total, self.index_name, self.column_order)
+        tmp_path = os.path.join(os.path.dirname(self.output_path), f".{os.path.basename(self.output_path)}.tmp.xlsx")
+        if write_merged_excel({'df': df}, tmp_path):
+            os.replace(tmp_path, self.output_path)
+            return True
+        return False
+
+class ExportWatcher:
+    def __init__(self, watch_dir, output_dir, workers=None, merge_by='year', settle=5.0,
+                 poll_interval=2.0, use_inotify=True, custom_config=None, results_db=None):
+        self.watch_dir = watch_dir
+        self.output_dir = output_dir
+        self.merge_by = merge_by
+        self.settle = settle
+        self.custom_config = custom_config
+        self.results_db = results_db
+        self.digest = config_digest(custom_config if custom_config else load_group_config())
+
+        os.makedirs(output_dir, exist_ok=True)
+        self.manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+        self.manifest = load_manifest(self.manifest_path)
+
+        self.pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self.pending = {}     # {绝对路径: (大小, 修改时间, 最后一次变化的时间)}
+        self.running = {}     # {future: (相对路径, 哈希, 输出路径)}
+        self.requeue = {}     # 处理期间再次变化的文件 {相对路径: 绝对路径}
+        self.groups = {}
+
+        self.source = None
+        if use_inotify:
+            try:
+                self.source = InotifyWatcher(watch_dir)
+                print(f"使用 inotify 监听: {watch_dir}")
+            except OSError as e:
+                print(f"inotify 不可用 ({e})，改用轮询")
+        if self.source is None:
+            self.source = PollingWatcher(watch_dir, poll_interval)
+            print(f"轮询监听: {watch_dir} (每 {poll_interval} 秒)")
+
+        # 启动时把已有的文件全部作为候选，manifest 会跳过未变化的文件
+        for rel_path in find_exports(watch_dir):
+            self._touch(os.path.join(watch_dir, rel_path))
+        # 已处理过的文件重新载入合并分组，保证合并结果完整；监控停止期间删除的文件移除
+        for rel_path, entry in sorted(self.manifest['files'].items()):
+            if not os.path.exists(os.path.join(watch_dir, rel_path)):
+                self._remove(rel_path)
+            elif os.path.exists(entry.get('output', '')):
+                self._update_merge(rel_path, entry['output'], write=False)
+        for group in self.groups.values():
+            group.write()
+
+    def _touch(self, path):
+        name = os.path.basename(path)
+        if not name.endswith(('.xls', '.xlsx')) or name.startswith(('~', '.~', '.')):
+            return
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.pending.pop(path, None)
+            return
+        self.pending[path] = (st.st_size, st.st_mtime_ns, time.monotonic())
+
+    def _ready_files(self):
+        """返回已经稳定 settle 秒的文件 (大小和修改时间都不再变化)"""
+        now = time.monotonic()
+        ready = []
+        for path, (size, mtime, changed_at) in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime):
+                self.pending[path] = (st.st_size, st.st_mtime_ns, now)
+            elif now - changed_at >= self.settle:
+                del self.pending[path]
+                ready.append(path)
+        return ready
+
+    def _in_flight(self, rel_path):
+        return any(running[0] == rel_path for running in self.running.values())
+
+    def _submit(self, path):
+        rel_path = os.path.relpath(path, self.watch_dir)
+        if self._in_flight(rel_path):
+            # 同一文件不并发处理 (会写同一个输出文件)，本次处理完成后再提交
+            self.requeue[rel_path] = path
+            return
+        digest = file_sha256(path)
+        entry = self.manifest['files'].get(rel_path)
+        if entry and entry.get('sha256') == digest and entry.get('config') == self.digest \
+                and os.path.exists(entry.get('output', '')):
+            return
+        output_path = processed_output_path(self.output_dir, rel_path)
+        future = self.pool.submit(process_export, path, output_path, self.custom_config, self.results_db)
+        self.running[future] = (rel_path, digest, output_path)
+        print(f"开始处理: {rel_path}")
+
+    def _update_merge(self, rel_path, processed_path, write=True):
+        if not self.merge_by:
+            return
+        key = merge_group_key(rel_path, self.merge_by)
+        if key is None:
+            return
+        name = key[0]
+        group = self.groups.get(name)
+        if group is None:
+            group = MergeGroup(name, os.path.join(self.output_dir, 'merged', f"{name}_合并.xlsx"))
+            self.groups[name] = group
+        try:
+            group.update(rel_path, processed_path)
+            if write and group.write():
+                print(f"已更新合并结果: {group.output_path}")
+        except Exception as e:
+            print(f"更新合并结果失败 {name}: {e}")
+
+    def _group_for(self, rel_path):
+        key = merge_group_key(rel_path, self.merge_by) if self.merge_by else None
+        return self.groups.get(key[0]) if key else None
+
+    def _remove(self, rel_path, output_path=None):
+        """源文件已删除：从合并分组中减去，删除 manifest 记录和处理结果"""
+        self.requeue.pop(rel_path, None)
+        entry = self.manifest['files'].pop(rel_path, None)
+        if entry:
+            save_manifest(self.manifest_path, self.manifest)
+            output_path = output_path or entry.get('output')
+        if output_path and os.path.exists(output_path):
+            os.remove(output_path)
+
+        group = self._group_for(rel_path)
+        if group is None or rel_path not in group.frames:
+            return
+        try:
+            if group.remove(rel_path):
+                if group.write():
+                    print(f"已更新合并结果: {group.output_path}")
+            else:
+                del self.groups[group.name]
+                if os.path.exists(group.output_path):
+                    os.remove(group.output_path)
+                print(f"合并分组已无文件，删除合并结果: {group.output_path}")
+        except Exception as e:
+            print(f"更新合并结果失败 {group.name}: {e}")
+        print(f"源文件已删除: {rel_path}")
+
+    def _removed(self, path):
+        """处理文件删除事件 (正在处理的文件在处理完成后再移除)"""
+        self.pending.pop(path, None)
+        rel_path = os.path.relpath(path, self.watch_dir)
+        self.requeue.pop(rel_path, None)
+        if not self._in_flight(rel_path):
+            self._remove(rel_path)
+
+    def _collect(self):
+        for future in [f for f in self.running if f.done()]:
+            rel_path, digest, output_path = self.running.pop(future)
+            ok, elapsed = future.result()
+            source_path = os.path.join(self.watch_dir, rel_path)
+            if not os.path.exists(source_path):
+                self._remove(rel_path, output_path)
+                continue
+            if not ok:
+                print(f"处理失败: {rel_path}")
+                self._resubmit(rel_path)
+                continue
+            self.manifest['files'][rel_path] = {
+                'sha256': digest,
+                'config': self.digest,
+                'output': output_path,
+                'seconds': round(elapsed, 3),
+            }
+            save_manifest(self.manifest_path, self.manifest)
+            print(f"处理完成: {rel_path} ({elapsed:.1f}s)")
+            self._update_merge(rel_path, output_path)
+            self._resubmit(rel_path)
+
+    def _resubmit(self, rel_path):
+        """处理期间文件又变化了：按新的内容重新提交 (内容与刚记录的哈希相同时 _submit 会跳过)"""
+        path = self.requeue.pop(rel_path, None)
+        if path and os.path.exists(path):
+            self._submit(path)
+
+    def run_once(self, timeout=1.0):
+        for path in self.source.poll(timeout):
+            if os.path.exists(path):
+                self._touch(path)
+            else:
+                self._removed(path)
+        for path in self._ready_files():
+            self._submit(path)
+        self._collect()
+
+    def run_forever(self):
+        print("开始监控，按 Ctrl+C 退出")
+        try:
+            while True:
+                self.run_once()
+        except KeyboardInterrupt:
+            print("正在退出...")
+        finally:
+            self.close()
+
+    def close(self):
+        self.source.close()
+        self.pool.shutdown(wait=True)
+        self._collect()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="监控导出目录并自动处理新文件")
+    parser.add_argument('watch_dir', nargs='?', default='excels/data_export', help="监控的导出目录")
+    parser.add_argument('output_dir', nargs='?', default='excels/watch_output', help="输出目录")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="并行进程数，默认为 CPU 核心数")
+    parser.add_argument('--merge-by', choices=['year', 'quarter', 'month', 'none'], default='year',
+                        help="按期间增量合并同类报表，none 表示不合并")
+    parser.add_argument('--settle', type=float, default=5.0, help="文件保持不变多少秒后才开始处理")
+    parser.add_argument('--poll', type=float, default=2.0, help="轮询模式的扫描间隔 (秒)")
+    parser.add_argument('--no-inotify', action='store_true', help="强制使用轮询模式")
+    parser.add_argument('--results-db', default=None, help="同时写入 SQLite 结果库")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.watch_dir):
+        print(f"错误: 监控目录不存在 {args.watch_dir}")
+        return 1
+
+    watcher = ExportWatcher(args.watch_dir, args.output_dir, workers=args.workers,
+                            merge_by=None if args.merge_by == 'none' else args.merge_by,
+                            settle=args.settle, poll_interval=args.poll,
+                            use_inotify=not args.no_inotify, results_db=args.results_db)
+    watcher.run_forever()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
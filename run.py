@@ -1,22 +1,76 @@
 import os
 from flask import Flask
 from app.routes import register_routes
+from core.readers import select_backends
 
-def create_app():
+def create_app(instance_dir=None):
     app = Flask(__name__, 
                 template_folder='app/templates', 
                 static_folder='app/static')
 
     # 配置上传和下载目录
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-    app.config['UPLOAD_FOLDER'] = os.path.join(BASE_DIR, 'temp_uploads')
-    app.config['DOWNLOAD_FOLDER'] = os.path.join(BASE_DIR, 'temp_downloads')
+    # 运行时数据 (上传、下载、结果库、剖析、期间立方体) 的根目录，默认为项目目录；
+    # 压测等场景通过参数或 APP_INSTANCE_DIR 环境变量指向临时目录，不触碰正式数据
+    DATA_DIR = instance_dir or os.environ.get('APP_INSTANCE_DIR') or BASE_DIR
+    app.config['UPLOAD_FOLDER'] = os.path.join(DATA_DIR, 'temp_uploads')
+    app.config['DOWNLOAD_FOLDER'] = os.path.join(DATA_DIR, 'temp_downloads')
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+    # 内存中缓存的任务结果数量和总大小上限 (用于汇总接口和延迟生成)
+    app.config['RESULT_CACHE_SIZE'] = 32
+    app.config['RESULT_CACHE_BYTES'] = 512 * 1024 * 1024
+    # 分块上传：单个文件上限、建议分块大小 (需小于 MAX_CONTENT_LENGTH)、未完成上传和已完成文件的保留秒数
+    # 完成的上传位于 UPLOAD_FOLDER/chunked/complete，也可直接作为 core.batch 的输入目录
+    app.config['CHUNKED_UPLOAD_MAX_BYTES'] = 2 * 1024 * 1024 * 1024
+    app.config['CHUNKED_UPLOAD_CHUNK_BYTES'] = 8 * 1024 * 1024
+    app.config['CHUNKED_UPLOAD_TTL'] = 24 * 3600
+    app.config['CHUNKED_UPLOAD_COMPLETE_TTL'] = 7 * 24 * 3600
+    # 期间对比结果缓存数量 (按输入文件哈希)
+    app.config['COMPARE_CACHE_SIZE'] = 16
+    # 延迟生成模式：先返回前 N 行预览，首次下载时再生成 xlsx
+    app.config['LAZY_OUTPUT'] = False
+    # 延迟生成的结果保存在下载目录中 (多个 worker 共享)，超过该秒数未下载则丢弃
+    app.config['LAZY_OUTPUT_TTL'] = 24 * 3600
+    app.config['PREVIEW_ROWS'] = 20
+    # 超过该大小的 xlsx 使用流式处理 (内存占用只取决于块大小)，每块行数
+    app.config['STREAMING_THRESHOLD_BYTES'] = 8 * 1024 * 1024
+    app.config['STREAMING_CHUNK_ROWS'] = 5000
+    # 金额按 int64 分精确累加 (分组合计和合并)，请求中的 exact 参数可覆盖；
+    # 设为 'strict' 时遇到不足一分的金额 (如 12.345) 报错而不是四舍五入
+    app.config['EXACT_MONEY'] = False
+    # 进度事件 (SSE) 的共享目录 (多个 worker 都能订阅) 和任务结束后保留的秒数
+    app.config['PROGRESS_DIR'] = os.path.join(DATA_DIR, 'data', 'progress')
+    app.config['PROGRESS_TTL'] = 600
+    # 管理员令牌 (X-Admin-Token 请求头)，未设置时管理员接口不可用
+    app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+    # 性能剖析：管理员请求带 X-Profile: 1 时剖析单次处理/合并；PROFILE_REQUESTS 为 True 时剖析全部
+    app.config['PROFILE_REQUESTS'] = False
+    app.config['PROFILE_DIR'] = os.path.join(DATA_DIR, 'data', 'profiles')
+    app.config['PROFILE_KEEP'] = 50
+    # 处理结果 SQLite 库 (设为 None 可关闭)
+    app.config['RESULTS_DB'] = os.path.join(DATA_DIR, 'data', 'results.sqlite3')
+    # 期间立方体目录 (月度处理结果的前缀和，供任意月份区间合计；设为 None 可关闭)
+    app.config['CUBE_DIR'] = os.path.join(DATA_DIR, 'data', 'cube')
+    # 处理/合并接口准入控制：同时运行的任务总成本上限、等待队列长度、最长等待秒数
+    app.config['ADMISSION_MAX_COST'] = os.cpu_count() or 2
+    app.config['ADMISSION_MAX_QUEUE'] = 16
+    app.config['ADMISSION_MAX_WAIT'] = 120
+    # 每多少字节上传计为 1 个成本单位
+    app.config['ADMISSION_BYTES_PER_UNIT'] = 4 * 1024 * 1024
+    # 读取后端基准测试样本目录 (存在时启动时自动选择最快的读取后端)
+    app.config['READER_BENCHMARK_DIR'] = os.path.join(BASE_DIR, 'excels', 'data_export')
 
     # 确保目录存在
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     os.makedirs(app.config['DOWNLOAD_FOLDER'], exist_ok=True)
 
+    # 用样本文件做一次微基准测试，选择读取后端
+    benchmark_dir = app.config['READER_BENCHMARK_DIR']
+    if benchmark_dir and os.path.isdir(benchmark_dir):
+        samples = sorted(os.path.join(benchmark_dir, f) for f in os.listdir(benchmark_dir)
+                         if f.endswith(('.xls', '.xlsx')) and not f.startswith('~'))
+        select_backends(samples)
+
     # 注册路由
     register_routes(app)
     
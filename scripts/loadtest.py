@@ -0,0 +1,374 @@
+"""
+本地压力测试：启动应用 (或连接已运行的服务)，用合成的导出文件从多个并发客户端
+按比例回放 /api/process_data、/api/merge_files、/api/config 和下载请求。
+
+报告吞吐量、各接口 p50/p95/p99 延迟、错误率，以及服务进程 (含子进程) 的 RSS 随时间变化，
+结果保存为 JSON，便于比较不同的部署方式和 worker 数量。
+
+用法:
+    python scripts/loadtest.py --clients 30 --duration 60
+    python scripts/loadtest.py --clients 30 --server-cmd "gunicorn -w 4 -b 127.0.0.1:{port} run:app" --label gunicorn-4
+    python scripts/loadtest.py --url http://127.0.0.1:5010 --mix process=1,config=1
+"""
+
+import os
+import sys
+import math
+import json
+import time
+import uuid
+import random
+import shlex
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+
+from openpyxl import Workbook
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from core.config_loader import load_group_config
+
+DEFAULT_MIX = 'process=5,merge=2,config=2,download=1'
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# ---------- 合成数据 ----------
+
+def make_export(path, period, departments=40, extra_items=5, seed=0):
+    """生成与 HIS 导出结构相同的源文件 (前 3 行为标题，第 4 行为表头，末尾为制表人)"""
+    rng = random.Random(seed)
+    items = [i for g in load_group_config()['groups'] for i in g['items']]
+    items = list(dict.fromkeys(items))[:40] + [f"其他项目{i}" for i in range(extra_items)]
+
+    wb = Workbook()
+    ws = wb.active
+    ws.append([f"全院收入 (按科室) {period}"])
+    ws.append([f"统计期间: {period}"])
+    ws.append([])
+    ws.append(['开单科室', '合计'] + items)
+    for d in range(departments):
+        values = [round(rng.uniform(0, 5000), 2) if rng.random() > 0.3 else None for _ in items]
+        ws.append([f"内科{d}", round(sum(v for v in values if v), 2)] + values)
+    ws.append(['制表人: 压测'])
+    wb.save(path)
+
+def make_dataset(work_dir, files=12, departments=40):
+    """按月份生成一年的源文件，返回路径列表"""
+    paths = []
+    for month in range(1, files + 1):
+        path = os.path.join(work_dir, f"全院收入_按科室2025{month:02d}门诊-开单科室.xlsx")
+        make_export(path, f"2025{month:02d}", departments=departments, seed=month)
+        paths.append(path)
+    return paths
+
+# ---------- HTTP ----------
+
+def _multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8'))
+    for name, path in files:
+        filename = os.path.basename(path)
+        with open(path, 'rb') as f:
+            content = f.read()
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8') + content + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+def _request(url, data=None, content_type=None, timeout=300):
+    """返回 (状态码, 响应体)；连接错误返回状态码 0"""
+    req = urllib.request.Request(url, data=data)
+    if content_type:
+        req.add_header('Content-Type', content_type)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+    except Exception as e:
+        return 0, str(e).encode('utf-8')
+
+# ---------- 服务进程与 RSS ----------
+
+def _children(pid):
+    children = []
+    try:
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tid}/children') as f:
+                children.extend(int(c) for c in f.read().split())
+    except OSError:
+        pass
+    return children
+
+def tree_rss(pid):
+    """进程及其全部子进程的 RSS 字节数 (读取 /proc，非 Linux 返回 None)"""
+    total, stack, seen = 0, [pid], set()
+    while stack:
+        p = stack.pop()
+        if p in seen:
+            continue
+        seen.add(p)
+        try:
+            with open(f'/proc/{p}/statm') as f:
+                total += int(f.read().split()[1]) * PAGE_SIZE
+        except OSError:
+            if p == pid:
+                return None
+            continue
+        stack.extend(_children(p))
+    return total
+
+def start_server(server_cmd, port, log_path, instance_dir):
+    """
+    启动被测服务。上传、下载、结果库等运行时数据通过 APP_INSTANCE_DIR 放在 instance_dir 中，
+    合成的期间数据不会写入正式的结果库和下载目录。
+    """
+    cmd = server_cmd.format(port=port, python=shlex.quote(sys.executable))
+    log = open(log_path, 'w')
+    env = dict(os.environ, APP_INSTANCE_DIR=instance_dir)
+    proc = subprocess.Popen(shlex.split(cmd), cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"服务启动失败，详见 {log_path}")
+        status, _ = _request(url + '/api/config', timeout=2)
+        if status == 200:
+            return proc, url
+        time.sleep(0.3)
+    proc.terminate()
+    raise RuntimeError("等待服务启动超时")
+
+# ---------- 负载 ----------
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ('process', 'merge', 'config', 'download'):
+            raise ValueError(f"未知的请求类型: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+class LoadRunner:
+    def __init__(self, url, dataset, mix, clients, duration=None, requests=None, merge_files=3, seed=0):
+        self.url = url
+        self.dataset = dataset
+        self.mix = mix
+        self.clients = clients
+        self.duration = duration
+        self.total_requests = requests
+        self.merge_files = merge_files
+        self.rng = random.Random(seed)
+
+        self.records = []
+        self.downloads = []
+        self._lock = threading.Lock()
+        self._issued = 0
+        self._start = None
+
+    def _next_op(self, rng):
+        with self._lock:
+            if self.total_requests is not None:
+                if self._issued >= self.total_requests:
+                    return None
+                self._issued += 1
+            downloads_ready = bool(self.downloads)
+        if self.duration is not None and time.monotonic() - self._start >= self.duration:
+            return None
+        ops = [op for op in self.mix if op != 'download' or downloads_ready]
+        return rng.choices(ops, weights=[self.mix[op] for op in ops])[0]
+
+    def _call(self, op, rng):
+        if op == 'config':
+            return _request(self.url + '/api/config')
+        if op == 'download':
+            with self._lock:
+                path = rng.choice(self.downloads)
+            return _request(self.url + path)
+        if op == 'process':
+            body, ctype = _multipart([('lazy', '0')], [('file', rng.choice(self.dataset))])
+            return _request(self.url + '/api/process_data', body, ctype)
+        files = rng.sample(self.dataset, min(self.merge_files, len(self.dataset)))
+        body, ctype = _multipart([], [('files', p) for p in files])
+        return _request(self.url + '/api/merge_files', body, ctype)
+
+    def _client(self, client_id):
+        rng = random.Random(self.rng.random() + client_id)
+        while True:
+            op = self._next_op(rng)
+            if op is None:
+                return
+            started = time.monotonic()
+            status, body = self._call(op, rng)
+            latency = time.monotonic() - started
+            if op in ('process', 'merge') and status == 200:
+                try:
+                    url = json.loads(body).get('download_url')
+                except ValueError:
+                    url = None
+                if url:
+                    with self._lock:
+                        self.downloads.append(url)
+            with self._lock:
+                self.records.append({
+                    'op': op,
+                    'start': round(started - self._start, 4),
+                    'latency': round(latency, 4),
+                    'status': status,
+                })
+
+    def run(self, server_pid=None, sample_interval=0.5):
+        self._start = time.monotonic()
+        rss_samples = []
+        stop = threading.Event()
+
+        def sample():
+            while not stop.is_set():
+                rss = tree_rss(server_pid)
+                if rss is not None:
+                    rss_samples.append({'t': round(time.monotonic() - self._start, 2), 'rss_bytes': rss})
+                stop.wait(sample_interval)
+
+        sampler = None
+        if server_pid:
+            sampler = threading.Thread(target=sample, daemon=True)
+            sampler.start()
+
+        threads = [threading.Thread(target=self._client, args=(i,)) for i in range(self.clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - self._start
+        stop.set()
+        if sampler:
+            sampler.join()
+        return elapsed, rss_samples
+
+# ---------- 统计 ----------
+
+def percentile(sorted_values, q):
+    """最近秩法百分位数"""
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, math.ceil(q / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+def summarize(records, elapsed):
+    def stats(rows):
+        latencies = sorted(r['latency'] for r in rows)
+        errors = sum(1 for r in rows if r['status'] != 200)
+        busy = sum(1 for r in rows if r['status'] == 503)
+        return {
+            'requests': len(rows),
+            'throughput_rps': round(len(rows) / elapsed, 3) if elapsed else None,
+            'error_rate': round(errors / len(rows), 4) if rows else 0.0,
+            'rejected_503': busy,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1] if latencies else None,
+        }
+
+    by_op = {}
+    for r in records:
+        by_op.setdefault(r['op'], []).append(r)
+    return {'overall': stats(records), 'by_op': {op: stats(rows) for op, rows in sorted(by_op.items())}}
+
+def print_report(summary, rss_samples, elapsed):
+    print(f"\n耗时 {elapsed:.1f}s")
+    print(f"{'接口':<10}{'请求数':>8}{'吞吐/s':>10}{'错误率':>9}{'503':>6}{'p50':>9}{'p95':>9}{'p99':>9}")
+    rows = list(summary['by_op'].items()) + [('合计', summary['overall'])]
+    for op, s in rows:
+        fmt = lambda v: f"{v:.3f}" if v is not None else '-'
+        print(f"{op:<10}{s['requests']:>8}{s['throughput_rps'] or 0:>10.2f}{s['error_rate']:>9.2%}"
+              f"{s['rejected_503']:>6}{fmt(s['p50']):>9}{fmt(s['p95']):>9}{fmt(s['p99']):>9}")
+    if rss_samples:
+        peak = max(s['rss_bytes'] for s in rss_samples) / 1024 / 1024
+        print(f"服务 RSS: 起始 {rss_samples[0]['rss_bytes'] / 1024 / 1024:.1f} MB，峰值 {peak:.1f} MB，"
+              f"结束 {rss_samples[-1]['rss_bytes'] / 1024 / 1024:.1f} MB")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Flask 接口本地压力测试")
+    parser.add_argument('--url', default=None, help="连接已运行的服务 (不启动新进程)")
+    parser.add_argument('--server-cmd', default="{python} -c \"from run import app; app.run(host='127.0.0.1', port={port}, threaded=True)\"",
+                        help="启动服务的命令，{port} 和 {python} 会被替换；"
+                             "运行时数据写入临时目录 (APP_INSTANCE_DIR)，自定义命令须使用 run.create_app 或 run:app")
+    parser.add_argument('--server-pid', type=int, default=None, help="使用 --url 时用于采样 RSS 的服务进程 ID")
+    parser.add_argument('--port', type=int, default=5011)
+    parser.add_argument('-c', '--clients', type=int, default=10, help="并发客户端数")
+    parser.add_argument('-d', '--duration', type=float, default=30, help="持续时间 (秒)")
+    parser.add_argument('-n', '--requests', type=int, default=None, help="总请求数 (指定后忽略 --duration)")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"请求比例，默认 {DEFAULT_MIX}")
+    parser.add_argument('--files', type=int, default=12, help="合成源文件数量 (按月)")
+    parser.add_argument('--departments', type=int, default=40, help="每个合成文件的科室数")
+    parser.add_argument('--merge-files', type=int, default=3, help="每次合并请求上传的文件数")
+    parser.add_argument('--label', default=None, help="结果标签 (如部署方式、worker 数)")
+    parser.add_argument('--output', default=None, help="结果 JSON 路径，默认 loadtest_results/<时间>.json")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    work_dir = tempfile.mkdtemp(prefix='loadtest_')
+    dataset = make_dataset(work_dir, files=args.files, departments=args.departments)
+    print(f"已生成 {len(dataset)} 个合成源文件: {work_dir}")
+
+    proc = None
+    server_pid = args.server_pid
+    url = args.url
+    if not url:
+        proc, url = start_server(args.server_cmd, args.port, os.path.join(work_dir, 'server.log'),
+                                 os.path.join(work_dir, 'instance'))
+        server_pid = proc.pid
+        print(f"服务已启动: {url} (pid {proc.pid})")
+
+    try:
+        runner = LoadRunner(url, dataset, mix, args.clients,
+                            duration=None if args.requests else args.duration,
+                            requests=args.requests, merge_files=args.merge_files, seed=args.seed)
+        print(f"开始压测: {args.clients} 个客户端，比例 {args.mix}")
+        elapsed, rss_samples = runner.run(server_pid=server_pid)
+    finally:
+        if proc:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    summary = summarize(runner.records, elapsed)
+    print_report(summary, rss_samples, elapsed)
+
+    output = args.output or os.path.join(BASE_DIR, 'loadtest_results', time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'label': args.label,
+            'url': url,
+            'server_cmd': None if args.url else args.server_cmd,
+            'clients': args.clients,
+            'mix': mix,
+            'files': args.files,
+            'departments': args.departments,
+            'elapsed_seconds': round(elapsed, 3),
+            'summary': summary,
+            'rss': rss_samples,
+            'requests': runner.records,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {output}")
+    return 1 if summary['overall']['requests'] == 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
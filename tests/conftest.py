@@ -0,0 +1,59 @@
+"""
+测试数据：按 HIS 导出版式生成的合成源文件 (前 3 行为标题，第 4 行为表头，最后一行为制表人)。
+金额均为整分，合计 = 各明细项目之和，便于按分精确核对。
+"""
+
+import os
+import numpy as np
+import pytest
+from openpyxl import Workbook
+
+from core.processor import process_hospital_data
+
+ITEMS = ['挂号费', '诊查费', '针灸费', 'CT费', '化验费', '西药费', '中成药费', '材料费']
+PERIODS = ['202501', '202502', '202503']
+
+def export_values(period, n_departments=6):
+    """某期间的 (科室列表, 明细金额矩阵 (元))；各期间科室略有不同"""
+    seed = int(period)
+    rng = np.random.default_rng(seed)
+    departments = [f"科室{i}" for i in range(n_departments)]
+    if period.endswith('02'):
+        departments[-1] = '新设科室'
+    cents = rng.integers(0, 500000, size=(len(departments), len(ITEMS)))
+    cents[rng.random(cents.shape) < 0.2] = 0
+    return departments, cents / 100
+
+def write_export(path, period, dept_col='开单科室'):
+    departments, values = export_values(period)
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['全院收入按科室'])
+    ws.append([f'期间 {period}'])
+    ws.append([])
+    ws.append([dept_col, '合计'] + ITEMS)
+    for dept, row in zip(departments, values):
+        total = int(round(row.sum() * 100)) / 100
+        ws.append([dept, total] + [v if v else None for v in row.tolist()])
+    ws.append(['制表人: 测试'])
+    wb.save(path)
+    return path
+
+@pytest.fixture
+def exports(tmp_path):
+    """三个月的源文件路径"""
+    src_dir = tmp_path / 'src'
+    src_dir.mkdir()
+    return [write_export(str(src_dir / f"全院收入_按科室{p}门诊-开单科室.xlsx"), p) for p in PERIODS]
+
+@pytest.fixture
+def processed(tmp_path, exports):
+    """三个月的处理结果路径"""
+    out_dir = tmp_path / 'processed'
+    out_dir.mkdir()
+    paths = []
+    for src in exports:
+        out = str(out_dir / os.path.basename(src).replace('.xlsx', '_processed.xlsx'))
+        assert process_hospital_data(src, out)
+        paths.append(out)
+    return paths
@@ -0,0 +1,26 @@
+import os
+import shutil
+
+from core.batch import run_batch, merge_group_key, load_manifest, MANIFEST_NAME
+
+def test_merge_group_key_with_braces_in_name():
+    assert merge_group_key('全院收入{门诊}202503_processed.xlsx', 'quarter') == ('全院收入{门诊}2025Q1', '2025Q1')
+    assert merge_group_key('收入}{0}202511.xlsx', 'year') == ('收入}{0}2025', '2025')
+
+def test_failed_reprocess_is_excluded_from_merge(tmp_path, exports):
+    input_dir, output_dir = tmp_path / 'in', tmp_path / 'out'
+    input_dir.mkdir()
+    for src in exports:
+        shutil.copy(src, input_dir)
+    assert run_batch(str(input_dir), str(output_dir), workers=1, merge_by='year') == (3, 0)
+
+    # 修改后的文件无法处理：旧的处理结果不能继续参与合并
+    broken = os.path.basename(exports[1])
+    with open(input_dir / broken, 'wb') as f:
+        f.write(b'not an excel file')
+    assert run_batch(str(input_dir), str(output_dir), workers=1, merge_by='year') == (0, 1)
+
+    manifest = load_manifest(str(output_dir / MANIFEST_NAME))
+    assert broken not in manifest['files']
+    (merge,) = manifest['merges'].values()
+    assert merge['inputs'] == [manifest['files'][os.path.basename(p)]['output'] for p in (exports[0], exports[2])]
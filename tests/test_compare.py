@@ -0,0 +1,21 @@
+import numpy as np
+from openpyxl import load_workbook
+
+from core.compare import compute_comparison, write_comparison_excel, sheet_title
+
+def test_sheet_titles_are_valid_and_unique():
+    used = set()
+    titles = [sheet_title(name, used) for name in ['差额_a/b:c*?', '差额_' + 'x' * 40, '差额_' + 'x' * 40, '差额_A/B:C*?']]
+    assert all(len(t) <= 31 and not set(t) & set('[]:*?/\\') for t in titles)
+    assert len({t.lower() for t in titles}) == len(titles)
+
+def test_comparison_workbook_with_hostile_labels(tmp_path, processed):
+    labels = ['2025/03', '[基期]:一月*', '[基期]:一月*']
+    result = compute_comparison(processed, labels)
+    # 本期与基期的差额
+    assert np.allclose(result['delta'][0], result['values'][0] - result['values'][1])
+
+    path = str(tmp_path / 'compare.xlsx')
+    assert write_comparison_excel(result, path)
+    names = load_workbook(path, read_only=True).sheetnames
+    assert len(names) == 2 * len(labels) and len(set(names)) == len(names)
@@ -0,0 +1,56 @@
+import multiprocessing
+import numpy as np
+import pytest
+
+from core.cube import PeriodCube, CubeError
+from core.merger import compute_merge_paths
+
+def _assert_same(result, paths):
+    """区间合计与逐文件精确合并的结果按分完全一致 (科室和列相同)"""
+    merged = compute_merge_paths(paths, exact=True)
+    a = result['df'].set_index(result['dept_col'])
+    b = merged['df'].set_index(merged['dept_col'])
+    assert set(a.index) == set(b.index) and set(a.columns) == set(b.columns)
+    b = b.loc[a.index, a.columns]
+    assert np.array_equal(np.rint(a.to_numpy() * 100), np.rint(b.to_numpy() * 100))
+
+def test_range_equals_merged_files(tmp_path, processed):
+    cube = PeriodCube(str(tmp_path / 'cube'))
+    # 乱序加入，并替换一个月份
+    for i in (2, 0, 1, 1):
+        cube.add_month([processed[i]])
+    assert cube.info()['periods'] == ['202501', '202502', '202503']
+
+    _assert_same(cube.range_total(), processed)
+    _assert_same(cube.range_total('202502', '202503'), processed[1:])
+    _assert_same(cube.range_total('202501', '202501'), processed[:1])
+    _assert_same(cube.year_to_date('202502'), processed[:2])
+    # 只在 2 月出现的科室不出现在不含 2 月的区间中
+    assert '新设科室' not in cube.range_total('202503', '202503')['df'].iloc[:, 0].tolist()
+
+def test_invalid_ranges(tmp_path, processed):
+    cube = PeriodCube(str(tmp_path / 'cube'))
+    with pytest.raises(CubeError):
+        cube.range_total()
+    cube.add_month([processed[0]])
+    for start, end in [('202504', '202506'), ('2025', None), ('202513', None)]:
+        with pytest.raises(CubeError):
+            cube.range_total(start, end)
+
+def _add(cube_dir, path):
+    PeriodCube(cube_dir).add_month([path])
+
+def test_concurrent_writers_across_processes(tmp_path, processed):
+    cube_dir = str(tmp_path / 'cube')
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=_add, args=(cube_dir, path)) for path in processed * 2]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+        assert p.exitcode == 0
+
+    cube = PeriodCube(cube_dir)
+    info = cube.info()
+    assert info['periods'] == ['202501', '202502', '202503'] and info['version'] == len(workers)
+    _assert_same(cube.range_total(), processed)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from openpyxl import load_workbook
+
+from core import money
+from core.processor import compute_hospital_data
+from core.merger import compute_merge_paths, compute_wide_merge_paths
+
+def test_to_cents_rounding_and_strict():
+    assert money.to_cents([0.1, 0.2, '1.10', None, 'x', -2.345]).tolist() == [10, 20, 110, 0, 0, -235]
+    with pytest.raises(money.MoneyError):
+        money.to_cents([1.005, 12.345], fractional='error')
+    assert money.to_cents([0.1 + 0.2], fractional='error').tolist() == [30]
+
+def test_overflow_is_detected():
+    with pytest.raises(money.MoneyOverflowError):
+        money.to_cents([2.0 ** 60])
+    big = np.array([money.INT64_MAX // 2 + 1], dtype=np.int64)
+    with pytest.raises(money.MoneyOverflowError):
+        money.add_cents(big, big)
+
+def test_parse_exact():
+    assert [money.parse_exact(v) for v in (None, False, True, '1', 'no', 'STRICT')] == \
+        [False, False, True, True, False, 'strict']
+    for value in ('strcit', 'yes please', '2'):
+        with pytest.raises(ValueError):
+            money.parse_exact(value)
+
+def test_exact_group_sums_equal_source_cents(exports):
+    result = compute_hospital_data(exports[0], exact=True)
+    df = result['df']
+    df = df[~df[result['dept_col']].astype(str).str.contains('制表人')]
+    items = money.to_cents(df[['CT费', '化验费']].to_numpy()).sum(axis=1)
+    assert np.array_equal(money.to_cents(df['检查收入合计'].to_numpy()), items)
+
+def _with_fraction(path):
+    wb = load_workbook(path)
+    wb.active.cell(row=5, column=3).value = 12.345
+    wb.save(path)
+    return path
+
+def test_strict_mode_rejects_fractional_cents(exports, processed):
+    src = _with_fraction(exports[0])
+    assert compute_hospital_data(src, exact=True) is not None
+    assert compute_hospital_data(src, exact='strict') is None
+
+    _with_fraction(processed[0])
+    assert compute_merge_paths(processed, exact=True) is not None
+    assert compute_merge_paths(processed, exact='strict') is None
+    assert compute_wide_merge_paths(processed, exact='strict') is None
+    assert compute_merge_paths(processed[1:], exact='strict') is not None
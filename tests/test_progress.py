@@ -0,0 +1,27 @@
+import json
+import threading
+
+from app.progress import ProgressBroker
+
+def _events(chunks):
+    return [json.loads(c.split("data: ", 1)[1]) for c in chunks if c.startswith("id:")]
+
+def test_subscriber_on_another_worker_receives_events(tmp_path):
+    # 两个 broker 共享目录，相当于两个 worker 进程
+    publisher = ProgressBroker(str(tmp_path), poll_interval=0.01)
+    subscriber = ProgressBroker(str(tmp_path), poll_interval=0.01)
+    task_id = 'c4d8e3c0-0000-4000-8000-000000000001'
+
+    received = []
+    reader = threading.Thread(target=lambda: received.extend(subscriber.stream(task_id)))
+    reader.start()    # 任务开始前订阅
+    publisher.publish(task_id, {'event': 'queued'})
+    publisher.publish(task_id, {'event': 'rows', 'rows': 5000})
+    publisher.finish(task_id, status='ok')
+    reader.join(timeout=10)
+    assert not reader.is_alive()
+    assert [e['event'] for e in _events(received)] == ['queued', 'rows', 'done']
+    assert subscriber.in_use(task_id)
+
+    # 断线重连只补发 Last-Event-ID 之后的事件
+    assert [e['id'] for e in _events(subscriber.stream(task_id, last_id=2))] == [3]
@@ -0,0 +1,29 @@
+import pytest
+
+from core.projection import Projection
+from core.processor import compute_hospital_data
+from core.merger import compute_merge_paths
+
+def test_process_projection_keeps_selected_group(exports):
+    result = compute_hospital_data(exports[0], projection=Projection(groups=['03']))
+    assert result['df'].columns.tolist() == ['开单科室', '合计', '检查收入合计', 'CT费', '化验费']
+
+def test_merge_projection_keeps_only_department_and_selected_columns(processed):
+    result = compute_merge_paths(processed, projection=Projection(groups=['检查收入合计'], departments=['科室1']))
+    assert result['df'].columns.tolist() == ['开单科室', '合计', '检查收入合计', 'CT费', '化验费']
+    assert result['df']['开单科室'].tolist() == ['科室1']
+
+def test_dept_pattern_is_literal_unless_regex_allowed(processed):
+    # 未授权时按文本匹配：正则元字符没有特殊含义
+    assert compute_merge_paths(processed, projection=Projection(dept_pattern='科室.'))['df'].empty
+    rows = compute_merge_paths(processed, projection=Projection(dept_pattern='科室1'))['df']
+    assert rows['开单科室'].tolist() == ['科室1']
+    rows = compute_merge_paths(processed, projection=Projection(dept_pattern='科室[12]', dept_regex=True))['df']
+    assert sorted(rows['开单科室']) == ['科室1', '科室2']
+
+def test_dept_pattern_limits():
+    Projection(dept_pattern='(a+)+$')
+    with pytest.raises(ValueError):
+        Projection(dept_pattern='x' * 101)
+    with pytest.raises(ValueError):
+        Projection(dept_pattern='(', dept_regex=True)
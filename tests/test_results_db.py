@@ -0,0 +1,50 @@
+import pandas as pd
+
+from core import results_db
+from core.processor import compute_hospital_data
+from tests.conftest import export_values, write_export, PERIODS
+
+def _store(tmp_path, exports, dimensions=('开单科室',)):
+    db_path = str(tmp_path / 'results.sqlite3')
+    for src in exports:
+        results_db.save_result(db_path, compute_hospital_data(src))
+    for dimension in dimensions[1:]:
+        src = write_export(str(tmp_path / f"全院收入_按科室202501门诊-{dimension}.xlsx"), '202501', dept_col=dimension)
+        results_db.save_result(db_path, compute_hospital_data(src))
+    return db_path
+
+def _source_total(period, department):
+    departments, values = export_values(period)
+    return round(float(values[departments.index(department)].sum()), 2)
+
+def test_rollup_department_equals_source_total(tmp_path, exports):
+    db_path = _store(tmp_path, exports)
+    rows = results_db.query_rollup(db_path, departments=['科室0'], dimension='开单科室')
+    assert [r['period'] for r in rows] == PERIODS
+    for row in rows:
+        assert row['value'] == _source_total(row['period'], '科室0')
+
+def test_rollup_range_sums_periods(tmp_path, exports):
+    db_path = _store(tmp_path, exports)
+    rows = results_db.query_rollup(db_path, departments=['科室1'], dimension='开单科室',
+                                   start='202501', end='202502', by=['department'])
+    assert len(rows) == 1
+    expected = sum(_source_total(p, '科室1') for p in PERIODS[:2])
+    assert abs(rows[0]['value'] - expected) < 0.005
+
+def test_rollup_keeps_dimensions_apart(tmp_path, exports):
+    db_path = _store(tmp_path, exports[:1], dimensions=('开单科室', '执行科室'))
+    rows = results_db.query_rollup(db_path, departments=['科室0'])
+    assert sorted(r['dimension'] for r in rows) == ['开单科室', '执行科室']
+    assert all(r['value'] == _source_total('202501', '科室0') for r in rows)
+
+def test_rollup_items_and_groups(tmp_path, exports):
+    db_path = _store(tmp_path, exports[:1])
+    result = compute_hospital_data(exports[0])
+    df = result['df'].set_index(result['dept_col'])
+
+    item = results_db.query_rollup(db_path, items=['CT费'], dimension='开单科室', by=['item'])
+    assert item == [{'item': 'CT费', 'value': round(float(pd.to_numeric(df['CT费']).sum()), 2)}]
+
+    group = results_db.query_rollup(db_path, group='03', dimension='开单科室')
+    assert group[0]['value'] == round(float(df['检查收入合计'].sum()), 2)
@@ -0,0 +1,45 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+
+from core import results_db
+from core.processor import process_hospital_data, compute_hospital_data
+from core.streaming import process_hospital_data_streaming
+
+def _read(path):
+    return pd.read_excel(path, header=None, dtype=object)
+
+@pytest.mark.parametrize('chunk_size', [1, 4, 5000])
+def test_streaming_output_equals_in_memory(tmp_path, exports, chunk_size):
+    src = exports[1]
+    in_memory = str(tmp_path / 'memory.xlsx')
+    streamed = str(tmp_path / 'streamed.xlsx')
+    assert process_hospital_data(src, in_memory)
+    assert process_hospital_data_streaming(src, streamed, chunk_size=chunk_size)
+
+    a, b = _read(in_memory), _read(streamed)
+    assert a.shape == b.shape
+    # 两行表头 (分组 ID 和列名) 与科室列逐格相同，金额按分相等
+    assert a.iloc[:2].astype(str).equals(b.iloc[:2].astype(str))
+    assert a.iloc[2:, 0].astype(str).tolist() == b.iloc[2:, 0].astype(str).tolist()
+    values_a = pd.DataFrame(a.iloc[2:, 1:]).apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=float)
+    values_b = pd.DataFrame(b.iloc[2:, 1:]).apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=float)
+    assert np.array_equal(np.rint(values_a * 100), np.rint(values_b * 100))
+
+def _facts(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return sorted(conn.execute("SELECT period, dimension, department, item, kind, group_ids, value FROM facts"))
+    finally:
+        conn.close()
+
+def test_streaming_saves_same_facts_as_in_memory(tmp_path, exports):
+    src = exports[1]
+    in_memory_db, streamed_db = str(tmp_path / 'memory.sqlite3'), str(tmp_path / 'streamed.sqlite3')
+    results_db.save_result(in_memory_db, compute_hospital_data(src))
+    assert process_hospital_data_streaming(src, str(tmp_path / 'streamed.xlsx'), chunk_size=4,
+                                           results_db=streamed_db)
+    assert _facts(streamed_db) == _facts(in_memory_db)
+    assert results_db.query_rollup(streamed_db, dimension='开单科室') == \
+        results_db.query_rollup(in_memory_db, dimension='开单科室')
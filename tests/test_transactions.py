@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.transactions import pivot_transactions
+from core.processor import compute_hospital_data
+
+def _write_csv(path, rows):
+    pd.DataFrame(rows, columns=['开单科室', '收费项目', '金额']).to_csv(path, index=False, encoding='utf-8')
+    return str(path)
+
+def test_pivot_sums_per_department_and_item(tmp_path):
+    rng = np.random.default_rng(0)
+    rows = [(f"内科{rng.integers(3)}", ['CT费', '化验费', '西药费'][rng.integers(3)], int(rng.integers(1, 10000)) / 100)
+            for _ in range(500)]
+    rows.append(('制表人: 测试', None, None))
+    src = _write_csv(tmp_path / 'tx.csv', rows)
+
+    df = pivot_transactions(src, chunk_size=64).set_index('开单科室')
+    expected = pd.DataFrame(rows[:-1], columns=['开单科室', '收费项目', '金额']).pivot_table(
+        index='开单科室', columns='收费项目', values='金额', aggfunc='sum')
+    assert np.allclose(df.loc[expected.index, expected.columns].to_numpy(), expected.to_numpy())
+    assert np.allclose(df['合计'], df.drop(columns='合计').sum(axis=1))
+
+    result = compute_hospital_data(src, input_format='transactions')
+    assert result is not None and '检查收入合计' in result['df'].columns
+
+@pytest.mark.parametrize('item', ['合计', '开单科室', '执行科室'])
+def test_pivot_rejects_reserved_item_names(tmp_path, item):
+    src = _write_csv(tmp_path / 'tx.csv', [('内科0', 'CT费', 1.0), ('内科0', item, 2.0)])
+    with pytest.raises(ValueError):
+        pivot_transactions(src)
+
+def test_pivot_csv_header_with_bom_and_spaces(tmp_path):
+    path = tmp_path / 'tx.csv'
+    lines = ['收费明细,,', ' 开单科室 , 收费项目 ,金额 ', '内科0,CT费,1.5', '内科1,化验费,2.25', '内科0,CT费,3']
+    path.write_bytes('\ufeff'.encode('utf-8') + '\n'.join(lines).encode('utf-8'))
+    df = pivot_transactions(str(path), chunk_size=2).set_index('开单科室')
+    assert df.loc['内科0', 'CT费'] == 4.5
+    assert df.loc['内科1', '化验费'] == 2.25
@@ -0,0 +1,70 @@
+import io
+import os
+import time
+import hashlib
+import pytest
+
+from app.uploads import ChunkedUploads, UploadError
+
+def _sha(data):
+    return hashlib.sha256(data).hexdigest()
+
+@pytest.fixture
+def uploads(tmp_path):
+    return ChunkedUploads(str(tmp_path), max_bytes=1024 * 1024, ttl=60)
+
+def test_resume_from_confirmed_offset(uploads):
+    data = os.urandom(100 * 1024)
+    status = uploads.initiate('全院收入202503.xlsx', len(data), sha256=_sha(data))
+    upload_id = status['upload_id']
+
+    first = data[:40 * 1024]
+    assert uploads.write_chunk(upload_id, 0, io.BytesIO(first), _sha(first))['offset'] == len(first)
+
+    # 校验和错误的分块被截断，偏移不变
+    bad = data[40 * 1024:70 * 1024]
+    with pytest.raises(UploadError) as e:
+        uploads.write_chunk(upload_id, len(first), io.BytesIO(bad), _sha(b'other'))
+    assert e.value.extra['offset'] == len(first)
+
+    # 跳过已确认偏移的分块被拒绝；重发已确认的分块是幂等的
+    with pytest.raises(UploadError) as e:
+        uploads.write_chunk(upload_id, 50 * 1024, io.BytesIO(bad), _sha(bad))
+    assert e.value.status == 409
+    assert uploads.write_chunk(upload_id, 0, io.BytesIO(first), _sha(first))['offset'] == len(first)
+
+    # 中断后按查询到的偏移继续上传
+    offset = uploads.status(upload_id)['offset']
+    rest = data[offset:]
+    assert uploads.write_chunk(upload_id, offset, io.BytesIO(rest), _sha(rest))['offset'] == len(data)
+
+    assert uploads.finalize(upload_id)['complete']
+    with open(uploads.finalized_path(upload_id), 'rb') as f:
+        assert f.read() == data
+
+def test_finalize_rejects_incomplete_and_bad_digest(uploads):
+    data = b'x' * 1000
+    upload_id = uploads.initiate('a.xlsx', len(data))['upload_id']
+    uploads.write_chunk(upload_id, 0, io.BytesIO(data[:500]), _sha(data[:500]))
+    with pytest.raises(UploadError):
+        uploads.finalize(upload_id)
+    uploads.write_chunk(upload_id, 500, io.BytesIO(data[500:]), _sha(data[500:]))
+    with pytest.raises(UploadError):
+        uploads.finalize(upload_id, sha256=_sha(b'other'))
+    assert uploads.finalize(upload_id, sha256=_sha(data))['complete']
+
+def test_cleanup_expires_partial_and_complete(uploads):
+    data = b'y' * 10
+    partial_id = uploads.initiate('p.xlsx', len(data))['upload_id']
+    complete_id = uploads.initiate('c.xlsx', len(data))['upload_id']
+    uploads.write_chunk(complete_id, 0, io.BytesIO(data), _sha(data))
+    uploads.finalize(complete_id)
+
+    old = time.time() - 3600
+    os.utime(os.path.join(uploads.partial_dir, partial_id, 'meta.json'), (old, old))
+    os.utime(os.path.join(uploads.complete_dir, complete_id, '.meta.json'), (old, old))
+    uploads.cleanup()
+
+    assert uploads.finalized_path(complete_id) is None
+    assert not os.path.exists(os.path.join(uploads.partial_dir, partial_id))
+    assert partial_id not in uploads._locks and complete_id not in uploads._locks
@@ -0,0 +1,105 @@
+import os
+import time
+import shutil
+import numpy as np
+import pandas as pd
+
+from core.watcher import ExportWatcher, MergeGroup
+from core.merger import compute_merge_paths, finalize_merged_frame
+from core.compare import load_compare_frame
+
+def _drain(watcher, timeout=60):
+    """运行到没有待处理和处理中的文件为止"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        watcher.run_once(timeout=0.05)
+        if not watcher.pending and not watcher.running and not watcher.requeue:
+            return
+    raise AssertionError("监控任务未在限定时间内完成")
+
+def _merged_total(path):
+    frame, _ = load_compare_frame(path)
+    return frame
+
+def _watcher(watch_dir, out_dir):
+    return ExportWatcher(str(watch_dir), str(out_dir), workers=1, merge_by='year', settle=0,
+                         poll_interval=0.05, use_inotify=False)
+
+def test_removed_export_leaves_merge(tmp_path, exports):
+    watch_dir, out_dir = tmp_path / 'watch', tmp_path / 'out'
+    watch_dir.mkdir()
+    for src in exports:
+        shutil.copy(src, watch_dir)
+    watcher = _watcher(watch_dir, out_dir)
+    try:
+        _drain(watcher)
+        assert len(watcher.manifest['files']) == 3
+        (group,) = watcher.groups.values()
+
+        removed = os.path.basename(exports[0])
+        os.remove(watch_dir / removed)
+        _drain(watcher)
+        assert removed not in watcher.manifest['files']
+        assert removed not in group.frames
+
+        merged = _merged_total(group.output_path)
+        expected = None
+        for entry in watcher.manifest['files'].values():
+            frame = _merged_total(entry['output'])
+            expected = frame if expected is None else expected.add(frame, fill_value=0)
+        expected = expected.loc[merged.index, merged.columns]
+        assert np.allclose(merged.to_numpy(), expected.to_numpy())
+    finally:
+        watcher.close()
+
+def test_removed_export_dropped_on_restart(tmp_path, exports):
+    watch_dir, out_dir = tmp_path / 'watch', tmp_path / 'out'
+    watch_dir.mkdir()
+    for src in exports:
+        shutil.copy(src, watch_dir)
+    watcher = _watcher(watch_dir, out_dir)
+    _drain(watcher)
+    watcher.close()
+
+    os.remove(watch_dir / os.path.basename(exports[1]))
+    watcher = _watcher(watch_dir, out_dir)
+    try:
+        assert os.path.basename(exports[1]) not in watcher.manifest['files']
+        (group,) = watcher.groups.values()
+        assert sorted(group.frames) == sorted(os.path.basename(p) for p in (exports[0], exports[2]))
+    finally:
+        watcher.close()
+
+def test_file_in_flight_is_not_processed_twice(tmp_path, exports):
+    watch_dir, out_dir = tmp_path / 'watch', tmp_path / 'out'
+    watch_dir.mkdir()
+    path = str(watch_dir / os.path.basename(exports[0]))
+    shutil.copy(exports[0], path)
+    watcher = _watcher(watch_dir, out_dir)
+    try:
+        # 启动时的候选文件还未提交：连续提交两次只运行一次
+        watcher.pending.clear()
+        watcher._submit(path)
+        watcher._submit(path)
+        assert len(watcher.running) == 1
+        assert list(watcher.requeue) == [os.path.basename(path)]
+        _drain(watcher)
+        # 内容未变，重新提交时被 manifest 跳过
+        assert len(watcher.manifest['files']) == 1
+        assert pd.read_excel(watcher.manifest['files'][os.path.basename(path)]['output']).shape[0] > 0
+    finally:
+        watcher.close()
+
+def test_incremental_merge_equals_fresh_merge(tmp_path, exports, processed):
+    group = MergeGroup('2025', str(tmp_path / 'merged.xlsx'))
+    # 同一文件先后被不同内容替换，再删除另一个文件
+    group.update('a.xlsx', processed[0])
+    group.update('b.xlsx', processed[1])
+    group.update('c.xlsx', processed[2])
+    group.update('a.xlsx', processed[1])
+    group.update('c.xlsx', processed[0])
+    group.remove('b.xlsx')
+
+    fresh = compute_merge_paths([processed[1], processed[0]], exact=True)['df']
+    merged = finalize_merged_frame(group.total, group.index_name, group.column_order)
+    pd.testing.assert_frame_equal(merged.reset_index(drop=True), fresh.reset_index(drop=True), check_exact=True)
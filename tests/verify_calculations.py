@@ -1,6 +1,10 @@
 import pandas as pd
 import numpy as np
 
+def to_cents(values):
+    """金额转换为整数分，按分精确比较 (不使用浮点容差)"""
+    return np.rint(np.asarray(values, dtype=float) * 100).astype(np.int64)
+
 def verify_data():
     file_path = 'excels/data_aggregation/全院收入_按科室202501门诊-开单科室_带合并.xlsx'
     print(f"正在验证文件: {file_path}")
@@ -72,26 +76,26 @@ def verify_data():
         for gid in range(1, 8):
             # 获取该组所有明细列的值
             item_indices = group_item_cols.get(gid, [])
-            item_sum = row_data[item_indices].sum()
+            item_sum = int(to_cents(row_data[item_indices]).sum())
             
             # 获取文件中该组的合计值
             sum_col_idx = group_sum_cols.get(gid)
             if sum_col_idx is None:
                 continue
                 
-            file_sum = row_data[sum_col_idx]
+            file_sum = int(to_cents(row_data[sum_col_idx]))
             calculated_group_sums[gid] = file_sum
             
-            # 对比 (容忍浮点误差)
-            if abs(item_sum - file_sum) > 0.01:
-                errors.append(f"行 {row_idx+1} [{dept_name}] 组 {gid} 错误: 明细和={item_sum:.2f}, 文件值={file_sum:.2f}")
+            # 按分精确对比
+            if item_sum != file_sum:
+                errors.append(f"行 {row_idx+1} [{dept_name}] 组 {gid} 错误: 明细和={item_sum / 100:.2f}, 文件值={file_sum / 100:.2f}")
 
         # 2. 验证分组合计之和是否等于总合计
         total_of_groups = sum(calculated_group_sums.values())
-        file_total = row_data[col_total]
+        file_total = int(to_cents(row_data[col_total]))
         
-        if abs(total_of_groups - file_total) > 0.01:
-             errors.append(f"行 {row_idx+1} [{dept_name}] 总合计错误: 分组累加={total_of_groups:.2f}, 文件值={file_total:.2f}")
+        if total_of_groups != file_total:
+             errors.append(f"行 {row_idx+1} [{dept_name}] 总合计错误: 分组累加={total_of_groups / 100:.2f}, 文件值={file_total / 100:.2f}")
 
     if errors:
         print(f"发现 {len(errors)} 个错误：")
@@ -3,6 +3,10 @@ import os
 import glob
 import numpy as np
 
+def to_cents(values):
+    """金额转换为整数分，按分精确比较 (不使用浮点容差)"""
+    return np.rint(np.asarray(values, dtype=float) * 100).astype(np.int64)
+
 def verify_merge():
     # 动态寻找最新的合并文件
     merged_files = glob.glob('excels/merged/全院收入_*.xlsx')
@@ -57,20 +61,20 @@ def verify_merge():
     print(f"\n--- 总额验证 ---")
     total_source_sum = 0
     for i, df in enumerate(source_dfs):
-        s_sum = df.select_dtypes(include=[np.number]).values.sum()
+        s_sum = int(to_cents(df.select_dtypes(include=[np.number]).values).sum())
         total_source_sum += s_sum
-        # print(f"源文件 {i+1} 总额: {s_sum:,.2f}")
+        # print(f"源文件 {i+1} 总额: {s_sum / 100:,.2f}")
 
-    merged_sum = df_merged.select_dtypes(include=[np.number]).values.sum()
+    merged_sum = int(to_cents(df_merged.select_dtypes(include=[np.number]).values).sum())
     
-    print(f"所有源文件总额: {total_source_sum:,.2f}")
-    print(f"合并文件总额:   {merged_sum:,.2f}")
+    print(f"所有源文件总额: {total_source_sum / 100:,.2f}")
+    print(f"合并文件总额:   {merged_sum / 100:,.2f}")
     
-    diff = abs(total_source_sum - merged_sum)
-    if diff < 1.0:
-        print("结果: 准确 (误差在允许范围内)")
+    diff = total_source_sum - merged_sum
+    if diff == 0:
+        print("结果: 准确 (按分完全一致)")
     else:
-        print(f"结果: 不匹配！差额: {diff:,.2f}")
+        print(f"结果: 不匹配！差额: {diff / 100:,.2f}")
 
     # 2. 抽样验证
     print(f"\n--- 抽样验证 ---")
@@ -93,18 +97,18 @@ def verify_merge():
             calculated_sum = 0
             for df in source_dfs:
                 if test_dept in df.index and test_col in df.columns:
-                    calculated_sum += df.loc[test_dept, test_col]
+                    calculated_sum += int(to_cents(df.loc[test_dept, test_col]).sum())
             
             # 获取合并文件在该坐标的值
             if test_dept in df_merged.index and test_col in df_merged.columns:
-                merged_val = df_merged.loc[test_dept, test_col]
+                merged_val = int(to_cents(df_merged.loc[test_dept, test_col]).sum())
             else:
                 merged_val = 0
                 
-            print(f"源文件累加值: {calculated_sum:,.2f}")
-            print(f"合并文件值:   {merged_val:,.2f}")
+            print(f"源文件累加值: {calculated_sum / 100:,.2f}")
+            print(f"合并文件值:   {merged_val / 100:,.2f}")
             
-            if abs(calculated_sum - merged_val) < 0.01:
+            if calculated_sum == merged_val:
                 print("结果: 准确")
             else:
                 print("结果: 错误！")